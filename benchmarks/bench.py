@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+'''
+Benchmark suite for jc.
+
+Times parsing and evaluation, long scripts, base conversion of huge
+integers, completion lookups, evaluator construction and (via startup.py)
+process startup. Times are normalized by a fixed pure Python workload so
+that results from different machines are comparable. Prints the results
+as JSON and, given a baseline, exits with status 1 on regression.
+
+Usage: python benchmarks/bench.py [--quick] [--only NAME [NAME ...]] [--no-startup]
+                                  [--baseline FILE] [--save FILE]
+'''
+
+from __future__ import print_function
+
+import argparse
+import ast
+import json
+import os
+import sys
+import timeit
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+
+import jc
+import startup
+
+default_baseline = os.path.join(root, 'benchmarks', 'baseline.json')
+
+# allowed slowdown relative to the baseline before a result counts as a regression
+tolerance = 0.25
+
+expressions = [
+    '1 + 2 * 3 - 4 / 5',
+    '(((2 ** 32) / 1024) * 12) % 52 + 9 - 5',
+    'sqrt(x) * 2 + sin(pi / 4) ** 2',
+    'x * x + 2 * x * y + y * y',
+    'fact(20) // fact(18) + gcd(12, 18)',
+    '0xff & ~0x0f | 1 << 4 ^ 0b1010',
+]
+
+
+def calibrate():
+    ''' Workload used to normalize times across machines. '''
+    return sum(i * i for i in range(10000))
+
+
+def parse_eval():
+    e = jc.Evaluator(completer=None)
+    e.eval('x = 3; y = 4')
+    def run():
+        for expr in expressions:
+            e._eval_op(ast.parse(expr, mode='eval').body)
+    return run
+
+
+def eval_cached():
+    e = jc.Evaluator(completer=None)
+    e.eval('x = 3; y = 4')
+    def run():
+        for expr in expressions:
+            e.eval(expr)
+    return run
+
+
+def eval_script():
+    e = jc.Evaluator(completer=None)
+    script = ';'.join(['a = 1'] + ['a = a + %d; a * 2' % i for i in range(2500)])
+    return lambda: e.eval(script)
+
+
+def convert_base(base):
+    def setup():
+        e = jc.Evaluator(completer=None, base=base)
+        value = 3 ** 200000
+        def run():
+            # base 10 results are integers, converted when they are written out
+            result = e._convert_result_base(value)
+            if not isinstance(result, str):
+                result = jc.radix.to_base(result, 10)
+            return result
+        return run
+    return setup
+
+
+def complete():
+    c = jc.Completer(['v%05d' % i for i in range(10000)] + list(jc.Evaluator.functions),
+                     history=False)
+    prefixes = ['v0', 'v09', 'v0999', 's', 'lo', 'x']
+    def run():
+        for prefix in prefixes:
+            c._matches = (None, [])
+            state = 0
+            while c.complete(prefix, state) is not None:
+                state += 1
+    return run
+
+
+def construct():
+    return lambda: jc.Evaluator()
+
+
+benchmarks = [
+    ('parse_eval', parse_eval),
+    ('eval_cached', eval_cached),
+    ('eval_script', eval_script),
+    ('convert_base_10', convert_base(10)),
+    ('convert_base_16', convert_base(16)),
+    ('convert_base_7', convert_base(7)),
+    ('complete', complete),
+    ('construct', construct),
+]
+
+
+def measure(func, repeat):
+    ''' Return the best time per call of func in microseconds. '''
+    timer = timeit.Timer(func)
+    number, total = timer.autorange()
+    return min([total] + timer.repeat(repeat - 1, number)) / number * 1e6
+
+
+def run(names, repeat):
+    results = {}
+    calibrations = []
+    for name, setup in benchmarks:
+        if names and name not in names:
+            continue
+        try:
+            func = setup()
+        except ImportError as error:
+            # e.g. readline is not available on this platform
+            print('skipping %s: %s' % (name, error), file=sys.stderr)
+            continue
+        # calibrate next to each benchmark to follow changes in machine load
+        calibration = measure(calibrate, repeat)
+        us = measure(func, repeat)
+        calibrations.append(calibration)
+        results[name] = {'us': round(us, 3), 'normalized': round(us / calibration, 4)}
+    return {'calibration_us': round(min(calibrations or [0]), 3), 'benchmarks': results}
+
+
+def compare(results, baseline):
+    ''' Return a list of regressions of results relative to baseline. '''
+    regressions = []
+    for name, result in sorted(results['benchmarks'].items()):
+        if name not in baseline.get('benchmarks', {}):
+            continue
+        expected = baseline['benchmarks'][name]['normalized']
+        if result['normalized'] > expected * (1 + tolerance):
+            regressions.append('%s: %s > %s' % (name, result['normalized'], expected))
+    if 'startup' in results and 'startup' in baseline:
+        regressions.extend(startup.compare(results['startup'], baseline['startup']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='jc benchmark suite')
+    parser.add_argument('--quick', action='store_true', help='fewer repetitions')
+    parser.add_argument('--only', nargs='+', metavar='NAME',
+                        help='run only the named benchmarks (%s)'
+                        % ', '.join(name for name, _ in benchmarks))
+    parser.add_argument('--no-startup', action='store_true', help='skip the process startup benchmark')
+    parser.add_argument('--baseline', default=default_baseline)
+    parser.add_argument('--save', help='write the results as the new baseline to SAVE')
+    args = parser.parse_args()
+
+    repeat = 3 if args.quick else 7
+    results = run(args.only, repeat)
+    if not args.no_startup and not args.only:
+        results['startup'] = startup.run(5 if args.quick else 20)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        for regression in regressions:
+            print('REGRESSION: %s' % regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+'''
+Startup benchmark for one-shot jc invocations.
+
+Measures the wall clock time of `jc 'expr'` against a bare interpreter
+start, and the import time of jc.cli (python -X importtime). Prints the
+results as JSON and, given a baseline, exits with status 1 on regression.
+
+Usage: python benchmarks/startup.py [--runs N] [--baseline FILE] [--save FILE]
+'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_baseline = os.path.join(root, 'benchmarks', 'startup_baseline.json')
+
+# allowed slowdown relative to the baseline before a result counts as a regression
+tolerance = 0.25
+
+
+def environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root
+    # measure with bytecode caching, as in an installed package
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env.pop('JC_PROFILE', None)
+    return env
+
+
+def wall_clock(args, runs):
+    ''' Return the median wall clock time of running args in milliseconds. '''
+    env = environment()
+    subprocess.check_call(args, env=env, stdout=subprocess.DEVNULL)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call(args, env=env, stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def import_time(module, runs):
+    ''' Return the median cumulative import time of module in milliseconds. '''
+    times = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+            env=environment(), stderr=subprocess.STDOUT, universal_newlines=True)
+        for line in output.splitlines():
+            fields = [field.strip() for field in line.split('|')]
+            if len(fields) == 3 and fields[2] == module:
+                times.append(int(fields[1]) / 1000.)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def loaded_modules(args):
+    ''' Return the modules loaded by a single calculation. '''
+    code = ('import sys; sys.argv = %r; import jc.cli; jc.cli.main(); '
+            'sys.stderr.write(" ".join(sorted(sys.modules)))' % (['jc'] + args))
+    output = subprocess.check_output([sys.executable, '-c', code], env=environment(),
+                                     stderr=subprocess.STDOUT, universal_newlines=True)
+    return output.split()
+
+
+def run(runs):
+    python_ms = wall_clock([sys.executable, '-c', 'pass'], runs)
+    jc_ms = wall_clock([sys.executable, '-m', 'jc.cli', '2 ** 10 + sqrt(16)'], runs)
+    modules = loaded_modules(['2 ** 10 + sqrt(16)'])
+    return {
+        'python_startup_ms': round(python_ms, 3),
+        'jc_startup_ms': round(jc_ms, 3),
+        'jc_overhead_ms': round(jc_ms - python_ms, 3),
+        'jc_startup_ratio': round(jc_ms / python_ms, 3),
+        'import_jc_cli_ms': round(import_time('jc.cli', runs), 3),
+        'readline_imported': 'readline' in modules,
+    }
+
+
+def compare(results, baseline):
+    ''' Return a list of regressions of results relative to baseline. '''
+    regressions = []
+    # the ratio to a bare interpreter start is comparable across machines
+    if results['jc_startup_ratio'] > baseline['jc_startup_ratio'] * (1 + tolerance):
+        regressions.append('jc_startup_ratio: %s > %s' % (
+            results['jc_startup_ratio'], baseline['jc_startup_ratio']))
+    if results['readline_imported'] and not baseline['readline_imported']:
+        regressions.append('readline_imported: readline is imported in single calculation mode')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='jc startup benchmark')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--baseline', default=default_baseline)
+    parser.add_argument('--save', help='write the results as the new baseline to SAVE')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        for regression in regressions:
+            print('REGRESSION: %s' % regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
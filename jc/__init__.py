@@ -1,4 +1,8 @@
 __version__ = '1.2'
 
+from .budget import *
+from .cache import *
 from .completer import *
 from .evaluator import *
+from .expression import *
+from .profiler import *
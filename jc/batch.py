@@ -0,0 +1,116 @@
+'''
+Parallel batch evaluation.
+
+Shards independent input lines across a pool of worker processes and
+evaluates them in chunks. Lines that depend on session state (variable
+assignments, ans, user variables or functions with side effects) are
+evaluated sequentially in the calling process, in input order.
+'''
+
+import itertools
+import multiprocessing
+import re
+
+from .evaluator import Evaluator, split_exprs
+
+
+name_re = re.compile(r'\b[A-Za-z_]\w*')
+
+worker_evaluator = None
+
+
+def is_independent(evaluator, line):
+    ''' Check if a line can be evaluated without access to session state. '''
+    if '=' in line:
+        return False
+    for expr in split_exprs(line):
+        expr = expr.strip()
+        if expr.startswith('#'):
+            return False
+        if expr and expr[0] in evaluator.symbols and not (expr[0] in '+-' and expr[1:2] != ' '):
+            return False
+    for name in name_re.findall(line):
+        if name not in evaluator.constants and not (
+                name in evaluator.functions and evaluator._is_pure_func(name)):
+            return False
+    return True
+
+
+def init_worker(budget):
+    global worker_evaluator
+    worker_evaluator = Evaluator(completer=None, budget=budget)
+
+
+def eval_chunk(lines):
+    ''' Evaluate independent lines in a worker, return (raw results, error) per line. '''
+    e = worker_evaluator
+    evaluated = []
+    for line in lines:
+        results = []
+        error = None
+        try:
+            for expr in split_exprs(line):
+                expr = expr.strip()
+                if not expr or expr.startswith('#'):
+                    continue
+                if e.budget is not None:
+                    e.budget.start()
+                result = e._compile(expr, syntax_error='invalid syntax')(e.variables)
+                if result is not None:
+                    results.append(result)
+        except Exception as err:
+            error = err
+        evaluated.append((results, error))
+    return evaluated
+
+
+def eval_lines(evaluator, lines, jobs, chunk_size=256):
+    '''
+    Evaluate lines on a pool of jobs worker processes.
+
+    Yields a (results, error) tuple per input line in input order, where
+    results are the line's (possibly partial) results and error is the
+    exception that stopped the line or None.
+    '''
+    pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=(evaluator.budget,))
+    try:
+        lines = iter(lines)
+        while True:
+            window = list(itertools.islice(lines, chunk_size * jobs * 4))
+            if not window:
+                break
+
+            blocks = []
+            for independent, group in itertools.groupby(
+                    window, lambda line: is_independent(evaluator, line)):
+                group = list(group)
+                if not independent:
+                    blocks.extend(('local', line) for line in group)
+                    continue
+                for i in range(0, len(group), chunk_size):
+                    chunk = group[i:i + chunk_size]
+                    blocks.append(('remote', pool.apply_async(eval_chunk, (chunk,))))
+
+            for kind, block in blocks:
+                if kind == 'local':
+                    results = []
+                    try:
+                        for result in evaluator.iter_eval(block):
+                            results.append(result)
+                    except Exception as error:
+                        yield results, error
+                    else:
+                        yield results, None
+                    continue
+
+                for raw_results, error in block.get():
+                    results = []
+                    try:
+                        for result in raw_results:
+                            evaluator.ans = result
+                            results.append(evaluator._convert_result_base(result))
+                    except Exception as conversion_error:
+                        error = conversion_error
+                    yield results, error
+    finally:
+        pool.terminate()
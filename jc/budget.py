@@ -0,0 +1,172 @@
+'''
+Evaluation budgets.
+
+Estimates the result size and cost of big-integer operations before they
+run, and rejects operations that would exceed the configured budgets.
+'''
+
+import math
+import operator
+import time
+
+
+class BudgetError(Exception):
+    pass
+
+
+# seconds per multiplication of two 128-bit halves, scaled by Karatsuba's exponent
+mul_seconds = 2.5e-8
+mul_exponent = 1.585
+
+
+def is_int(x):
+    return isinstance(x, int) and not isinstance(x, bool)
+
+
+def estimate_seconds(bits, work):
+    ''' Roughly estimate the time to produce a result of bits bits. '''
+    if not work or bits < 4096:
+        return 0
+    return work * mul_seconds * (bits / 128.) ** mul_exponent
+
+
+def mul_cost(a, b):
+    if not is_int(a) or not is_int(b):
+        return 0, 0
+    return a.bit_length() + b.bit_length(), 1
+
+
+def pow_cost(a, b):
+    if not is_int(a) or not is_int(b) or b < 0 or abs(a) <= 1:
+        return 0, 0
+    try:
+        return int(b * math.log(abs(a), 2)) + 1, 1.5
+    except OverflowError:
+        return float('inf'), 1.5
+
+
+def lshift_cost(a, b):
+    if not is_int(a) or not is_int(b) or b < 0:
+        return 0, 0
+    return abs(a).bit_length() + b, 0
+
+
+def factorial_cost(n):
+    if not is_int(n) or n < 2:
+        return 0, 0
+    # Stirling's approximation of log2(n!)
+    return int(n * math.log(n / math.e, 2) + 0.5 * math.log(2 * math.pi * n, 2)) + 1, 3
+
+
+def binom_cost(n, k):
+    if not is_int(n) or not is_int(k) or k < 0 or k > n:
+        return 0, 0
+    # log2 of n! / (k! (n - k)!)
+    return int((math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)) / math.log(2)) + 1, 3
+
+
+def fib_cost(n):
+    if not is_int(n):
+        return 0, 0
+    # F(n) grows as phi ** n
+    return int(abs(n) * 0.6943) + 1, 3
+
+
+def powmod_cost(a, b, m):
+    if not is_int(a) or not is_int(b) or not is_int(m):
+        return 0, 0
+    # a squaring and a reduction modulo m per bit of the exponent
+    return abs(m).bit_length(), 2 * abs(b).bit_length()
+
+
+def isprime_cost(n):
+    if not is_int(n):
+        return 0, 0
+    # at most 13 Miller-Rabin rounds or a Lucas test, each a modular exponentiation
+    return n.bit_length(), 13 * n.bit_length()
+
+
+def prod_cost(terms, poly, a, b):
+    if poly is None or b < a:
+        return 0, 0
+    if len(poly) == 1 and is_int(poly[0]) and abs(poly[0]) > 1:
+        return int((b - a + 1) * math.log(abs(poly[0]), 2)) + 1, 1.5
+    if poly == [0, 1]:
+        # the product of the index is a ratio of factorials
+        return factorial_cost(max(abs(a), abs(b)))
+    return 0, 0
+
+
+def ackermann_cost(m, n):
+    if m < 3 or n < 0:
+        return 0, 0
+    elif m == 3:
+        return n + 3, 1
+    elif m == 4 and n < 2:
+        return 16, 0
+    elif m == 4 and n == 2 or m == 5 and n == 0:
+        return 65536, 1
+    return float('inf'), 1
+
+
+op_costs = {
+    operator.mul:    mul_cost,
+    operator.pow:    pow_cost,
+    operator.lshift: lshift_cost,
+}
+
+
+class Budget(object):
+    '''
+    Evaluation budget.
+
+    Limits the estimated size of big-integer results (max_bits), the
+    estimated memory needed to compute them (max_memory, in bytes) and the
+    time spent on a single statement (max_time, in seconds). Operations are
+    checked before they run, so over-budget operations are rejected with a
+    BudgetError instead of tying up the evaluator.
+    '''
+
+    def __init__(self, max_bits=None, max_memory=None, max_time=None):
+        self.max_bits = max_bits
+        self.max_memory = max_memory
+        self.max_time = max_time
+        self.deadline = None
+
+    def start(self):
+        ''' Start the time budget of a new statement. '''
+        if self.max_time is not None:
+            self.deadline = time.time() + self.max_time
+
+    def check(self, bits, work):
+        ''' Check that an operation producing bits bits with work factor work fits the budget. '''
+        if self.max_bits is not None and bits > self.max_bits:
+            raise BudgetError('result would have about %s bits (limit: %d)'
+                              % (format_size(bits), self.max_bits))
+        memory = 3 * bits / 8.
+        if self.max_memory is not None and memory > self.max_memory:
+            raise BudgetError('operation would need about %s bytes of memory (limit: %d)'
+                              % (format_size(memory), self.max_memory))
+        if self.deadline is not None:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                raise BudgetError('time limit of %g seconds exceeded' % self.max_time)
+            seconds = estimate_seconds(bits, work)
+            if seconds > remaining:
+                raise BudgetError('operation would take about %s seconds (limit: %g)'
+                                  % (format_size(seconds), self.max_time))
+
+    def guard(self, func, cost):
+        ''' Wrap func so that calls are checked against the budget first. '''
+        def guarded(*args):
+            self.check(*cost(*args))
+            return func(*args)
+        return guarded
+
+
+def format_size(size):
+    if size == float('inf'):
+        return 'infinitely many'
+    if size >= 1e6:
+        return '%.3g' % size
+    return '%d' % size if size >= 1 else '%.2g' % size
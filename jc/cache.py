@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''
+    Bounded least-recently-used cache.
+
+    Keeps at most maxsize entries, evicting the least recently used entries
+    when full. If maxbytes is given, the cache is also size-aware: sizeof(key,
+    value) gives the size of an entry in bytes and entries are evicted until
+    their total size is at most maxbytes. Hits and misses are counted for
+    inspection.
+    '''
+
+    def __init__(self, maxsize=1024, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        ''' Return the cached value for key and mark it as recently used. '''
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        ''' Cache value for key, evicting the least recently used entries if full. '''
+        self.discard(key)
+        size = 0
+        if self.maxbytes is not None:
+            size = self.sizeof(key, value)
+            if size > self.maxbytes:
+                return
+            self._sizes[key] = size
+            self.nbytes += size
+        self._data[key] = value
+        while len(self._data) > self.maxsize or (
+                self.maxbytes is not None and self.nbytes > self.maxbytes):
+            self.discard(next(iter(self._data)))
+
+    def discard(self, key):
+        ''' Remove key from the cache if present. '''
+        if key in self._data:
+            del self._data[key]
+            self.nbytes -= self._sizes.pop(key, 0)
+
+    def clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        ''' Return cache statistics as a dict. '''
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize,
+                'bytes': self.nbytes, 'maxbytes': self.maxbytes}
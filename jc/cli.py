@@ -1,8 +1,9 @@
 from __future__ import print_function
 
+import atexit
+import itertools
 import os
 import sys
-import traceback
 
 import jc
 
@@ -11,46 +12,275 @@ if sys.version_info < (3, 0, 0):
 
 debug = os.environ.get('JC_DEBUG', False) == '1'
 
+# set by main when profiling is enabled
+profiler = None
+
+usage = '''usage: jc [options] [expression[; ...]]
+
+options:
+  -f, --file FILE
+                run the script FILE, then the expression if one is given
+  --keep-going  in piped mode, report errors per line and continue
+  --jsonl       in piped mode, evaluate JSON records with ids and variables
+  --map EXPR    evaluate EXPR for each piped value, bound to x
+  --jobs N      in piped mode, evaluate independent lines on N processes
+  --max-bits N  reject operations with results larger than N bits
+  --max-memory N
+                reject operations needing more than N bytes of memory
+  --timeout N   limit the time spent on a single statement to N seconds
+  --serve       run a daemon that evaluates expressions for other jc calls
+  --session NAME
+                evaluate in a named daemon session, keeping its variables
+  --socket PATH
+                daemon socket path (default: $JC_SOCKET or a per-user path)
+  --profile FILE
+                record profiling statistics and write them to FILE as JSON
+                at exit ('-' for stderr, same as setting JC_PROFILE)
+  --load FILE   start with the session (variables, formulas, ans and base)
+                saved in FILE
+  --save FILE   save the session to FILE at exit
+  --            end of options'''
+
+options = {
+    '-f':           ('file', str),
+    '--file':       ('file', str),
+    '--keep-going': ('keep_going', None),
+    '--jsonl':      ('jsonl', None),
+    '--map':        ('map', str),
+    '--jobs':       ('jobs', int),
+    '--max-bits':   ('max_bits', int),
+    '--max-memory': ('max_memory', int),
+    '--timeout':    ('timeout', float),
+    '--serve':      ('serve', None),
+    '--session':    ('session', str),
+    '--socket':     ('socket', str),
+    '--profile':    ('profile', str),
+    '--load':       ('load', str),
+    '--save':       ('save', str),
+}
+
+def parse_args(args):
+    ''' Split leading command line options from the expression. '''
+    opts = dict((key, False if convert is None else None)
+                for key, convert in options.values())
+    args = list(args)
+    while args and args[0].startswith('-'):
+        arg = args.pop(0)
+        if arg == '--':
+            break
+        if arg in ('-h', '--help'):
+            print(usage)
+            sys.exit(0)
+        name, has_value, value = arg.partition('=')
+        if name not in options:
+            if name.startswith('--') and name[2:3].isalpha():
+                handle_error('unknown option \'%s\'' % name)
+            args.insert(0, arg)
+            break
+        key, convert = options[name]
+        if convert is None:
+            if has_value:
+                handle_error('option \'%s\' does not take a value' % name)
+            opts[key] = True
+            continue
+        if not has_value:
+            if not args:
+                handle_error('option \'%s\' requires a value' % name)
+            value = args.pop(0)
+        try:
+            opts[key] = convert(value)
+        except ValueError:
+            handle_error('invalid value \'%s\' for option \'%s\'' % (value, name))
+    return opts, args
+
 def handle_error(error, exit_on_error=True):
     print('ERROR: %s' % error, file=sys.stderr)
     if debug:
+        import traceback
         traceback.print_exc()
     if exit_on_error:
         sys.exit(1)
 
-def single_calc(e):
+def print_result(result):
+    if profiler is not None:
+        with profiler.stage('print'):
+            write_result(result)
+    else:
+        write_result(result)
+
+def write_result(result):
+    # large integers are written out in chunks as they are converted
+    if (isinstance(result, int) and not isinstance(result, bool)
+            and result.bit_length() > jc.radix.large_bits):
+        for chunk in jc.radix.iter_digits(result, 10):
+            sys.stdout.write(chunk)
+        sys.stdout.write('\n')
+    else:
+        print(result)
+
+def save_session(e, path):
+    try:
+        e.save_session(path)
+    except (IOError, OSError, ValueError) as error:
+        handle_error('failed to save session to %s: %s' % (path, error), exit_on_error=False)
+
+def single_calc(e, expr):
     # single calculation mode
     try:
-        results = e.eval(''.join(sys.argv[1:]))
+        results = e.eval(expr)
         for result in results:
-            print(result)
+            print_result(result)
     except Exception as error:
         handle_error(error)
 
+def forward_calc(expr, session=None, path=None):
+    # forwards a single calculation to a running daemon, returns False if there is none
+    from jc import server
+    sock = server.connect(path)
+    if sock is None:
+        if session is not None:
+            handle_error('no jc daemon is running at %s' % (path or server.socket_path()))
+        return False
+    try:
+        response = server.request(sock, {'expr': expr, 'session': session})
+    except (IOError, OSError, ValueError) as error:
+        if session is not None:
+            handle_error('lost connection to jc daemon: %s' % error)
+        return False
+    finally:
+        sock.close()
+    sys.stdout.write(response.get('output', ''))
+    if response.get('error') is not None:
+        handle_error(response['error'])
+    return True
+
+def serve_calc(e, path=None):
+    # daemon mode, serves evaluations over a Unix domain socket
+    from jc import server
+    try:
+        server.serve(e, path)
+    except (RuntimeError, IOError, OSError) as error:
+        handle_error(error)
+
 def interactive_calc(e):
-    # interactive mode
+    # interactive mode, the completer binds readline before the first prompt
+    completer = e.completer
     while True:
         try:
             expr = input('> ')
             while expr.rstrip().endswith('\\'):
                 expr = ''.join(expr.rsplit('\\')[:1]).rstrip()
                 expr += input('>> ')
+            if completer is not None:
+                completer.save_history()
             results = e.eval(expr)
             for result in results:
-                print(result)
+                print_result(result)
         except (KeyboardInterrupt, EOFError):
             print()
             sys.exit()
         except Exception as error:
             handle_error(error, exit_on_error=False)
 
-def piped_calc(e):
-    # piped mode
+def piped_calc(e, keep_going=False):
+    # piped mode, evaluates and prints line by line as input arrives
+    failed = False
     try:
-        expr = ';'.join(sys.stdin.readlines())
-        results = e.eval(expr)
-        for result in results:
-            print(result)
+        for lineno, line in enumerate(iter(sys.stdin.readline, ''), 1):
+            try:
+                for result in e.iter_eval(line):
+                    print_result(result)
+            except Exception as error:
+                sys.stdout.flush()
+                if not keep_going:
+                    handle_error(error)
+                handle_error('line %d: %s' % (lineno, error), exit_on_error=False)
+                failed = True
+            sys.stdout.flush()
+    except (KeyboardInterrupt, EOFError):
+        print()
+        sys.exit(0)
+    if failed:
+        sys.exit(1)
+
+def script_calc(e, path, keep_going=False):
+    # script mode, runs a script file parsed once and cached by content
+    from jc import script
+    try:
+        lines = script.load(e, path)
+    except (IOError, OSError, UnicodeDecodeError) as error:
+        handle_error('failed to read script %s: %s' % (path, error))
+    failed = False
+    for lineno, statements in lines:
+        try:
+            for result in script.iter_eval(e, statements):
+                print_result(result)
+        except Exception as error:
+            sys.stdout.flush()
+            handle_error('%s:%d: %s' % (path, lineno, error), exit_on_error=not keep_going)
+            failed = True
+    sys.stdout.flush()
+    if failed:
+        sys.exit(1)
+
+def parallel_calc(e, jobs, keep_going=False):
+    # parallel piped mode, evaluates independent lines on a process pool
+    from jc import batch
+    failed = False
+    evaluated = batch.eval_lines(e, sys.stdin, jobs)
+    try:
+        for lineno, (results, error) in enumerate(evaluated, 1):
+            for result in results:
+                print_result(result)
+            if error is not None:
+                sys.stdout.flush()
+                if not keep_going:
+                    handle_error(error)
+                handle_error('line %d: %s' % (lineno, error), exit_on_error=False)
+                failed = True
+    except (KeyboardInterrupt, EOFError):
+        print()
+        sys.exit(0)
+    finally:
+        evaluated.close()
+    if failed:
+        sys.exit(1)
+
+def jsonl_calc(e):
+    # JSON lines mode, evaluates records independently and reports errors per record
+    from jc import jsonl
+    try:
+        failed = jsonl.eval_lines(e, iter(sys.stdin.readline, ''), sys.stdout)
+    except (KeyboardInterrupt, EOFError):
+        print()
+        sys.exit(0)
+    if failed:
+        sys.exit(1)
+
+def parse_number(text):
+    ''' Parse a number literal (e.g. 10, 0x1f or 1.5e3). '''
+    text = text.strip()
+    try:
+        return int(text, 0)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError('invalid number \'%s\'' % text)
+
+def map_calc(e, expr, chunk_size=65536):
+    # vectorized mode, evaluates expr over chunks of piped values bound to x
+    lines = iter(sys.stdin.readline, '')
+    try:
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                break
+            column = [parse_number(line) for line in chunk if line.strip()]
+            for result in e.map(expr, column):
+                print_result(e._convert_result_base(result))
+            sys.stdout.flush()
     except (KeyboardInterrupt, EOFError):
         print()
         sys.exit(0)
@@ -58,14 +288,67 @@ def piped_calc(e):
         handle_error(error)
 
 def main():
-    e = jc.Evaluator()
+    opts, args = parse_args(sys.argv[1:])
+
+    budget = None
+    if opts['max_bits'] or opts['max_memory'] or opts['timeout']:
+        budget = jc.Budget(max_bits=opts['max_bits'], max_memory=opts['max_memory'],
+                           max_time=opts['timeout'])
+
+    # JC_PROFILE=1 writes the statistics to stderr, 0 disables profiling, any other value is a file path
+    profile = opts['profile']
+    if profile is None and os.environ.get('JC_PROFILE', '') not in ('', '0'):
+        profile = os.environ['JC_PROFILE']
+    if profile:
+        global profiler
+        profiler = jc.Profiler()
+        atexit.register(profiler.dump, None if profile in ('1', '-') else profile)
+
+    # single calculations go to a running daemon, unless they set their own budget or session
+    local_options = [name for name, given in (
+        ('--serve', opts['serve']), ('--map', opts['map']), ('--file', opts['file']),
+        ('--max-bits', opts['max_bits']), ('--max-memory', opts['max_memory']),
+        ('--timeout', opts['timeout']), ('--profile', profiler is not None),
+        ('--load', opts['load']), ('--save', opts['save'])) if given]
+    if args and not local_options:
+        if forward_calc(''.join(args), opts['session'], opts['socket']):
+            return
+    elif opts['session'] is not None:
+        if local_options:
+            handle_error('option \'--session\' cannot be combined with %s' % ', '.join(local_options))
+        handle_error('option \'--session\' requires an expression')
+
+    # readline bindings and history are only set up in interactive mode
+    interactive = (not opts['serve'] and not opts['map'] and not opts['file'] and not args and
+                   sys.stdin.isatty())
+    completer = jc.Completer if interactive else None
+    e = jc.Evaluator(budget=budget, completer=completer, profiler=profiler)
+    if opts['load']:
+        try:
+            e.load_session(opts['load'])
+        except Exception as error:
+            handle_error('failed to load session from %s: %s' % (opts['load'], error))
+    if opts['save']:
+        atexit.register(save_session, e, opts['save'])
 
-    if len(sys.argv) > 1:
-        single_calc(e)
-    elif sys.stdin.isatty():
+    if opts['serve']:
+        serve_calc(e, opts['socket'])
+    elif opts['map']:
+        map_calc(e, opts['map'])
+    elif opts['file']:
+        script_calc(e, opts['file'], keep_going=opts['keep_going'])
+        if args:
+            single_calc(e, ''.join(args))
+    elif args:
+        single_calc(e, ''.join(args))
+    elif interactive:
         interactive_calc(e)
+    elif opts['jsonl']:
+        jsonl_calc(e)
+    elif opts['jobs'] is not None and opts['jobs'] > 1:
+        parallel_calc(e, opts['jobs'], keep_going=opts['keep_going'])
     else:
-        piped_calc(e)
+        piped_calc(e, keep_going=opts['keep_going'])
 
 
 if __name__ == '__main__':
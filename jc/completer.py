@@ -1,6 +1,6 @@
 import atexit
+import bisect
 import os
-import readline
 import sys
 
 
@@ -9,15 +9,26 @@ class Completer(object):
     Readline completer.
 
     Provides readline bindings, tab-completion and history for calculations.
+
+    Completion candidates are kept in a sorted, deduplicated index, so a
+    prefix lookup takes O(log n + k) for k matches. The matches for a prefix
+    are computed once and reused while readline cycles through them.
     '''
 
-    def __init__(self, content=[], history=True,
+    def __init__(self, content=(), history=True,
                  history_file=os.path.expanduser("~/.jc_history"),
                  history_len=1000):
 
-        self.content = content
+        # readline is imported here rather than at module level to keep it
+        # out of the startup path of non-interactive modes
+        import readline
+
+        self.content = sorted(set(content))
+        self._matches = (None, [])
+        self.history_file = None
+        self._saved_history_len = 0
         readline.parse_and_bind('tab: complete')
-        readline.set_completer(self._init_completer())
+        readline.set_completer(self.complete)
 
         if history:
             try:
@@ -30,18 +41,105 @@ class Completer(object):
                 self._init_history(history_file, history_len)
 
     def add_content(self, content):
-        self.content.append(content)
+        ''' Add a completion candidate. '''
+        i = bisect.bisect_left(self.content, content)
+        if i == len(self.content) or self.content[i] != content:
+            self.content.insert(i, content)
+            self._matches = (None, [])
+
+    def remove_content(self, content):
+        ''' Remove a completion candidate. '''
+        i = bisect.bisect_left(self.content, content)
+        if i < len(self.content) and self.content[i] == content:
+            del self.content[i]
+            self._matches = (None, [])
+
+    def matches(self, text):
+        ''' Return the completion candidates starting with text. '''
+        cached_text, matches = self._matches
+        if cached_text != text:
+            matches = []
+            for i in range(bisect.bisect_left(self.content, text), len(self.content)):
+                if not self.content[i].startswith(text):
+                    break
+                matches.append(self.content[i])
+            self._matches = (text, matches)
+        return matches
+
+    def complete(self, text, state):
+        ''' Readline completion function, return the state-th match for text. '''
+        matches = self.matches(text)
+        if state < len(matches):
+            return matches[state]
+        return None
+
+    def save_history(self):
+        ''' Append history entries added since the last save to the history file. '''
+        if self.history_file is None:
+            return
+        import readline
+        history_len = readline.get_current_history_length()
+        if history_len <= self._saved_history_len:
+            return
+        lines = [readline.get_history_item(i) or ''
+                 for i in range(self._saved_history_len + 1, history_len + 1)]
+        try:
+            with open(self.history_file, 'a') as f:
+                f.write(''.join(line + '\n' for line in lines))
+        except (IOError, OSError):
+            return
+        self._saved_history_len = history_len
 
     def _init_history(self, history_file, history_len):
         ''' Initialize the history file. '''
-        readline.read_history_file(history_file)
-        readline.set_history_length(history_len)
-        atexit.register(readline.write_history_file, history_file)
-
-    def _init_completer(self):
-        ''' Initialize a completion provider function. '''
-        def completer(text, state):
-            results = [i for i in self.content if i.startswith(text)] + [None]
-            return results[state]
-        return completer
+        import readline
+        lines, total = read_tail(history_file, 2 * history_len)
+        if total > 2 * history_len:
+            lines = lines[-history_len:]
+            compact_history(history_file, lines)
+        readline.clear_history()
+        for line in lines[-history_len:]:
+            readline.add_history(line)
+        self.history_file = history_file
+        self._saved_history_len = readline.get_current_history_length()
+        atexit.register(self.save_history)
+
+
+def read_tail(path, count, block_size=8192):
+    '''
+    Read the last count lines of a text file without reading all of it.
+
+    Returns the lines and the number of lines seen, which is more than count
+    if the file has more than count lines.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b''
+        while pos > 0 and data.count(b'\n') <= count:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = [line for line in data.decode('utf-8', 'replace').splitlines()
+             if line != '_HiStOrY_V2_']
+    total = len(lines)
+    if pos > 0:
+        # the first line may have been cut in the middle
+        lines = lines[1:]
+    return lines[-count:], total
+
+
+def compact_history(path, lines):
+    ''' Atomically replace the history file with the given lines. '''
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp_path)
+        except (IOError, OSError):
+            pass
 
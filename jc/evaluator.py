@@ -10,19 +10,148 @@ Usage: jc.py [expression[; ...]]
 from __future__ import print_function
 
 import ast
+import copy
+import functools
 import math
 import operator
 import re
 import sys
 
+from . import cache
 from . import completer
+from . import optimizer
+from . import parser
+from .profiler import null_stage
+from . import radix
+from . import numtheory
+from . import series
+from .budget import (ackermann_cost, binom_cost, factorial_cost, fib_cost, isprime_cost,
+                     op_costs, powmod_cost, prod_cost)
+from .expression import Expression
 from . import __version__
 
 
+assign_re = re.compile(r'(?P<var>^\w+\s*)\=(?P<val>\s*(.*?)$)')
+formula_re = re.compile(r'^(?P<var>\w+)\s*:=(?P<val>.*)$')
+function_re = re.compile(r'^(?P<memo>@memo\s+)?(?P<name>\w+)\s*\((?P<params>[^()]*)\)\s*=(?P<val>.*)$')
+separator_re = re.compile(r'[();]')
+
+
 class NamespaceError(Exception):
     pass
 
 
+class Formula(object):
+    '''
+    Formula variable (e.g. total := a * b + c).
+
+    Keeps the expression, the names it depends on, the user functions it
+    calls and its last value, which is recomputed on the next read after a
+    dependency has changed.
+    '''
+
+    __slots__ = ('expr', 'compiled', 'deps', 'calls', 'value', 'dirty', 'computing')
+
+    def __init__(self, expr, compiled, deps, calls):
+        self.expr = expr
+        self.compiled = compiled
+        self.deps = deps
+        self.calls = calls
+        self.value = None
+        self.dirty = True
+        self.computing = False
+
+    def copy(self):
+        formula = Formula(self.expr, self.compiled, self.deps, self.calls)
+        formula.value = self.value
+        formula.dirty = self.dirty
+        return formula
+
+
+class UserFunction(object):
+    '''
+    User-defined function (e.g. f(x, y) = x ** 2 + y).
+
+    Keeps the definition, its parsed body (small bodies are inlined at the
+    call site), the free variables and user functions it refers to and the
+    compiled callable, which is compiled once per definition.
+    '''
+
+    __slots__ = ('name', 'params', 'expr', 'memo', 'tree', 'free', 'calls', 'inline', 'call')
+
+    def __init__(self, name, params, expr, memo, tree, free, calls, inline):
+        self.name = name
+        self.params = params
+        self.expr = expr
+        self.memo = memo
+        self.tree = tree
+        self.free = free
+        self.calls = calls
+        self.inline = inline
+        self.call = None
+
+    def copy(self):
+        return UserFunction(self.name, self.params, self.expr, self.memo, self.tree,
+                            self.free, self.calls, self.inline)
+
+    def signature(self):
+        return '%s%s(%s)' % ('@memo ' if self.memo else '', self.name, ', '.join(self.params))
+
+
+def ackermann(m, n):
+    ''' Ackermann function, using closed forms for m < 4 and an explicit stack. '''
+    m, n = numtheory.as_int(m, 'A'), numtheory.as_int(n, 'A')
+    if m < 0 or n < 0:
+        raise ValueError('Ackermann function is not defined for negative values')
+    stack = [m]
+    while stack:
+        m = stack.pop()
+        if m == 0:
+            n = n + 1
+        elif m == 1:
+            n = n + 2
+        elif m == 2:
+            n = 2 * n + 3
+        elif m == 3:
+            n = 2 ** (n + 3) - 3
+        elif n == 0:
+            stack.append(m - 1)
+            n = 1
+        else:
+            stack.append(m - 1)
+            stack.append(m)
+            n = n - 1
+    return n
+
+
+def failing_call(error):
+    ''' Return a function that raises error when called. '''
+    def call(*args):
+        raise error
+    return call
+
+
+def memo_sizeof(key, value):
+    ''' Approximate size of a memoized function call and its result in bytes. '''
+    return sum(sys.getsizeof(arg) for arg in key[1]) + sys.getsizeof(value)
+
+
+def split_exprs(source):
+    ''' Split source into statements on semicolons outside of parentheses. '''
+    depth = 0
+    start = 0
+    for match in separator_re.finditer(source):
+        char = match.group()
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            yield source[start:match.start()]
+            start = match.end()
+    yield source[start:]
+
+
 class Evaluator(object):
     '''
     Expression evaluator.
@@ -32,134 +161,283 @@ class Evaluator(object):
     variable assignments, basic functions, constants and base conversions.
     '''
 
-    def __init__(self, base=10, completer=completer.Completer):
-        self.ans = None
+    __slots__ = ('ans', 'variables', 'formulas', 'user_functions', 'internal_variables', 'budget',
+                 'profiler', '_completer', '_make_completer', '_compiled', '_memo', '_cells',
+                 '_dependents', '_depth')
+
+    # maximum depth of nested user function calls
+    max_depth = 100
+    # user functions with bodies of at most this many nodes are inlined
+    inline_size = 32
 
-        self.operators = {
-            ast.Add:      {'op': operator.add,      'symbol': '+'},
-            ast.Sub:      {'op': operator.sub,      'symbol': '-'},
-            ast.Mult:     {'op': operator.mul,      'symbol': '*'},
-            ast.Div:      {'op': operator.truediv,  'symbol': '/'},
-            ast.FloorDiv: {'op': operator.floordiv, 'symbol': '//'},
-            ast.Mod:      {'op': operator.mod,      'symbol': '%'},
-            ast.Pow:      {'op': operator.pow,      'symbol': '**'},
-            ast.BitAnd:   {'op': operator.iand,     'symbol': '&'},
-            ast.BitOr:    {'op': operator.ior,      'symbol': '|'},
-            ast.BitXor:   {'op': operator.ixor,     'symbol': '^'},
-            ast.Invert:   {'op': operator.inv,      'symbol': '~'},
-            ast.LShift:   {'op': operator.lshift,   'symbol': '>>'},
-            ast.RShift:   {'op': operator.rshift,   'symbol': '<<'},
-            ast.UAdd:     {'op': operator.pos,      'symbol': '+'},
-            ast.USub:     {'op': operator.neg,      'symbol': '-'},
-        }
-
-        self.symbols = [op['symbol'] for op in self.operators.values()]
-
-        self.internal_variables = {
-            '_base': base,
-            '_python': 'Python ' + sys.version,
-            '_version': __version__
-        }
+    operators = {
+        ast.Add:      {'op': operator.add,      'symbol': '+'},
+        ast.Sub:      {'op': operator.sub,      'symbol': '-'},
+        ast.Mult:     {'op': operator.mul,      'symbol': '*'},
+        ast.Div:      {'op': operator.truediv,  'symbol': '/'},
+        ast.FloorDiv: {'op': operator.floordiv, 'symbol': '//'},
+        ast.Mod:      {'op': operator.mod,      'symbol': '%'},
+        ast.Pow:      {'op': operator.pow,      'symbol': '**'},
+        ast.BitAnd:   {'op': operator.iand,     'symbol': '&'},
+        ast.BitOr:    {'op': operator.ior,      'symbol': '|'},
+        ast.BitXor:   {'op': operator.ixor,     'symbol': '^'},
+        ast.Invert:   {'op': operator.inv,      'symbol': '~'},
+        ast.LShift:   {'op': operator.lshift,   'symbol': '<<'},
+        ast.RShift:   {'op': operator.rshift,   'symbol': '>>'},
+        ast.UAdd:     {'op': operator.pos,      'symbol': '+'},
+        ast.USub:     {'op': operator.neg,      'symbol': '-'},
+    }
 
+    symbols = [op['symbol'] for op in operators.values()]
+
+    shared_internal_variables = {
+        '_python': 'Python ' + sys.version,
+        '_version': __version__
+    }
+
+    constants = {
+        'e':        {'value': math.e,
+                     'help': 'e: Euler\'s number'},
+        'euler':    {'value': 0.577215664901533,
+                     'help': 'euler: Euler-Mascheroni constant'},
+        'pi':       {'value': math.pi,
+                     'help': 'pi: 0.5 tau'},
+        'phi':      {'value': (1 + math.sqrt(5)) / 2,
+                     'help': 'phi: the golden ratio'},
+        'tau':      {'value': math.pi * 2,
+                     'help': 'tau: 2 pi'},
+    }
+
+    functions = {
+        'A':      {'value': ackermann,
+                   'help': 'A(x, y): Ackermann function',
+                   'memo': True,
+                   'cost': ackermann_cost},
+        'abs':    {'value': abs,
+                   'help': 'abs(x): absolute value of x'},
+        'acos':   {'value': math.acos,
+                   'help': 'acos(x): inverse trigonometric cosine of x (in radians)'},
+        'acosh':  {'value': math.acosh,
+                   'help': 'acosh(x): inverse hyperbolic cosine of x (in radians)'},
+        'asin':   {'value': math.asin,
+                   'help': 'asin(x): inverse trigonometric sine of x (in radians)'},
+        'asinh':  {'value': math.asinh,
+                   'help': 'asinh(x): inverse hyperbolic sine of x (in radians)'},
+        'atan':   {'value': math.atan,
+                   'help': 'atan(x): inverse trigonometric tangent of x (in radians)'},
+        'atanh':  {'value': math.atanh,
+                   'help': 'atanh(x): inverse hyperbolic tangent of x (in radians)'},
+        'base':   {'value': lambda self, x=None: self._set_base(x),
+                   'help': 'base(x): set output base to x (2 to 36)',
+                   'bound': True,
+                   'pure': False},
+        'binom':  {'value': numtheory.binom,
+                   'help': 'binom(n, k): binomial coefficient n choose k',
+                   'memo': True,
+                   'cost': binom_cost},
+        'cbrt':   {'value': lambda x: x ** (1. / 3),
+                   'help': 'cbrt(x): cube root of x'},
+        'ceil':   {'value': math.ceil,
+                   'help': 'ceil(x): ceiling function of x'},
+        'cond':   {'value': lambda x, a, b: a() if x() else b(),
+                   'help': 'cond(x, a, b): a if x is not zero, b otherwise (only one of them is evaluated)',
+                   'lazy': True},
+        'cos':    {'value': math.cos,
+                   'help': 'cos(x): cosine of x (in radians)'},
+        'deg':    {'value': math.degrees,
+                  'help': 'deg(x): convert x from radians to degrees'},
+        'delete': {'value': lambda self, x: self._delete_var(x),
+                  'help': 'delete(x): delete variable x',
+                  'bound': True,
+                  'meta': True},
+        'erf':    {'value': math.erf,
+                   'help': 'erf(x): error function of x'},
+        'exp':    {'value': math.exp,
+                   'help': 'exp(x): calculate e ** x'},
+        'fact':   {'value': math.factorial,
+                   'help': 'fact(x): factorial of x',
+                   'memo': True,
+                   'cost': factorial_cost},
+        'fib':    {'value': numtheory.fib,
+                   'help': 'fib(n): nth Fibonacci number',
+                   'memo': True,
+                   'cost': fib_cost},
+        'fmod':   {'value': math.fmod,
+                   'help': 'fmod(x, y): calculate floating point modulo of x % y'},
+        'floor':  {'value': math.floor,
+                   'help': 'floor(x): floor function of x'},
+        'gamma':  {'value': math.gamma,
+                   'help': 'gamma(x): gamma function of x',
+                   'memo': True},
+        'gcd':    {'value': numtheory.gcd,
+                   'help': 'gcd(x, y[, ...]): greatest common divisor of integers'},
+        'help':   {'value': lambda self, x: self._help(x),
+                   'help': 'help(x): print help on x',
+                   'bound': True,
+                   'meta': True},
+        'hyp':    {'value': math.hypot,
+                   'help': 'hyp(x): hypotenuse of x'},
+        'isprime': {'value': numtheory.isprime,
+                   'help': 'isprime(n): 1 if n is prime, 0 otherwise',
+                   'memo': True,
+                   'cost': isprime_cost},
+        'isqrt':  {'value': numtheory.isqrt,
+                   'help': 'isqrt(n): integer square root of n'},
+        'lcm':    {'value': numtheory.lcm,
+                   'help': 'lcm(x, y[, ...]): least common multiple of integers'},
+        'ln':     {'value': lambda x: math.log(x, math.e),
+                   'help': 'ln(x): natural logarithm of x'},
+        'log':    {'value': math.log,
+                   'help': 'log(x[, base]): logarithm of x to base (default: 2)'},
+        'log2':   {'value': lambda x: math.log(x, 2),
+                   'help': 'log2(x): base 2 logarithm of x'},
+        'log10':  {'value': math.log10,
+                   'help': 'log10(x): base 10 logarithm of x'},
+        'max':    {'value': series.reduce_max,
+                   'help': 'max(f, i, a, b): maximum of f for integers i from a to b',
+                   'reduce': True},
+        'min':    {'value': series.reduce_min,
+                   'help': 'min(f, i, a, b): minimum of f for integers i from a to b',
+                   'reduce': True},
+        'modinv': {'value': numtheory.modinv,
+                   'help': 'modinv(a, m): inverse of a modulo m'},
+        'pmov':   {'value': lambda x, a, b: a + x * (b - a),
+                   'help': 'pmov(x, a, b): proportional movement from a to b'},
+        'nrt':    {'value': lambda n, x: x ** (1. / n),
+                   'help': 'nrt(x): nth root of x',
+                   'memo': True},
+        'powmod': {'value': numtheory.powmod,
+                   'help': 'powmod(a, b, m): calculate a ** b % m without the intermediate a ** b',
+                   'cost': powmod_cost},
+        'prod':   {'value': series.reduce_prod,
+                   'help': 'prod(f, i, a, b): product of f for integers i from a to b',
+                   'reduce': True,
+                   'cost': prod_cost},
+        'rad':    {'value': math.radians,
+                   'help': 'rad(x): convert x from degrees to radians'},
+        'round':  {'value': round,
+                   'help': 'round(x[, n]): round x to n decimal places (default: 0)'},
+        'sin':    {'value': math.sin,
+                   'help': 'sin(x): sine of x'},
+        'stats':  {'value': lambda self, _: self._print_stats(),
+                   'help': 'stats(): print profiling statistics (see JC_PROFILE)',
+                   'bound': True,
+                   'meta': True},
+        'sqrt':   {'value': math.sqrt,
+                   'help': 'sqrt(x): square root of x'},
+        'sum':    {'value': series.reduce_sum,
+                   'help': 'sum(f, i, a, b): sum of f for integers i from a to b, e.g. sum(i ** 2, i, 1, 100)',
+                   'reduce': True},
+        'tan':    {'value': math.tan,
+                   'help': 'tan(x): tangent of x'},
+        'vars':   {'value': lambda self, _: self._print_vars(),
+                  'help': 'vars(): print user-assigned variables and formulas and their values',
+                  'bound': True,
+                  'meta': True},
+    }
+
+    def __init__(self, base=10, completer=completer.Completer, cache_size=1024,
+                 memo_size=1024, memo_bytes=16 * 1024 * 1024, budget=None, profiler=None):
+        self.ans = None
         self.variables = {}
+        self.formulas = {}
+        self.user_functions = {}
+        self.internal_variables = dict(self.shared_internal_variables, _base=base)
+        self.budget = budget
+        self.profiler = profiler
+        self._compiled = cache.LRUCache(cache_size)
+        self._memo = cache.LRUCache(memo_size, maxbytes=memo_bytes, sizeof=memo_sizeof)
+        self._cells = []
+        self._dependents = {}
+        self._depth = 0
 
-        self.constants = {
-            'e':        {'value': math.e,
-                         'help': 'e: Euler\'s number'},
-            'euler':    {'value': 0.577215664901533,
-                         'help': 'euler: Euler-Mascheroni constant'},
-            'pi':       {'value': math.pi,
-                         'help': 'pi: 0.5 tau'},
-            'phi':      {'value': (1 + math.sqrt(5)) / 2,
-                         'help': 'phi: the golden ratio'},
-            'tau':      {'value': math.pi * 2,
-                         'help': 'tau: 2 pi'},
-        }
-
-        self.functions = {
-            'A':      {'value': lambda m, n: n + 1 if m == 0 else \
-                      (self.functions['A']['value'](m - 1, 1) if m > 0 and n == 0 else \
-                      self.functions['A']['value'](m - 1, self.functions['A']['value'](m, n - 1))),
-                      'help': 'A(x, y): Ackermann function'},
-            'abs':    {'value': abs,
-                       'help': 'abs(x): absolute value of x'},
-            'acos':   {'value': math.acos,
-                       'help': 'acos(x): inverse trigonometric cosine of x (in radians)'},
-            'acosh':  {'value': math.acosh,
-                       'help': 'acosh(x): inverse hyperbolic cosine of x (in radians)'},
-            'asin':   {'value': math.asin,
-                       'help': 'asin(x): inverse trigonometric sine of x (in radians)'},
-            'asinh':  {'value': math.asinh,
-                       'help': 'asinh(x): inverse hyperbolic sine of x (in radians)'},
-            'atan':   {'value': math.atan,
-                       'help': 'atan(x): inverse trigonometric tangent of x (in radians)'},
-            'atanh':  {'value': math.atanh,
-                       'help': 'atanh(x): inverse hyperbolic tangent of x (in radians)'},
-            'base':   {'value': lambda x=None: self._set_base(x),
-                       'help': 'base(x): set output base to x (2, 8, 10 or 16 allowed)'},
-            'cbrt':   {'value': lambda x: x ** (1. / 3),
-                       'help': 'cbrt(x): cube root of x'},
-            'ceil':   {'value': math.ceil,
-                       'help': 'ceil(x): ceiling function of x'},
-            'cos':    {'value': math.cos,
-                       'help': 'cos(x): cosine of x (in radians)'},
-            'deg':    {'value': math.degrees,
-                      'help': 'deg(x): convert x from radians to degrees'},
-            'delete': {'value': lambda x: self._delete_var(x),
-                      'help': 'delete(x): delete variable x',
-                      'meta': True},
-            'erf':    {'value': math.erf,
-                       'help': 'erf(x): error function of x'},
-            'exp':    {'value': math.exp,
-                       'help': 'exp(x): calculate e ** x'},
-            'fact':   {'value': math.factorial,
-                       'help': 'fact(x): factorial of x'},
-            'fmod':   {'value': math.fmod,
-                       'help': 'fmod(x, y): calculate floating point modulo of x % y'},
-            'floor':  {'value': math.floor,
-                       'help': 'floor(x): floor function of x'},
-            'gamma':  {'value': math.gamma,
-                       'help': 'gamma(x): gamma function of x'},
-            'help':   {'value': lambda x: self._help(x),
-                       'help': 'help(x): print help on x',
-                       'meta': True},
-            'hyp':    {'value': math.hypot,
-                       'help': 'hyp(x): hypotenuse of x'},
-            'ln':     {'value': lambda x: math.log(x, math.e),
-                       'help': 'ln(x): natural logarithm of x'},
-            'log':    {'value': math.log,
-                       'help': 'log(x[, base]): logarithm of x to base (default: 2)'},
-            'log2':   {'value': lambda x: math.log(x, 2),
-                       'help': 'log2(x): base 2 logarithm of x'},
-            'log10':  {'value': math.log10,
-                       'help': 'log10(x): base 10 logarithm of x'},
-            'pmov':   {'value': lambda x, a, b: a + x * (b - a),
-                       'help': 'pmov(x, a, b): proportional movement from a to b'},
-            'nrt':    {'value': lambda n, x: x ** (1. / n),
-                       'help': 'nrt(x): nth root of x'},
-            'rad':    {'value': math.radians,
-                       'help': 'rad(x): convert x from degrees to radians'},
-            'round':  {'value': round,
-                       'help': 'round(x[, n]): round x to n decimal places (default: 0)'},
-            'sin':    {'value': math.sin,
-                       'help': 'sin(x): sine of x'},
-            'sqrt':   {'value': math.sqrt,
-                       'help': 'sqrt(x): square root of x'},
-            'tan':    {'value': math.tan,
-                       'help': 'tan(x): tangent of x'},
-            'vars':   {'value': lambda _: self._print_vars(),
-                      'help': 'vars(): print user-assigned variables and their values',
-                      'meta': True},
-        }
-
-        self.completer = None
-        if completer is not None:
-            self.completer = completer(
+        # created on first use, it binds readline and loads the history
+        self._completer = None
+        self._make_completer = completer
+
+    @property
+    def completer(self):
+        ''' The readline completer, None if disabled. Created on first access. '''
+        if self._make_completer is not None:
+            make_completer, self._make_completer = self._make_completer, None
+            self._completer = make_completer(
                 list([k + '(' for k in self.functions.keys()]) +
                 list(self.constants.keys()) +
                 list(self.variables.keys()) +
+                list(self.formulas.keys()) +
+                list([k + '(' for k in self.user_functions.keys()]) +
                 ['ans']
             )
+        return self._completer
+
+    def clone(self):
+        '''
+        Create an independent copy of the session.
+
+        Only the session state (ans, variables, formulas, user functions and the output base)
+        is copied, the operator and function tables are shared by all evaluators. The
+        clone shares the completer (if it has been created), the profiler and the
+        memoization cache of pure function results, and gets its own compilation cache.
+        Cloning a template evaluator is the intended way to get an evaluator per
+        request, it is cheaper than constructing one.
+        '''
+        clone = object.__new__(type(self))
+        clone.budget = copy.copy(self.budget)
+        clone._completer = self._completer
+        clone._make_completer = None
+        clone.profiler = self.profiler
+        clone._compiled = cache.LRUCache(self._compiled.maxsize)
+        clone._memo = self._memo
+        clone._cells = []
+        clone._depth = 0
+        clone.user_functions = {}
+        clone._copy_state(self)
+        return clone
+
+    def _copy_state(self, other):
+        ''' Replace the session state with a copy of the session state of other. '''
+        self.ans = other.ans
+        self.variables = dict(other.variables)
+        self.internal_variables = dict(other.internal_variables)
+        self._dependents = dict((name, set(names)) for name, names in other._dependents.items())
+        # compiled functions and expressions are bound to this evaluator, they
+        # are kept if the definitions are the same, e.g. when resetting a scratch copy
+        if not self._same_functions(other):
+            # compiled expressions may have inlined the previous functions
+            self._compiled.clear()
+            self.user_functions = dict((name, function.copy())
+                                       for name, function in other.user_functions.items())
+            self._compile_functions()
+        # compiled formulas read the variables and formulas of their evaluator
+        self.formulas = {}
+        for name, formula in other.formulas.items():
+            formula = formula.copy()
+            formula.compiled = self._compile(formula.expr)
+            self.formulas[name] = formula
+
+    def _same_functions(self, other):
+        ''' Check if the user functions are copies of the same definitions as those of other. '''
+        if len(self.user_functions) != len(other.user_functions):
+            return False
+        for name, function in other.user_functions.items():
+            if name not in self.user_functions or self.user_functions[name].tree is not function.tree:
+                return False
+        return True
+
+    def save_session(self, path):
+        ''' Save the session state (ans, variables, formulas, functions and the output base) to a snapshot file. '''
+        from . import session
+        session.save(self, path)
+
+    def load_session(self, path):
+        '''
+        Replace the session state with the one saved in a snapshot file.
+
+        Raises SessionError (a ValueError) if the file is not a snapshot, was
+        written by an incompatible version or is corrupted.
+        '''
+        from . import session
+        session.load(self, path)
 
     def _help(self, args):
         ''' Print help for given topics. '''
@@ -172,51 +450,79 @@ class Evaluator(object):
             print(get_help(self.functions))
 
         for arg in args:
+            if arg.id in self.user_functions:
+                function = self.user_functions[arg.id]
+                print('%s = %s' % (function.signature(), function.expr))
+                continue
             msg = self.constants.get(arg.id, self.functions.get(arg.id, {})).get('help')
             if not msg:
                 raise ValueError('unknown help topic \'%s\'' % arg.id)
             print(msg)
 
     def _print_vars(self):
-        ''' Print user-assigned variables. '''
+        ''' Print user-assigned variables, formulas and functions. '''
         for key, value in self.variables.items():
             print('%s: %s' % (key, value))
+        for key, formula in self.formulas.items():
+            try:
+                value = self._read_formula(key)
+            except Exception as error:
+                value = 'error: %s' % error
+            print('%s: %s (:= %s)' % (key, value, formula.expr))
+        for function in self.user_functions.values():
+            print('%s = %s' % (function.signature(), function.expr))
+
+    def _print_stats(self):
+        ''' Print profiling statistics. '''
+        if self.profiler is None:
+            raise ValueError('profiling is disabled (enable it with JC_PROFILE=1 or --profile)')
+        print(self.profiler.format())
 
     def _delete_var(self, var):
-        ''' Delete user-assigned variable. '''
+        ''' Delete user-assigned variable or function. '''
         if len(var) != 1:
             raise ValueError('unknown variable %s' % var)
         var_id = var[0].id
+        if var_id in self.user_functions:
+            del self.user_functions[var_id]
+            self._refresh_functions()
+            if self._completer is not None:
+                self._completer.remove_content(var_id + '(')
+            return
         is_existing_var = self.variables.get(var_id)
-        if is_existing_var is not None:
-            del self.variables[var_id]
+        if is_existing_var is not None or var_id in self.formulas:
+            self.variables.pop(var_id, None)
+            self._remove_formula(var_id)
+            self._invalidate(var_id)
+            if self._completer is not None:
+                self._completer.remove_content(var_id)
 
     def _set_base(self, base):
         if base is None:
             print(self.internal_variables['_base'])
             return
-        if base not in (2, 8, 10, 16):
-            raise ValueError('unsupported base \'%s\' (allowed: 2, 8, 10, 16)' % base)
-        self.internal_variables['_base'] = base
+        if base not in range(2, 37):
+            raise ValueError('unsupported base \'%s\' (allowed: 2 to 36)' % base)
+        self.internal_variables['_base'] = int(base)
 
     def _get_op(self, operator):
         try:
             found_op = self.operators[type(operator.op)]['op']
         except KeyError:
             raise SyntaxError('unknown operator \'%s\'' % operator.op)
+        if self.budget is not None and found_op in op_costs:
+            found_op = self.budget.guard(found_op, op_costs[found_op])
         return found_op
 
-    def _eval_unary_op(self, operator):
-        ''' Evaluate unary operator (e.g. -1) '''
-        op = self._get_op(operator)
-        value = op(self._eval_op(operator.operand))
-        return value
-
-    def _eval_binary_op(self, operator):
-        ''' Evaluate binary operator (e.g. 5 + 5). '''
-        op = self._get_op(operator)
-        value = op(self._eval_op(operator.left), self._eval_op(operator.right))
-        return value
+    def _get_func(self, name):
+        ''' Get the callable of a function, checked against the budget if it has a cost. '''
+        func_wrapper = self.functions[name]
+        func = func_wrapper['value']
+        if func_wrapper.get('bound') == True:
+            func = functools.partial(func, self)
+        if self.budget is not None and 'cost' in func_wrapper:
+            func = self.budget.guard(func, func_wrapper['cost'])
+        return func
 
     def _eval_name(self, operator):
         ''' Evaluate name expansion / assignment (e.g. a = 10). '''
@@ -226,41 +532,262 @@ class Evaluator(object):
             print(self.internal_variables[operator.id])
         elif operator.id in self.variables:
             return self.variables[operator.id]
+        elif operator.id in self.formulas:
+            return self._read_formula(operator.id)
         elif operator.id == 'ans':
             return self.ans
-        elif operator.id in self.functions:
+        elif operator.id in self.functions or operator.id in self.user_functions:
             raise TypeError('cannot evaluate function label \'%s\'' % operator.id)
         else:
             raise NameError('variable \'%s\' is not defined' % operator.id)
 
-    def _eval_func(self, operator):
-        ''' Evaluate function call (e.g. sqrt(16)). '''
-        if operator.func.id in self.functions:
-            func_wrapper = self.functions[operator.func.id]
-            func = func_wrapper['value']
-            if func_wrapper.get('meta') == True:
-                return func(operator.args)
-            value = func(*(self._eval_op(arg) for arg in operator.args))
+    def _eval_op(self, op):
+        ''' Evaluate expression operator. '''
+        return self._compile_op(op)(self.variables)
+
+    def _compile_num(self, operator):
+        ''' Compile numeric literal (e.g. 1). '''
+        value = operator.n
+        return lambda scope: value
+
+    def _compile_unary_op(self, operator):
+        ''' Compile unary operator (e.g. -1). '''
+        op = self._get_op(operator)
+        operand = self._compile_op(operator.operand)
+        return lambda scope: op(operand(scope))
+
+    def _compile_binary_op(self, operator):
+        ''' Compile binary operator (e.g. 5 + 5). '''
+        op = self._get_op(operator)
+        left = self._compile_op(operator.left)
+        right = self._compile_op(operator.right)
+        return lambda scope: op(left(scope), right(scope))
+
+    def _compile_name(self, operator):
+        ''' Compile name expansion (e.g. a). '''
+        if operator.id in self.constants:
+            value = self.constants[operator.id]['value']
+            return lambda scope: value
+
+        name = operator.id
+        def lookup(scope):
+            try:
+                return scope[name]
+            except KeyError:
+                return self._eval_name(operator)
+        return lookup
+
+    def _memoize(self, name, func):
+        ''' Wrap a pure function with a lookup in the memoization cache. '''
+        memo = self._memo
+        missing = object()
+        def memoized(*args):
+            key = (name, args, tuple(type(arg) for arg in args))
+            value = memo.get(key, missing)
+            if value is missing:
+                value = func(*args)
+                memo.put(key, value)
             return value
-        else:
+        return memoized
+
+    def _compile_func(self, operator):
+        ''' Compile function call (e.g. sqrt(16)). '''
+        if operator.func.id in self.user_functions:
+            return self._compile_user_func(operator)
+        if operator.func.id not in self.functions:
             raise NameError('function \'%s\' is not defined' % operator.func.id)
 
-    def _eval_op(self, op):
-        ''' Evaluate expression operator. '''
+        func_wrapper = self.functions[operator.func.id]
+        func = self._get_func(operator.func.id)
+        if self.profiler is not None:
+            func = self.profiler.timed(operator.func.id, func)
+        if func_wrapper.get('meta') == True:
+            args = operator.args
+            return lambda scope: func(args)
+        if func_wrapper.get('reduce') == True:
+            return self._compile_reduce(operator, func)
+        if func_wrapper.get('lazy') == True:
+            # arguments are passed unevaluated, as functions of no arguments
+            lazy_args = [self._compile_op(arg) for arg in operator.args]
+            return lambda scope: func(*[functools.partial(arg, scope) for arg in lazy_args])
+
+        if func_wrapper.get('memo') == True:
+            func = self._memoize(operator.func.id, func)
+
+        args = [self._compile_op(arg) for arg in operator.args]
+        if len(args) == 1:
+            arg = args[0]
+            return lambda scope: func(arg(scope))
+        return lambda scope: func(*[arg(scope) for arg in args])
+
+    def _compile_reduce(self, operator, func):
+        ''' Compile a reduction over an integer range (e.g. sum(i ** 2, i, 1, 10)). '''
+        name = operator.func.id
+        if len(operator.args) != 4 or not isinstance(operator.args[1], ast.Name):
+            raise SyntaxError('%s() takes an expression, an index variable and two bounds, '
+                              'e.g. %s(i ** 2, i, 1, 10)' % (name, name))
+        body, index, lower, upper = operator.args
+        index = index.id
+        self._validate_var(index)
+        poly = series.polynomial(body, index)
+        body = self._compile_op(body)
+        lower = self._compile_op(lower)
+        upper = self._compile_op(upper)
+        budget = self.budget
+
+        def reduce(scope):
+            a = numtheory.as_int(lower(scope), name)
+            b = numtheory.as_int(upper(scope), name)
+            def terms():
+                local = dict(scope)
+                for i in range(a, b + 1):
+                    local[index] = i
+                    if budget is not None and not i & 0xfff:
+                        budget.check(0, 0)
+                    yield body(local)
+            return func(terms, poly, a, b)
+        return reduce
+
+    def _compile_user_func(self, operator):
+        ''' Compile user function call (e.g. f(2, 3)), the function is looked up when called. '''
+        name = operator.func.id
+        self._check_arity(self.user_functions[name], len(operator.args))
+        args = [self._compile_op(arg) for arg in operator.args]
+
+        def call(scope):
+            try:
+                function = self.user_functions[name]
+            except KeyError:
+                raise NameError('function \'%s\' is not defined' % name)
+            return function.call(*[arg(scope) for arg in args])
+        return call
+
+    def _check_arity(self, function, count):
+        if count != len(function.params):
+            raise TypeError('%s() takes %d argument%s (%d given)'
+                            % (function.name, len(function.params),
+                               '' if len(function.params) == 1 else 's', count))
+
+    def _bound_names(self, tree):
+        ''' Return the ids of the name nodes bound to the index of a reduction. '''
+        bound = set()
+        for node in ast.walk(tree):
+            if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+                    self.functions.get(node.func.id, {}).get('reduce') and
+                    len(node.args) == 4 and isinstance(node.args[1], ast.Name)):
+                index = node.args[1].id
+                bound.update(id(child) for child in ast.walk(node.args[0])
+                             if isinstance(child, ast.Name) and child.id == index)
+                bound.add(id(node.args[1]))
+        return bound
+
+    def _compile_let(self, operator):
+        ''' Compile shared subexpressions (see jc.optimizer). '''
+        cells = [None] * len(operator.bindings)
+        self._cells.append(cells)
+        try:
+            bindings = list(enumerate(self._compile_op(b) for b in operator.bindings))
+            body = self._compile_op(operator.body)
+        finally:
+            self._cells.pop()
+
+        def let(scope):
+            # restore the cells afterwards, the same let may be entered recursively
+            saved = cells[:]
+            try:
+                for slot, binding in bindings:
+                    cells[slot] = binding(scope)
+                return body(scope)
+            finally:
+                cells[:] = saved
+        return let
+
+    def _compile_ref(self, operator):
+        ''' Compile reference to a shared subexpression. '''
+        cells = self._cells[-1]
+        slot = operator.slot
+        return lambda scope: cells[slot]
+
+    def _compile_op(self, op):
+        '''
+        Compile expression operator into a closure.
+
+        The closure takes the variable scope as its only argument and
+        returns the value of the expression.
+        '''
         if isinstance(op, ast.Num):
-            val = op.n
+            compiled = self._compile_num(op)
         elif isinstance(op, ast.UnaryOp):
-            val = self._eval_unary_op(op)
+            compiled = self._compile_unary_op(op)
         elif isinstance(op, ast.BinOp):
-            val = self._eval_binary_op(op)
+            compiled = self._compile_binary_op(op)
         elif isinstance(op, ast.Name):
-            val = self._eval_name(op)
+            compiled = self._compile_name(op)
         elif isinstance(op, ast.Call):
-            val = self._eval_func(op)
+            compiled = self._compile_func(op)
+        elif isinstance(op, optimizer.Ref):
+            compiled = self._compile_ref(op)
+        elif isinstance(op, optimizer.Let):
+            compiled = self._compile_let(op)
         else:
             raise SyntaxError('unknown operator \'%s\'' % op)
 
-        return val
+        if self.profiler is not None:
+            compiled = self.profiler.count(type(op).__name__, compiled)
+        return compiled
+
+    def _compile(self, expr, syntax_error=None):
+        '''
+        Parse and compile an expression, reusing cached compilations.
+
+        If syntax_error is given, parse errors are reported with it as message.
+        '''
+        compiled = self._compiled.get(expr)
+        if compiled is None:
+            compiled = self._compile_tree(self._parse(expr, syntax_error))
+            self._compiled.put(expr, compiled)
+        return compiled
+
+    def _parse(self, expr, syntax_error=None, inline=True):
+        '''
+        Parse and optimize an expression, return the optimized tree.
+
+        Calls of user functions are inlined unless inline is false, e.g. for
+        trees that outlive the current function definitions.
+        '''
+        try:
+            with self._stage('parse'):
+                tree = parser.parse_expr(expr)
+        except SyntaxError:
+            if syntax_error is None:
+                raise
+            raise SyntaxError(syntax_error)
+        return self._optimize(tree, inline)
+
+    def _optimize(self, tree, inline=True):
+        ''' Optimize a parsed expression tree. '''
+        with self._stage('optimize'):
+            return optimizer.Optimizer(self).optimize(tree, inline)
+
+    def _compile_tree(self, tree):
+        ''' Compile an optimized expression tree into a closure. '''
+        with self._stage('compile'):
+            return self._compile_op(tree)
+
+    def _stage(self, name):
+        ''' Return a context that times a stage of evaluation if profiling is enabled. '''
+        if self.profiler is None:
+            return null_stage
+        return self.profiler.stage(name)
+
+    def _is_pure_func(self, name):
+        ''' Check if a function is free of side effects on the session. '''
+        func_wrapper = self.functions.get(name, {})
+        return not func_wrapper.get('meta') and func_wrapper.get('pure', True)
+
+    def cache_info(self):
+        ''' Return hit/miss statistics of the compilation and memoization caches. '''
+        return {'compiled': self._compiled.info(), 'memo': self._memo.info()}
 
     def _validate_var(self, var):
         ''' Validate a variable assignment. '''
@@ -270,6 +797,8 @@ class Evaluator(object):
             raise NamespaceError('cannot assign to internal variable \'%s\'' % var)
         elif var in self.functions:
             raise NamespaceError('cannot override existing function \'%s\'' % var)
+        elif var in self.user_functions:
+            raise NamespaceError('cannot assign to function \'%s\' (delete it first)' % var)
         elif var.startswith('_'):
             raise NamespaceError('cannot assign to internal variable space (starting with _)')
         elif var == 'ans':
@@ -284,36 +813,253 @@ class Evaluator(object):
     def _assign_var(self, var_name, expr_value):
         ''' Assign a value to a variable. '''
         self._validate_var(var_name)
-        tree = ast.parse(expr_value, mode='eval')
-        value = self._eval_op(tree.body)
+        value = self._compile(expr_value)(self.variables)
+        self._set_var(var_name, value)
+        return value
+
+    def _set_var(self, var_name, value):
+        ''' Set a validated variable, replacing a formula of the same name. '''
+        self._remove_formula(var_name)
         self.variables[var_name] = value
-        if self.completer is not None:
-            self.completer.add_content(var_name)
+        self._invalidate(var_name)
+        if self._completer is not None:
+            self._completer.add_content(var_name)
 
-        return value
+    def _assign_formula(self, var_name, expr_value):
+        ''' Assign a formula to a variable, it is evaluated when read. '''
+        self._validate_var(var_name)
+        compiled = self._compile(expr_value)
+        deps = set()
+        calls = set()
+        tree = parser.parse_expr(expr_value)
+        # function names and reduction indices are not dependencies
+        ignored = self._bound_names(tree)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+                if not self._is_pure_func(node.func.id):
+                    raise ValueError('cannot use function \'%s\' with side effects in a formula'
+                                     % node.func.id)
+                ignored.add(id(node.func))
+                calls.add(node.func.id)
+                # user functions may read variables themselves
+                deps.update(self._function_deps(node.func.id))
+            elif isinstance(node, ast.Name) and id(node) not in ignored:
+                if node.id == 'ans':
+                    raise ValueError('formulas cannot refer to ans')
+                if node.id not in self.constants:
+                    deps.add(node.id)
+
+        # reject formulas that would depend on themselves
+        seen = set()
+        stack = list(deps)
+        while stack:
+            name = stack.pop()
+            if name == var_name:
+                raise ValueError('circular reference in formula \'%s\'' % var_name)
+            if name not in seen and name in self.formulas:
+                seen.add(name)
+                stack.extend(self.formulas[name].deps)
+
+        self.variables.pop(var_name, None)
+        self._remove_formula(var_name)
+        self.formulas[var_name] = Formula(expr_value, compiled, deps, calls)
+        for name in deps:
+            self._dependents.setdefault(name, set()).add(var_name)
+        self._invalidate(var_name)
+        if self._completer is not None:
+            self._completer.add_content(var_name)
+
+    def _define_function(self, name, params, expr_value, memo=False):
+        ''' Define a user function (e.g. f(x, y) = x ** 2 + y), compiled once. '''
+        function = self._parse_function(name, params, expr_value, memo)
+        previous = self.user_functions.pop(name, None)
+        # registered before compiling, the body may call the function itself
+        self.user_functions[name] = function
+        try:
+            self._check_memo()
+            self._compile_function(function)
+        except Exception:
+            del self.user_functions[name]
+            if previous is not None:
+                self.user_functions[name] = previous
+            raise
+
+        if name in self.variables or name in self.formulas:
+            self.variables.pop(name, None)
+            self._remove_formula(name)
+            self._invalidate(name)
+        # e.g. functions or formulas calling a function of the same name that was deleted
+        if (previous is not None
+                or any(name in other.calls for other in self.user_functions.values()
+                       if other is not function)
+                or any(name in formula.calls for formula in self.formulas.values())):
+            self._refresh_functions()
+        if self._completer is not None:
+            self._completer.remove_content(name)
+            self._completer.add_content(name + '(')
+
+    def _parse_function(self, name, params, expr_value, memo):
+        ''' Validate a user function definition, return it as a UserFunction. '''
+        if name not in self.user_functions:
+            self._validate_var(name)
+        for param in params:
+            self._validate_var(param)
+        if len(set(params)) != len(params):
+            raise SyntaxError('duplicate parameter in function \'%s\'' % name)
+        try:
+            tree = parser.parse_expr(expr_value)
+        except SyntaxError:
+            raise SyntaxError('invalid syntax')
+
+        free = set()
+        calls = set()
+        used = set()
+        size = 0
+        has_scopes = False
+        # function names and reduction indices are not free variables
+        ignored = self._bound_names(tree)
+        for node in ast.walk(tree):
+            size += 1
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+                func_name = node.func.id
+                if not self._is_pure_func(func_name):
+                    raise ValueError('cannot use function \'%s\' with side effects in a function'
+                                     % func_name)
+                ignored.add(id(node.func))
+                if func_name not in self.functions:
+                    calls.add(func_name)
+                elif self.functions[func_name].get('reduce'):
+                    has_scopes = True
+            elif isinstance(node, ast.Name) and id(node) not in ignored:
+                if node.id in params:
+                    used.add(node.id)
+                elif node.id not in self.constants:
+                    free.add(node.id)
+        if memo and free:
+            raise ValueError('memoized function \'%s\' can only refer to its parameters, not to %s'
+                             % (name, ', '.join(sorted(free))))
+
+        # only self-contained bodies are inlined, they evaluate the same in any scope, and
+        # only if they use every parameter, inlining drops the arguments of unused ones
+        inline = (not memo and not free and not calls and not has_scopes and size <= self.inline_size
+                  and len(used) == len(params))
+        return UserFunction(name, tuple(params), expr_value, memo, tree, free, calls, inline)
+
+    def _check_memo(self):
+        ''' Check that memoized functions do not read variables through the functions they call. '''
+        for function in self.user_functions.values():
+            deps = self._function_deps(function.name) if function.memo else None
+            if deps:
+                raise ValueError('memoized function \'%s\' can only refer to its parameters, not to %s'
+                                 % (function.name, ', '.join(sorted(deps))))
+
+    def _compile_function(self, function):
+        ''' Compile the body of a user function into its callable. '''
+        # the optimizer modifies the tree, the original is kept for inlining
+        body = self._compile_tree(self._optimize(copy.deepcopy(function.tree)))
+        params = function.params
+        budget = self.budget
+        max_depth = self.max_depth
+
+        def call(*args):
+            if len(args) != len(params):
+                self._check_arity(function, len(args))
+            if self._depth >= max_depth:
+                raise RuntimeError('maximum recursion depth exceeded in \'%s\' (limit: %d)'
+                                   % (function.name, max_depth))
+            if budget is not None:
+                budget.check(0, 0)
+            self._depth += 1
+            try:
+                return body(dict(zip(params, args)))
+            finally:
+                self._depth -= 1
+        if function.memo:
+            # a new key per compilation, so that results memoized before a
+            # function it calls was redefined are never returned again
+            call = self._memoize(object(), call)
+        if self.profiler is not None:
+            call = self.profiler.timed(function.name, call)
+        function.call = call
+
+    def _compile_functions(self):
+        ''' Compile all user functions, e.g. after their definitions were replaced. '''
+        for function in list(self.user_functions.values()):
+            try:
+                self._compile_function(function)
+            except Exception as error:
+                # e.g. a function it calls was deleted, the error is raised when it is called
+                function.call = failing_call(error)
+
+    def _refresh_functions(self):
+        ''' Recompile what may have inlined a user function that was redefined or deleted. '''
+        self._compiled.clear()
+        self._compile_functions()
+        for name, formula in list(self.formulas.items()):
+            try:
+                self._assign_formula(name, formula.expr)
+            except Exception as error:
+                # e.g. a function it calls was deleted, the error is raised when it is read
+                formula.compiled = failing_call(error)
+                self._invalidate(name)
+                formula.dirty = True
+
+    def _function_deps(self, name):
+        ''' Return the variables a user function reads, directly or through other functions. '''
+        deps = set()
+        seen = set()
+        stack = [name]
+        while stack:
+            name = stack.pop()
+            if name in seen or name not in self.user_functions:
+                continue
+            seen.add(name)
+            function = self.user_functions[name]
+            deps.update(function.free)
+            stack.extend(function.calls)
+        return deps
+
+    def _remove_formula(self, var_name):
+        formula = self.formulas.pop(var_name, None)
+        if formula is not None:
+            for name in formula.deps:
+                self._dependents[name].discard(var_name)
+
+    def _invalidate(self, var_name):
+        ''' Mark the formulas depending on a variable for recomputation. '''
+        stack = list(self._dependents.get(var_name, ()))
+        while stack:
+            name = stack.pop()
+            formula = self.formulas[name]
+            # the dependents of a formula that is already dirty are dirty as well
+            if not formula.dirty:
+                formula.dirty = True
+                stack.extend(self._dependents.get(name, ()))
+
+    def _read_formula(self, var_name):
+        ''' Return the value of a formula, recomputing it if a dependency has changed. '''
+        formula = self.formulas[var_name]
+        if formula.dirty:
+            if formula.computing:
+                raise ValueError('circular reference in formula \'%s\'' % var_name)
+            formula.computing = True
+            try:
+                formula.value = formula.compiled(self.variables)
+            finally:
+                formula.computing = False
+            formula.dirty = False
+        return formula.value
 
     def _convert_result_base(self, result):
         ''' Convert output result to defined base. '''
         base = self.internal_variables['_base']
-        if base == 2:
-            return int(bin(int(result))[2:])
-        elif base == 8:
-            if sys.version_info >= (3, 0, 0):
-                return int(oct(int(result))[2:])
-            else:
-                if result == 0:
-                    return int(oct(int(result)))
-                else:
-                    return int(oct(int(result))[1:])
-        elif base == 10:
+        if base == 10:
+            if not isinstance(result, (float, complex)):
+                return result
             if result - int(result) == 0:
                 return int(result)
-            else:
-                return result
-        elif base == 16:
-            return hex(result)[2:]
-        else:
-            raise ValueError('unsupported base value \'%s\'' % base)
+            return result
+        return radix.to_base(int(result), base)
 
     def _is_repeatable_expr(self, expr):
         if not len(expr):
@@ -329,45 +1075,127 @@ class Evaluator(object):
         if self._is_repeatable_expr(expr):
             expr = 'ans' + expr
 
-        try:
-            tree = ast.parse(expr, mode='eval')
-        except SyntaxError:
-            raise SyntaxError('invalid syntax')
+        return self._eval_compiled(self._compile(expr, syntax_error='invalid syntax'))
+
+    def _eval_compiled(self, compiled):
+        ''' Evaluate a compiled expression, set ans and return the result in the output base. '''
+        if self.profiler is None:
+            result = compiled(self.variables)
         else:
-            result = self._eval_op(tree.body)
+            with self.profiler.stage('eval'):
+                result = compiled(self.variables)
 
-            if result is not None:
-                self.ans = result
+        if result is not None:
+            self.ans = result
+            if self.profiler is None:
                 result = self._convert_result_base(result)
+            else:
+                with self.profiler.stage('convert'):
+                    result = self._convert_result_base(result)
 
-            return result
-
-    def eval(self, expr, results=None):
-        ''' Build and evaluate the AST for an expression, return the result(s). '''
-        if results is None:
-            results = []
+        return result
 
+    def _eval_stmt(self, expr):
+        ''' Evaluate a single statement, return its result. '''
         expr = expr.strip()
-
-        multi_expr = ';' in expr
-        if multi_expr:
-            expr, _, rest = expr.partition(';')
+        if self.budget is not None:
+            self.budget.start()
 
         if expr.startswith('#') or len(expr) == 0:
-            return results
+            return None
+
+        formula_assign = formula_re.match(expr)
+        if formula_assign is not None:
+            self._assign_formula(formula_assign.group('var'), formula_assign.group('val').strip())
+            return None
 
-        var_assign = re.search(r'(?P<var>^\w+\s*)\=(?P<val>\s*(.*?)$)', expr)
+        function_def = function_re.match(expr)
+        if function_def is not None:
+            params = function_def.group('params').strip()
+            params = [param.strip() for param in params.split(',')] if params else []
+            self._define_function(function_def.group('name'), params,
+                                  function_def.group('val').strip(), function_def.group('memo') is not None)
+            return None
+
+        var_assign = assign_re.search(expr)
         if var_assign is not None:
             var_assign = var_assign.groupdict()
             var_name = var_assign['var'].strip()
             var_value = var_assign['val'].strip()
             self._assign_var(var_name, var_value)
-        else:
-            result = self._eval_expr(expr)
-            if result is not None:
-                results.append(result)
+            return None
 
-        if multi_expr:
-            self.eval(rest, results)
+        return self._eval_expr(expr)
+
+    def iter_eval(self, source):
+        ''' Evaluate the statements of source one by one, yield their results. '''
+        for expr in split_exprs(source):
+            result = self._eval_stmt(expr)
+            if result is not None:
+                yield result
 
+    def eval(self, expr, results=None):
+        ''' Build and evaluate the AST for an expression, return the result(s). '''
+        if results is None:
+            results = []
+        results.extend(self.iter_eval(expr))
         return results
+
+    def compile(self, expr):
+        '''
+        Compile an expression into a reusable Expression object.
+
+        Names that are not constants, functions or reserved variables are
+        the free variables of the expression and can be bound when calling it.
+        '''
+        try:
+            tree = ast.parse(expr.strip(), mode='eval')
+        except SyntaxError:
+            raise SyntaxError('invalid syntax')
+
+        # function names and reduction indices are not free variables
+        ignored = self._bound_names(tree)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+                if not self._is_pure_func(node.func.id):
+                    raise ValueError('cannot compile function \'%s\' with side effects' % node.func.id)
+                ignored.add(id(node.func))
+
+        variables = []
+        names = [node for node in ast.walk(tree)
+                 if isinstance(node, ast.Name) and id(node) not in ignored]
+        for node in sorted(names, key=lambda node: node.col_offset):
+            name = node.id
+            if (name in self.constants or name in self.internal_variables or
+                    name in self.functions or name == 'ans' or name in variables):
+                continue
+            variables.append(name)
+
+        # the expression outlives the current function definitions, calls of them are not inlined
+        compiled = self._compile_op(optimizer.Optimizer(self).optimize(tree.body, inline=False))
+        return Expression(self, expr, compiled, variables)
+
+    def optimize(self, expr):
+        '''
+        Return the optimized form of an expression as a string.
+
+        Constant subexpressions are folded and repeated subexpressions
+        are hoisted into $n bindings, e.g. '2*pi*r + sqrt(x+1)/(x+1)'
+        optimizes to '6.283185307179586 * r + sqrt($0) / $0 where $0 = x + 1'.
+        '''
+        try:
+            tree = ast.parse(expr.strip(), mode='eval')
+        except SyntaxError:
+            raise SyntaxError('invalid syntax')
+        symbols = dict((op, value['symbol']) for op, value in self.operators.items())
+        return optimizer.unparse(optimizer.Optimizer(self).optimize(tree.body), symbols)
+
+    def map(self, expr, column, name='x'):
+        '''
+        Evaluate an expression over a whole column of values at once.
+
+        The column is bound to the variable name and the expression is
+        evaluated over arrays (see jc.vector), results are returned as a list.
+        '''
+        from . import vector
+        return vector.map_column(self, expr, column, name)
@@ -0,0 +1,50 @@
+class Expression(object):
+    '''
+    Compiled expression.
+
+    Evaluates a single expression against variable bindings given as
+    arguments, e.g. expr(a=3, b=4) or expr(3, 4) in the order of
+    expr.variables. Unbound variables fall back to the evaluator's session
+    variables. Evaluation has no side effects on the session: ans is not
+    updated and results are returned as raw values, without base conversion.
+    '''
+
+    def __init__(self, evaluator, expr, compiled, variables):
+        self.expr = expr
+        self.variables = tuple(variables)
+        self._evaluator = evaluator
+        self._compiled = compiled
+
+    def __repr__(self):
+        return 'Expression(%r, variables=%r)' % (self.expr, self.variables)
+
+    def __call__(self, *args, **bindings):
+        ''' Evaluate the expression with the given variable bindings. '''
+        return self._compiled(self._bind(args, bindings))
+
+    def map(self, rows):
+        '''
+        Evaluate the expression for each row of bindings.
+
+        Rows are either mappings of variable names to values or sequences
+        of values in the order of expr.variables. Returns an iterator.
+        '''
+        for row in rows:
+            if hasattr(row, 'keys'):
+                yield self._compiled(self._bind((), dict(row)))
+            else:
+                yield self._compiled(self._bind(row, {}))
+
+    def _bind(self, args, bindings):
+        ''' Build the variable scope for an evaluation. '''
+        if len(args) > len(self.variables):
+            raise TypeError('expected at most %d values, got %d'
+                            % (len(self.variables), len(args)))
+        for name, value in zip(self.variables, args):
+            if name in bindings:
+                raise TypeError('multiple values for variable \'%s\'' % name)
+            bindings[name] = value
+        for name in bindings:
+            if name not in self.variables:
+                raise TypeError('unknown variable \'%s\'' % name)
+        return bindings
@@ -0,0 +1,133 @@
+'''
+JSON lines batch evaluation.
+
+Evaluates one JSON record per input line, e.g.
+
+    {"id": 1, "expr": "sqrt(x) * 2", "vars": {"x": 16}}
+
+and writes one JSON record per input record, carrying the id of the input
+record and either the result or an error, e.g.
+
+    {"id": 1, "result": 8}
+    {"id": 2, "error": {"type": "ZeroDivisionError", "message": "division by zero"}}
+
+Records are evaluated independently of each other, so a failed record
+does not affect the rest of the batch and a batch can be restarted after
+the id of the last record in the output.
+'''
+
+import contextlib
+import io
+import json
+
+from . import radix
+
+
+class RecordError(Exception):
+    pass
+
+
+class RecordEvaluator(object):
+    '''
+    Record evaluator.
+
+    Evaluates each record on a scratch copy of the evaluator whose state is
+    reset to the state of the original before each record, so records keep
+    the warm compilation cache without seeing each other's variables.
+    The result of a record is the result of its last statement, or the text
+    printed by its statements (e.g. vars() or help(sqrt)) if it has none.
+    Printed text never goes to stdout, where it would corrupt the output.
+    '''
+
+    def __init__(self, evaluator):
+        self.template = evaluator
+        self.evaluator = evaluator.clone()
+
+    def _reset(self, bindings):
+        e = self.evaluator
+        e._copy_state(self.template)
+        for name, value in bindings.items():
+            e._validate_var(name)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise RecordError('invalid value for variable \'%s\'' % name)
+            e._remove_formula(name)
+            e.variables[name] = value
+            e._invalidate(name)
+        return e
+
+    def eval_record(self, record):
+        ''' Evaluate a decoded record, return the output record. '''
+        record_id = record.get('id') if isinstance(record, dict) else None
+        try:
+            if not isinstance(record, dict):
+                raise RecordError('record is not an object')
+            expr = record.get('expr')
+            bindings = record.get('vars', {})
+            if not isinstance(expr, str):
+                raise RecordError('record has no expression')
+            if not isinstance(bindings, dict):
+                raise RecordError('record vars is not an object')
+            e = self._reset(bindings)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                results = e.eval(expr)
+        except Exception as error:
+            return {'id': record_id, 'error': {
+                'type': type(error).__name__, 'message': str(error)}}
+        result = results[-1] if results else None
+        if result is None and output.getvalue():
+            result = output.getvalue().rstrip('\n')
+        if (isinstance(result, int) and not isinstance(result, bool)
+                and result.bit_length() > radix.large_bits):
+            # too large for a JSON number in most decoders
+            result = radix.to_base(result, 10)
+        return {'id': record_id, 'result': result}
+
+    def eval_line(self, line):
+        ''' Evaluate a JSON encoded record, return the output record or None for blank lines. '''
+        if not line.strip():
+            return None
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            return {'id': None, 'error': {'type': 'RecordError', 'message': str(error)}}
+        return self.eval_record(record)
+
+
+def eval_lines(evaluator, lines, out, buffer_size=65536):
+    '''
+    Evaluate JSON encoded records from lines, write output records to out.
+
+    Output records are written in blocks of about buffer_size characters,
+    always ending on a complete record. Returns the number of failed records.
+    '''
+    evaluator = RecordEvaluator(evaluator)
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    failed = 0
+    buf = []
+    size = 0
+    try:
+        for line in lines:
+            output = evaluator.eval_line(line)
+            if output is None:
+                continue
+            try:
+                text = encode(output)
+            except ValueError as error:
+                # e.g. integers too large to convert to a string
+                output = {'id': output['id'], 'error': {
+                    'type': type(error).__name__, 'message': str(error)}}
+                text = encode(output)
+            if 'error' in output:
+                failed += 1
+            buf.append(text + '\n')
+            size += len(buf[-1])
+            if size >= buffer_size:
+                out.write(''.join(buf))
+                out.flush()
+                del buf[:]
+                size = 0
+    finally:
+        out.write(''.join(buf))
+        out.flush()
+    return failed
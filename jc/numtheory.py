@@ -0,0 +1,204 @@
+'''
+Number theory functions.
+
+Exact integer functions that avoid the huge intermediate results of their
+naive formulas, e.g. powmod(a, b, m) instead of a ** b % m and binom(n, k)
+instead of fact(n) / (fact(k) * fact(n - k)).
+'''
+
+import functools
+import math
+
+small_primes = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+# Miller-Rabin with the bases in small_primes is deterministic below this
+miller_rabin_limit = 3317044064679887385961981
+
+
+def as_int(x, name):
+    ''' Convert an integral number to an int, raise ValueError for other numbers. '''
+    if isinstance(x, float) and x.is_integer():
+        return int(x)
+    if isinstance(x, bool) or not isinstance(x, int):
+        raise ValueError('%s() requires integer arguments' % name)
+    return x
+
+
+def powmod(a, b, m):
+    ''' Calculate a ** b % m, b may be negative if a is invertible modulo m. '''
+    a, b, m = as_int(a, 'powmod'), as_int(b, 'powmod'), as_int(m, 'powmod')
+    if m == 0:
+        raise ValueError('powmod() modulus must not be zero')
+    if b < 0:
+        return pow(modinv(a, m), -b, m)
+    return pow(a, b, m)
+
+
+def binom(n, k):
+    ''' Calculate the binomial coefficient n choose k. '''
+    n, k = as_int(n, 'binom'), as_int(k, 'binom')
+    if n < 0 or k < 0:
+        raise ValueError('binom() arguments must be non-negative')
+    if hasattr(math, 'comb'):
+        return math.comb(n, k)
+    if k > n:
+        return 0
+    k = min(k, n - k)
+    result = 1
+    for i in range(1, k + 1):
+        result = result * (n - k + i) // i
+    return result
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return abs(a)
+
+
+def gcd(a, b, *args):
+    ''' Calculate the greatest common divisor of the arguments. '''
+    args = [as_int(x, 'gcd') for x in (a, b) + args]
+    return functools.reduce(getattr(math, 'gcd', _gcd), args)
+
+
+def lcm(a, b, *args):
+    ''' Calculate the least common multiple of the arguments. '''
+    args = [as_int(x, 'lcm') for x in (a, b) + args]
+    def lcm2(a, b):
+        if a == 0 or b == 0:
+            return 0
+        return abs(a // getattr(math, 'gcd', _gcd)(a, b) * b)
+    return functools.reduce(lcm2, args)
+
+
+def isqrt(n):
+    ''' Calculate the integer square root of n. '''
+    n = as_int(n, 'isqrt')
+    if n < 0:
+        raise ValueError('isqrt() argument must be non-negative')
+    if hasattr(math, 'isqrt'):
+        return math.isqrt(n)
+    if n == 0:
+        return 0
+    x = 1 << ((n.bit_length() + 1) >> 1)
+    while True:
+        y = (x + n // x) >> 1
+        if y >= x:
+            return x
+        x = y
+
+
+def modinv(a, m):
+    ''' Calculate the inverse of a modulo m. '''
+    a, m = as_int(a, 'modinv'), as_int(m, 'modinv')
+    if m == 0:
+        raise ValueError('modinv() modulus must not be zero')
+    # extended Euclidean algorithm
+    r0, r1 = a % m, m
+    s0, s1 = 1, 0
+    while r1:
+        q = r0 // r1
+        r0, r1 = r1, r0 - q * r1
+        s0, s1 = s1, s0 - q * s1
+    if abs(r0) != 1:
+        raise ValueError('%d is not invertible modulo %d' % (a, m))
+    return s0 * r0 % m
+
+
+def fib(n):
+    ''' Calculate the nth Fibonacci number by fast doubling. '''
+    n = as_int(n, 'fib')
+    if n < 0:
+        result = fib(-n)
+        return -result if n % 2 == 0 else result
+    a, b = 0, 1
+    for bit in bin(n)[2:]:
+        # F(2k) = F(k) * (2 F(k + 1) - F(k)), F(2k + 1) = F(k) ** 2 + F(k + 1) ** 2
+        a, b = a * (2 * b - a), a * a + b * b
+        if bit == '1':
+            a, b = b, a + b
+    return a
+
+
+def jacobi(a, n):
+    ''' Calculate the Jacobi symbol (a / n) for odd positive n. '''
+    a %= n
+    result = 1
+    while a:
+        while a % 2 == 0:
+            a //= 2
+            if n % 8 in (3, 5):
+                result = -result
+        a, n = n, a
+        if a % 4 == 3 and n % 4 == 3:
+            result = -result
+        a %= n
+    return result if n == 1 else 0
+
+
+def is_strong_probable_prime(n, a):
+    ''' Miller-Rabin test of odd n > 2 to base a. '''
+    d = n - 1
+    s = (d & -d).bit_length() - 1
+    d >>= s
+    x = pow(a, d, n)
+    if x == 1 or x == n - 1:
+        return True
+    for _ in range(s - 1):
+        x = x * x % n
+        if x == n - 1:
+            return True
+    return False
+
+
+def is_strong_lucas_probable_prime(n):
+    ''' Strong Lucas test of odd n > 2 that is not a perfect square, with Selfridge's parameters. '''
+    D = 5
+    while True:
+        j = jacobi(D, n)
+        if j == -1:
+            break
+        if j == 0 and abs(D) != n:
+            return False
+        D = -D - 2 if D > 0 else -D + 2
+    P, Q = 1, (1 - D) // 4
+
+    d = n + 1
+    s = (d & -d).bit_length() - 1
+    d >>= s
+    half = (n + 1) // 2
+    U, V, Qk = 1, P, Q
+    for bit in bin(d)[3:]:
+        U, V, Qk = U * V % n, (V * V - 2 * Qk) % n, Qk * Qk % n
+        if bit == '1':
+            U, V, Qk = (P * U + V) * half % n, (D * U + P * V) * half % n, Qk * Q % n
+    if U == 0 or V == 0:
+        return True
+    for _ in range(s - 1):
+        V, Qk = (V * V - 2 * Qk) % n, Qk * Qk % n
+        if V == 0:
+            return True
+    return False
+
+
+def isprime(n):
+    '''
+    Test if n is prime, return 1 or 0.
+
+    Deterministic below 3.3e24, above that uses the Baillie-PSW test,
+    which has no known counterexamples.
+    '''
+    n = as_int(n, 'isprime')
+    if n < 2:
+        return 0
+    for p in small_primes:
+        if n % p == 0:
+            return int(n == p)
+    if n < small_primes[-1] ** 2:
+        return 1
+    if n < miller_rabin_limit:
+        return int(all(is_strong_probable_prime(n, a) for a in small_primes))
+    if not is_strong_probable_prime(n, 2) or isqrt(n) ** 2 == n:
+        return 0
+    return int(is_strong_lucas_probable_prime(n))
@@ -0,0 +1,314 @@
+'''
+AST optimizer.
+
+Inlines small user functions, folds constant subexpressions and hoists
+repeated subexpressions so that they are evaluated once per evaluation.
+Runs between parsing and compilation, the optimized form can be inspected
+with Evaluator.optimize.
+'''
+
+import ast
+import copy
+
+
+class Let(ast.expr):
+    ''' Evaluate bindings once, then evaluate body referring to them with Ref. '''
+    _fields = ('bindings', 'body')
+
+
+class Ref(ast.expr):
+    ''' Reference to the value of a Let binding. '''
+    _fields = ('slot',)
+
+
+precedence = {
+    ast.BitOr: 1, ast.BitXor: 2, ast.BitAnd: 3,
+    ast.LShift: 4, ast.RShift: 4,
+    ast.Add: 5, ast.Sub: 5,
+    ast.Mult: 6, ast.Div: 6, ast.FloorDiv: 6, ast.Mod: 6,
+    ast.Pow: 8,
+}
+unary_precedence = 7
+atom_precedence = 9
+
+
+class Optimizer(object):
+    '''
+    Expression optimizer.
+
+    Replaces calls of small self-contained user functions with their
+    bodies, folds subtrees consisting only of literals, constants and pure
+    functions into literals, and hoists pure subexpressions that occur
+    more than once. Meta functions, functions with side effects, user
+    variables and internal variables are never folded.
+    '''
+
+    def __init__(self, evaluator):
+        self.evaluator = evaluator
+
+    def optimize(self, tree, inline=True):
+        ''' Optimize an expression tree, return the optimized tree. '''
+        if inline and self.evaluator.user_functions:
+            tree = self.inline(tree)
+        return self.hoist(self.fold(tree))
+
+    def inline(self, node):
+        ''' Replace calls of inlinable user functions in node with their bodies. '''
+        if isinstance(node, ast.UnaryOp):
+            node.operand = self.inline(node.operand)
+        elif isinstance(node, ast.BinOp):
+            node.left = self.inline(node.left)
+            node.right = self.inline(node.right)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not self._is_meta(node):
+            node.args = [self.inline(arg) for arg in node.args]
+            function = self.evaluator.user_functions.get(node.func.id)
+            if function is not None and function.inline:
+                self.evaluator._check_arity(function, len(node.args))
+                args = dict(zip(function.params, node.args))
+                return ast.copy_location(self._substitute(copy.deepcopy(function.tree), args), node)
+        return node
+
+    def _substitute(self, node, args):
+        ''' Replace the parameter names in a function body with the argument trees. '''
+        if isinstance(node, ast.Name):
+            if node.id in args:
+                return copy.deepcopy(args[node.id])
+        elif isinstance(node, ast.UnaryOp):
+            node.operand = self._substitute(node.operand, args)
+        elif isinstance(node, ast.BinOp):
+            node.left = self._substitute(node.left, args)
+            node.right = self._substitute(node.right, args)
+        elif isinstance(node, ast.Call):
+            node.args = [self._substitute(arg, args) for arg in node.args]
+        return node
+
+    def fold(self, node):
+        ''' Fold constant subtrees of node into literals. '''
+        e = self.evaluator
+        if isinstance(node, ast.Name):
+            if node.id in e.constants:
+                return self._literal(node, e.constants[node.id]['value'])
+            return node
+        elif isinstance(node, ast.UnaryOp):
+            node.operand = self.fold(node.operand)
+            if isinstance(node.operand, ast.Num):
+                return self._try_fold(node, e._get_op(node), node.operand.n)
+            return node
+        elif isinstance(node, ast.BinOp):
+            node.left = self.fold(node.left)
+            node.right = self.fold(node.right)
+            if isinstance(node.left, ast.Num) and isinstance(node.right, ast.Num):
+                return self._try_fold(node, e._get_op(node), node.left.n, node.right.n)
+            return node
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            if e.functions.get(node.func.id, {}).get('meta'):
+                return node
+            if self._is_reduction(node):
+                # the index is a name to bind, even if it is also a constant
+                node.args = [arg if i == 1 else self.fold(arg) for i, arg in enumerate(node.args)]
+                return node
+            if self._is_lazy(node):
+                # the branches may never be evaluated, folding them could be slow or fail
+                node.args[0] = self.fold(node.args[0])
+                return node
+            node.args = [self.fold(arg) for arg in node.args]
+            if (e._is_pure_func(node.func.id) and node.func.id in e.functions and
+                    not node.keywords and all(isinstance(arg, ast.Num) for arg in node.args)):
+                func = e._get_func(node.func.id)
+                return self._try_fold(node, func, *(arg.n for arg in node.args))
+            return node
+        return node
+
+    def hoist(self, tree):
+        ''' Hoist repeated pure subexpressions of tree into a Let. '''
+        nodes = [node for node in self._walk(tree) if isinstance(node, (ast.UnaryOp, ast.BinOp, ast.Call))]
+        has_scope = any(self._has_scope(node) for node in nodes)
+        if len(nodes) < 2 and not has_scope:
+            # nothing to share, e.g. a + 1
+            return tree
+
+        keys, hoistable = self._number(tree)
+        counts = {}
+        for node in nodes:
+            if id(node) in hoistable:
+                key = keys[id(node)]
+                counts[key] = counts.get(key, 0) + 1
+
+        shared = set(key for key, count in counts.items() if count > 1)
+        if not shared and not has_scope:
+            return tree
+
+        bindings = []
+        slots = {}
+        def replace(node):
+            if isinstance(node, (ast.UnaryOp, ast.BinOp, ast.Call)):
+                key = keys[id(node)]
+                if key in shared and id(node) in hoistable:
+                    if key not in slots:
+                        slots[key] = len(bindings)
+                        bindings.append(node)
+                    return ast.copy_location(Ref(slot=slots[key]), node)
+            if isinstance(node, ast.UnaryOp):
+                node.operand = replace(node.operand)
+            elif isinstance(node, ast.BinOp):
+                node.left = replace(node.left)
+                node.right = replace(node.right)
+            elif isinstance(node, ast.Call) and self._is_reduction(node):
+                # the body is evaluated in the scope of the index, hoist within it separately
+                node.args = [self.hoist(node.args[0])] + [replace(arg) for arg in node.args[1:]]
+            elif isinstance(node, ast.Call) and self._is_lazy(node):
+                # only one of the branches is evaluated, hoist within each separately
+                node.args = [replace(node.args[0])] + [self.hoist(arg) for arg in node.args[1:]]
+            elif isinstance(node, ast.Call) and not self._is_meta(node):
+                node.args = [replace(arg) for arg in node.args]
+            return node
+
+        body = replace(tree)
+        if not bindings:
+            return body
+        return ast.copy_location(Let(bindings=bindings, body=body), tree)
+
+    def _is_meta(self, node):
+        return self.evaluator.functions.get(node.func.id, {}).get('meta')
+
+    def _is_reduction(self, node):
+        return self.evaluator.functions.get(node.func.id, {}).get('reduce') and len(node.args) == 4
+
+    def _is_lazy(self, node):
+        return self.evaluator.functions.get(node.func.id, {}).get('lazy') and len(node.args) > 0
+
+    def _has_scope(self, node):
+        ''' Check if node is a call with arguments that are hoisted separately. '''
+        return (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+                (self._is_reduction(node) or self._is_lazy(node)))
+
+    def _walk(self, tree):
+        '''
+        Iterate over the nodes of tree like ast.walk, except for the bodies of
+        reductions and the branches of lazy functions.
+        '''
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            yield node
+            if self._has_scope(node):
+                stack.extend(node.args[1:] if self._is_reduction(node) else node.args[:1])
+            else:
+                stack.extend(ast.iter_child_nodes(node))
+
+    def _number(self, tree):
+        '''
+        Number the distinct subtrees of tree in one bottom-up pass.
+
+        Returns the number of each node, equal for structurally equal
+        subtrees, and the set of the nodes that are non-trivial
+        subexpressions free of side effects, both by node id. Numbers are
+        given to tuples of the node type and the numbers of the children,
+        so that big literals are never converted to strings and no
+        subtree is compared more than once.
+        '''
+        e = self.evaluator
+        numbers = {}
+        keys = {}
+        pure = set()
+        hoistable = set()
+        stack = [(tree, None)]
+        while stack:
+            node, children = stack.pop()
+            if children is None:
+                if isinstance(node, ast.UnaryOp):
+                    children = [node.operand]
+                elif isinstance(node, ast.BinOp):
+                    children = [node.left, node.right]
+                elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+                    children = node.args
+                elif isinstance(node, (ast.Num, ast.Name)):
+                    children = []
+                else:
+                    children = list(ast.iter_child_nodes(node))
+                stack.append((node, children))
+                stack.extend((child, None) for child in children)
+                continue
+
+            is_pure = all(id(child) in pure for child in children)
+            if isinstance(node, ast.Num):
+                value = node.n
+                # floats by repr, to tell 0.0 from -0.0
+                key = (ast.Num, type(value), value if isinstance(value, int) else repr(value))
+            elif isinstance(node, ast.Name):
+                key = (ast.Name, node.id)
+                is_pure = node.id not in e.internal_variables
+            elif isinstance(node, ast.UnaryOp):
+                key = (ast.UnaryOp, type(node.op), keys[id(node.operand)])
+            elif isinstance(node, ast.BinOp):
+                key = (ast.BinOp, type(node.op), keys[id(node.left)], keys[id(node.right)])
+            elif children is node.args:
+                key = (ast.Call, node.func.id) + tuple(keys[id(arg)] for arg in children)
+                is_pure = is_pure and e._is_pure_func(node.func.id)
+            else:
+                # nodes from the ast.parse fallback, only numbered to be told apart
+                key = (type(node), id(node))
+                is_pure = False
+            keys[id(node)] = numbers.setdefault(key, len(numbers))
+            if is_pure:
+                pure.add(id(node))
+                if isinstance(node, (ast.UnaryOp, ast.BinOp, ast.Call)):
+                    hoistable.add(id(node))
+        return keys, hoistable
+
+    def _literal(self, node, value):
+        return ast.copy_location(ast.Num(n=value), node)
+
+    def _try_fold(self, node, func, *args):
+        ''' Replace node with the literal value of func(*args), keep it if that fails. '''
+        try:
+            value = func(*args)
+        except Exception:
+            return node
+        if isinstance(value, bool) or not isinstance(value, (int, float, complex)):
+            return node
+        return self._literal(node, value)
+
+
+def unparse(node, symbols):
+    ''' Format an (optimized) expression tree as an expression string. '''
+    if isinstance(node, Let):
+        body = unparse(node.body, symbols)
+        bindings = ', '.join('$%d = %s' % (slot, unparse(binding, symbols))
+                             for slot, binding in enumerate(node.bindings))
+        return '%s where %s' % (body, bindings)
+    return _unparse(node, symbols)[0]
+
+
+def _unparse(node, symbols):
+    ''' Format node, return the string and its operator precedence. '''
+    if isinstance(node, ast.Num):
+        if isinstance(node.n, (int, float)) and node.n < 0:
+            return repr(node.n), unary_precedence
+        return repr(node.n), atom_precedence
+    elif isinstance(node, ast.Name):
+        return node.id, atom_precedence
+    elif isinstance(node, Ref):
+        return '$%d' % node.slot, atom_precedence
+    elif isinstance(node, Let):
+        # the body of a reduction, its slots are separate from the enclosing ones
+        return '(%s)' % unparse(node, symbols), atom_precedence
+    elif isinstance(node, ast.UnaryOp):
+        operand, operand_prec = _unparse(node.operand, symbols)
+        if operand_prec < unary_precedence:
+            operand = '(%s)' % operand
+        return symbols[type(node.op)] + operand, unary_precedence
+    elif isinstance(node, ast.BinOp):
+        prec = precedence[type(node.op)]
+        left, left_prec = _unparse(node.left, symbols)
+        right, right_prec = _unparse(node.right, symbols)
+        right_assoc = isinstance(node.op, ast.Pow)
+        if left_prec < prec or (right_assoc and left_prec == prec):
+            left = '(%s)' % left
+        if right_prec < prec or (not right_assoc and right_prec == prec):
+            right = '(%s)' % right
+        return '%s %s %s' % (left, symbols[type(node.op)], right), prec
+    elif isinstance(node, ast.Call):
+        args = ', '.join(_unparse(arg, symbols)[0] for arg in node.args)
+        return '%s(%s)' % (node.func.id, args), atom_precedence
+    raise SyntaxError('unknown operator \'%s\'' % node)
@@ -0,0 +1,223 @@
+'''
+Expression parser.
+
+A hand-written tokenizer and operator precedence parser for the expression
+grammar of jc: numbers, names, unary and binary operators, parentheses and
+function calls. It builds the same ast nodes as ast.parse (without source
+positions) in a single pass over the tokens, and parse_line also splits
+statements and recognizes assignments in the same pass. Anything outside
+of this grammar raises ParseError, and parse_expr falls back to ast.parse,
+which remains the reference for the accepted syntax and for error messages.
+'''
+
+import ast
+import keyword
+import re
+
+
+class ParseError(Exception):
+    ''' Input that this parser does not handle, ast.parse decides what it means. '''
+
+
+# numbers are matched loosely and validated when they are converted
+token_re = re.compile(r'''\s*(
+    (?:[0-9]|\.[0-9])[0-9A-Za-z_.]*(?:(?<=[eE])[-+][0-9_]+[jJ]?)?
+   |[A-Za-z_][A-Za-z0-9_]*
+   |\*\*|//|<<|>>|:=|\S
+)''', re.VERBOSE)
+
+keywords = frozenset(keyword.kwlist)
+digits = frozenset('0123456789.')
+name_chars = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+
+load = ast.Load()
+# numbers are built as ast.parse builds them: Num nodes before Python 3.8,
+# Constant nodes with kind=None since
+literal_node = type(ast.parse('1', mode='eval').body)
+literal_fields = {'kind': None} if 'kind' in literal_node._fields else {}
+
+
+def literal(value):
+    ''' Return a number node as built by ast.parse. '''
+    return literal_node(value, **literal_fields)
+
+
+# operators by symbol: precedence and node, ** is the only right associative one
+binary_ops = {
+    '|': (1, ast.BitOr()), '^': (2, ast.BitXor()), '&': (3, ast.BitAnd()),
+    '<<': (4, ast.LShift()), '>>': (4, ast.RShift()),
+    '+': (5, ast.Add()), '-': (5, ast.Sub()),
+    '*': (6, ast.Mult()), '/': (6, ast.Div()), '//': (6, ast.FloorDiv()), '%': (6, ast.Mod()),
+    '**': (8, ast.Pow()),
+}
+unary_ops = {'+': (7, ast.UAdd()), '-': (7, ast.USub()), '~': (7, ast.Invert())}
+power_precedence = 8
+
+# operator stack markers for parentheses and calls
+paren = (0, None)
+call = 0
+
+
+def number(text):
+    ''' Convert a numeric literal to its value. '''
+    try:
+        if text[:2] in ('0x', '0X', '0o', '0O', '0b', '0B'):
+            return int(text, 0)
+        if text[-1] in 'jJ':
+            return complex(0, float(text[:-1]))
+        if '.' in text or 'e' in text or 'E' in text:
+            return float(text)
+        # decimal integers other than zero cannot have leading zeros
+        if text[0] == '0' and text.strip('0_'):
+            raise ParseError(text)
+        return int(text)
+    except ValueError:
+        # invalid literals, or integers that exceed the string conversion limit
+        raise ParseError(text)
+
+
+def reduce_ops(operators, operands, precedence):
+    ''' Apply the operators on top of the stack that bind at least as tight as precedence. '''
+    while operators and operators[-1][0] >= precedence:
+        entry = operators.pop()
+        if len(entry) == 3:
+            operands[-1] = ast.UnaryOp(entry[1], operands[-1])
+        else:
+            right = operands.pop()
+            operands[-1] = ast.BinOp(operands[-1], entry[1], right)
+
+
+def parse_tokens(tokens):
+    '''
+    Parse a list of token strings into an ast node.
+
+    An operator precedence parser: operands and pending operators are kept
+    on two stacks, and operators are applied as soon as an operator that
+    binds less tightly (or a closing parenthesis) follows them.
+    '''
+    operands = []
+    operators = []
+    expect_operand = True
+    last = None
+    for token in tokens:
+        if expect_operand:
+            first = token[0]
+            if first in digits:
+                operands.append(literal(number(token)))
+                expect_operand = False
+            elif first in name_chars:
+                if token in keywords:
+                    raise ParseError('keyword \'%s\'' % token)
+                operands.append(ast.Name(token, load))
+                expect_operand = False
+            elif token in unary_ops:
+                precedence, op = unary_ops[token]
+                operators.append((precedence, op, True))
+            elif token == '(':
+                operators.append(paren)
+            elif token == ')' and operators and operators[-1][0] == call and \
+                    (last == ',' or len(operands) == operators[-1][1]):
+                # f() or a trailing comma as in f(x,)
+                entry = operators.pop()
+                args = operands[entry[1]:]
+                del operands[entry[1]:]
+                operands[-1] = ast.Call(operands[-1], args, [])
+                expect_operand = False
+            else:
+                raise ParseError('unexpected \'%s\'' % token)
+        elif token in binary_ops:
+            precedence, op = binary_ops[token]
+            # ** is right associative and binds tighter than a unary operator on its left
+            reduce_ops(operators, operands, precedence + (precedence == power_precedence))
+            operators.append((precedence, op))
+            expect_operand = True
+        elif token == '(':
+            operators.append((call, len(operands), None))
+            expect_operand = True
+        elif token == ')' or token == ',':
+            reduce_ops(operators, operands, 1)
+            if not operators:
+                raise ParseError('unexpected \'%s\'' % token)
+            if operators[-1] is paren:
+                if token == ',':
+                    raise ParseError('unexpected \',\'')
+                operators.pop()
+            elif token == ')':
+                entry = operators.pop()
+                args = operands[entry[1]:]
+                del operands[entry[1]:]
+                operands[-1] = ast.Call(operands[-1], args, [])
+            else:
+                expect_operand = True
+        else:
+            raise ParseError('unexpected \'%s\'' % token)
+        last = token
+
+    if expect_operand:
+        raise ParseError('unexpected end of expression')
+    reduce_ops(operators, operands, 1)
+    if operators:
+        raise ParseError('unclosed \'(\'')
+    return operands[0]
+
+
+def parse(text):
+    ''' Parse an expression into an ast node, raise ParseError if it is outside of the grammar. '''
+    return parse_tokens(token_re.findall(text))
+
+
+def parse_expr(text):
+    ''' Parse an expression into an ast node, using ast.parse if parse cannot handle it. '''
+    try:
+        return parse(text)
+    except ParseError:
+        return ast.parse(text, mode='eval').body
+
+
+def parse_line(text):
+    '''
+    Split a line into statements on semicolons outside of parentheses and parse them.
+
+    Returns a list of (kind, name, tree, text) tuples, one per non-empty
+    statement, where text is the statement. Kind is 'assign' (name = tree),
+    'formula' (name := tree) or 'expr'. Kind 'source' marks statements that
+    are left to the evaluator, e.g. ones that start with an operator and so
+    may continue ans, or that are outside of the grammar.
+    '''
+    tokens = []
+    offsets = []
+    for token in token_re.finditer(text):
+        tokens.append(token.group(1))
+        offsets.append(token.start(1))
+    offsets.append(len(text))
+    statements = []
+    depth = 0
+    start = 0
+    for end, token in enumerate(tokens + [None]):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(depth - 1, 0)
+        elif (token == ';' and depth == 0) or token is None:
+            if end > start:
+                statement = text[offsets[start]:offsets[end]].rstrip()
+                statements.append(parse_statement(tokens[start:end]) + (statement,))
+            start = end + 1
+    return statements
+
+
+def parse_statement(tokens):
+    ''' Parse the tokens of a statement, return (kind, name, tree). '''
+    first = tokens[0][0]
+    try:
+        if len(tokens) > 2 and tokens[1] in ('=', ':=') and first in name_chars:
+            kind = 'assign' if tokens[1] == '=' else 'formula'
+            if tokens[0] in keywords:
+                raise ParseError('keyword \'%s\'' % tokens[0])
+            return (kind, tokens[0], parse_tokens(tokens[2:]))
+        # whether an expression continues ans is decided when it is evaluated
+        if first in digits or first in name_chars or first == '(':
+            return ('expr', None, parse_tokens(tokens))
+    except ParseError:
+        pass
+    return ('source', None, None)
@@ -0,0 +1,125 @@
+'''
+Evaluation profiling.
+
+Records the time spent in each stage of evaluation (parsing, optimizing,
+compiling, evaluating, converting and printing results), evaluation
+counts by AST node type and call counts and times per function. An
+evaluator only instruments its compiled expressions when it is created
+with a profiler, so there is no overhead when profiling is disabled.
+'''
+
+import json
+import sys
+import time
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class NullStage(object):
+    ''' Stage context that records nothing. '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+null_stage = NullStage()
+
+
+class Stage(object):
+    ''' Context that adds the time spent in it to a stage of a profiler. '''
+
+    def __init__(self, totals):
+        self.totals = totals
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.totals[0] += 1
+        self.totals[1] += clock() - self.start
+        return False
+
+
+class Profiler(object):
+    '''
+    Evaluation profiler.
+
+    stages and functions map names to [calls, seconds], nodes maps AST
+    node type names to evaluation counts. Function times include the time
+    spent in nested function calls, calls of memoized functions answered
+    from the cache are not counted.
+    '''
+
+    def __init__(self):
+        self.stages = {}
+        self.functions = {}
+        self.nodes = {}
+
+    def stage(self, name):
+        ''' Return a context that times a stage. '''
+        return Stage(self.stages.setdefault(name, [0, 0.]))
+
+    def count(self, name, compiled):
+        ''' Wrap a compiled node to count its evaluations. '''
+        nodes = self.nodes
+        nodes.setdefault(name, 0)
+        def counted(scope):
+            nodes[name] += 1
+            return compiled(scope)
+        return counted
+
+    def timed(self, name, func):
+        ''' Wrap a function to count and time its calls. '''
+        totals = self.functions.setdefault(name, [0, 0.])
+        def timed(*args):
+            start = clock()
+            try:
+                return func(*args)
+            finally:
+                totals[0] += 1
+                totals[1] += clock() - start
+        return timed
+
+    def as_dict(self):
+        ''' Return the recorded statistics as a JSON serializable dict. '''
+        def timings(totals):
+            return dict((name, {'calls': calls, 'seconds': round(seconds, 9)})
+                        for name, (calls, seconds) in totals.items())
+        return {
+            'stages': timings(self.stages),
+            'functions': timings(self.functions),
+            'nodes': dict(self.nodes),
+        }
+
+    def format(self):
+        ''' Format the recorded statistics as a table. '''
+        lines = ['%-12s %10s %12s' % ('stage', 'calls', 'ms')]
+        for name, (calls, seconds) in sorted(self.stages.items()):
+            lines.append('%-12s %10d %12.3f' % (name, calls, seconds * 1000))
+        if self.functions:
+            lines.append('')
+            lines.append('%-12s %10s %12s' % ('function', 'calls', 'ms'))
+            for name, (calls, seconds) in sorted(self.functions.items(), key=lambda item: -item[1][1]):
+                lines.append('%-12s %10d %12.3f' % (name, calls, seconds * 1000))
+        if self.nodes:
+            lines.append('')
+            lines.append('%-12s %10s' % ('node', 'evals'))
+            for name, count in sorted(self.nodes.items(), key=lambda item: -item[1]):
+                lines.append('%-12s %10d' % (name, count))
+        return '\n'.join(lines)
+
+    def dump(self, path=None):
+        ''' Write the recorded statistics as JSON to path, or to stderr if path is None. '''
+        text = json.dumps(self.as_dict(), indent=2, sort_keys=True) + '\n'
+        if path is None:
+            sys.stderr.write(text)
+            return
+        try:
+            with open(path, 'w') as f:
+                f.write(text)
+        except (IOError, OSError) as error:
+            sys.stderr.write('warning: failed to write profile to %s: %s\n' % (path, error))
@@ -0,0 +1,122 @@
+'''
+Integer to string conversion in bases 2 to 36.
+
+Large integers are converted by divide and conquer: the integer is split
+by powers of the base into halves that are converted independently, and
+the digits are produced as a stream of chunks, most significant first.
+Powers of two are split with shifts, other bases with the decimal
+module when its C implementation is available, as its division is
+subquadratic on large operands.
+'''
+
+import math
+
+digit_chars = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+# integers up to this size are converted in one go
+large_bits = 8192
+
+# size of the pieces converted without splitting further
+leaf_bits = 1024
+
+formats = {2: 'b', 8: 'o', 10: 'd', 16: 'x'}
+
+
+def small_to_base(n, base):
+    ''' Convert a small non-negative integer to a string in base. '''
+    if base in formats:
+        return format(n, formats[base])
+    digits = []
+    while n:
+        n, digit = divmod(n, base)
+        digits.append(digit_chars[digit])
+    return ''.join(reversed(digits)) or '0'
+
+
+def c_decimal():
+    ''' Return the C implementation of the decimal module, None if it is not available. '''
+    try:
+        import _decimal
+    except ImportError:
+        return None
+    return _decimal
+
+
+def iter_digits(n, base, leaf_bits=leaf_bits):
+    ''' Yield the digits of integer n in base as strings, most significant first. '''
+    if n < 0:
+        yield '-'
+        n = -n
+    if n.bit_length() <= leaf_bits:
+        yield small_to_base(n, base)
+        return
+
+    # number of digits in a leaf
+    width = max(1, int(leaf_bits / math.log(base, 2)))
+    if base & (base - 1) == 0:
+        # split at powers of two with shifts
+        shift = width * (base.bit_length() - 1)
+        splitters = [shift]
+        while splitters[-1] < n.bit_length():
+            splitters.append(2 * splitters[-1])
+        def split(n, k):
+            return n >> splitters[k], n & ((1 << splitters[k]) - 1)
+    elif c_decimal() is not None:
+        decimal = c_decimal()
+        context = decimal.Context(prec=decimal.MAX_PREC, Emax=decimal.MAX_EMAX,
+                                  Emin=decimal.MIN_EMIN)
+        n = to_decimal(n, context)
+        splitters = [context.power(base, width)]
+        while splitters[-1] <= n:
+            splitters.append(context.multiply(splitters[-1], splitters[-1]))
+        def split(n, k):
+            return context.divmod(n, splitters[k])
+    else:
+        splitters = [base ** width]
+        while splitters[-1] <= n:
+            splitters.append(splitters[-1] * splitters[-1])
+        def split(n, k):
+            return divmod(n, splitters[k])
+
+    # convert n < base ** (width * 2 ** k), padding with zeros to the full width if pad
+    stack = [(n, len(splitters) - 1, False)]
+    while stack:
+        n, k, pad = stack.pop()
+        if k == 0:
+            digits = small_to_base(int(n), base)
+            yield digits.zfill(width) if pad else digits
+            continue
+        hi, lo = split(n, k - 1)
+        stack.append((lo, k - 1, pad or bool(hi)))
+        if hi or pad:
+            stack.append((hi, k - 1, pad))
+
+
+def to_decimal(n, context, leaf_bits=4096):
+    ''' Convert a non-negative integer to a Decimal in subquadratic time. '''
+    powers = {}
+    def power_of_two(bits):
+        if bits not in powers:
+            if bits <= leaf_bits:
+                powers[bits] = context.create_decimal(1 << bits)
+            else:
+                half = power_of_two(bits >> 1)
+                powers[bits] = context.multiply(half, half)
+                if bits & 1:
+                    powers[bits] = context.multiply(powers[bits], 2)
+        return powers[bits]
+    def convert(n, bits):
+        if bits <= leaf_bits:
+            return context.create_decimal(n)
+        half = bits >> 1
+        hi = n >> half
+        lo = n - (hi << half)
+        return context.add(context.multiply(convert(hi, bits - half), power_of_two(half)),
+                           convert(lo, half))
+    return convert(n, n.bit_length())
+
+
+def to_base(n, base):
+    ''' Convert integer n to a string in base. '''
+    return ''.join(iter_digits(n, base))
+
@@ -0,0 +1,180 @@
+'''
+Script files.
+
+Runs jc scripts from files (jc -f script.jc). A script is parsed once:
+its statements are classified and their expressions parsed. The result is
+cached on disk, keyed by a hash of the script, the jc version and the
+Python version. Assignment targets are validated and trees are optimized
+when each statement is reached, as both depend on the session and the
+budget, so running an unchanged script again skips parsing only.
+
+Statements that cannot be compiled in advance (e.g. function definitions,
+syntax errors and expressions continuing ans) are kept as source and
+evaluated as usual, so their errors are reported when they are reached.
+'''
+
+import hashlib
+import os
+import pickle
+import sys
+
+from . import __version__
+from . import parser
+from .evaluator import assign_re, formula_re
+
+cache_suffix = '.jcc'
+
+# changed when the layout of cached scripts changes
+cache_format = 2
+
+
+def cache_dir():
+    ''' Return the script cache directory, $JC_CACHE_DIR or a per-user default. '''
+    path = os.environ.get('JC_CACHE_DIR')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'jc')
+
+
+def cache_key(data):
+    ''' Return the cache key of script contents (bytes). '''
+    key = hashlib.sha256()
+    key.update(('jc %s python %d.%d format %d\n' % (
+        (__version__,) + tuple(sys.version_info[:2]) + (cache_format,))).encode('ascii'))
+    key.update(data)
+    return key.hexdigest()
+
+
+def parse_stmt(evaluator, expr):
+    ''' Parse a statement into a (kind, name, source, tree) tuple, None if it is empty. '''
+    expr = expr.strip()
+    if expr.startswith('#') or len(expr) == 0:
+        return None
+
+    formula_assign = formula_re.match(expr)
+    if formula_assign is not None:
+        return ('formula', formula_assign.group('var'), formula_assign.group('val').strip(), None)
+
+    try:
+        var_assign = assign_re.search(expr)
+        if var_assign is not None:
+            var_name = var_assign.group('var').strip()
+            var_value = var_assign.group('val').strip()
+            return ('assign', var_name, expr, parser.parse_expr(var_value))
+        # whether an expression continues ans depends on ans at run time
+        if expr[0] not in evaluator.symbols:
+            return ('expr', None, expr, parser.parse_expr(expr))
+    except Exception:
+        pass
+    return ('source', None, expr, None)
+
+
+def parse_script_line(evaluator, line):
+    ''' Parse the statements of a line into a tuple of (kind, name, source, tree) tuples. '''
+    parsed = []
+    for kind, name, tree, text in parser.parse_line(line):
+        if kind in ('source', 'formula'):
+            statement = parse_stmt(evaluator, text)
+            if statement is not None:
+                parsed.append(statement)
+            continue
+        parsed.append((kind, name, text, tree))
+    return tuple(parsed)
+
+
+def parse_script(evaluator, source):
+    ''' Parse script source into a list of (lineno, statements) tuples. '''
+    lines = []
+    for lineno, line in enumerate(source.splitlines(), 1):
+        statements = parse_script_line(evaluator, line)
+        if statements:
+            lines.append((lineno, statements))
+    return lines
+
+
+def compile_stmt(evaluator, statement):
+    '''
+    Validate and optimize a parsed statement for the session of evaluator.
+
+    Statements that fail are kept as source, so that their errors are
+    reported as by the evaluator.
+    '''
+    kind, name, source, tree = statement
+    if tree is None:
+        return statement
+    if evaluator.budget is not None:
+        evaluator.budget.start()
+    try:
+        if kind == 'assign':
+            evaluator._validate_var(name)
+        # the cache outlives the user functions of the session, calls of them are not inlined
+        return (kind, name, source, evaluator._optimize(tree, inline=False))
+    except Exception:
+        return ('source', None, source, None)
+
+
+def read_cache(path, key):
+    ''' Return the parsed script cached at path, None if it is missing or invalid. '''
+    try:
+        with open(path, 'rb') as f:
+            cached_key, lines = pickle.load(f)
+    except Exception:
+        return None
+    return lines if cached_key == key else None
+
+
+def write_cache(path, key, lines):
+    ''' Write a parsed script to the cache, ignoring failures. '''
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), 0o700)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((key, lines), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+    except (IOError, OSError, pickle.PicklingError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load(evaluator, path, use_cache=True):
+    ''' Read and parse the script at path, return a list of (lineno, statements) tuples. '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not use_cache:
+        return parse_script(evaluator, data.decode('utf-8'))
+
+    # parsed trees do not depend on the session or the budget, only they are cached
+    key = cache_key(data)
+    cache_path = os.path.join(cache_dir(), key + cache_suffix)
+    lines = read_cache(cache_path, key)
+    if lines is None:
+        lines = parse_script(evaluator, data.decode('utf-8'))
+        write_cache(cache_path, key, lines)
+    return lines
+
+
+def eval_stmt(evaluator, statement):
+    ''' Evaluate a parsed statement, return its result. '''
+    # compiled when reached, against the session as left by the statements before
+    kind, name, source, tree = compile_stmt(evaluator, statement)
+    if kind == 'source':
+        return evaluator._eval_stmt(source)
+    if evaluator.budget is not None:
+        evaluator.budget.start()
+    if kind == 'expr':
+        return evaluator._eval_compiled(evaluator._compile_tree(tree))
+    if kind == 'assign':
+        evaluator._set_var(name, evaluator._compile_tree(tree)(evaluator.variables))
+    else:
+        evaluator._assign_formula(name, source)
+    return None
+
+
+def iter_eval(evaluator, statements):
+    ''' Evaluate parsed statements one by one, yield their results. '''
+    for statement in statements:
+        result = eval_stmt(evaluator, statement)
+        if result is not None:
+            yield result
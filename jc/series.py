@@ -0,0 +1,200 @@
+'''
+Series reductions.
+
+sum, prod, min and max of an expression over an integer range of an index
+variable, e.g. sum(i ** 2, i, 1, 1000000). The body is compiled once and
+evaluated in a loop, or not at all when it is a polynomial in the index
+with integer coefficients and the reduction has a closed form: sums use
+Faulhaber's formula, products of the index factorials and minima and
+maxima of polynomials up to degree two are found among a few candidates.
+
+Sums are exact: integers are added as integers and floats with math.fsum.
+'''
+
+import ast
+import fractions
+import math
+
+from . import optimizer
+
+# polynomials of higher degree are summed term by term
+max_degree = 32
+
+_bernoulli = [fractions.Fraction(1)]
+
+
+def bernoulli(n):
+    ''' Return the nth Bernoulli number, with B(1) = -1/2. '''
+    while len(_bernoulli) <= n:
+        m = len(_bernoulli)
+        _bernoulli.append(-sum(math.factorial(m + 1) // (math.factorial(k) * math.factorial(m + 1 - k)) * b
+                               for k, b in enumerate(_bernoulli)) / (m + 1))
+    return _bernoulli[n]
+
+
+def power_sum(p, n):
+    ''' Faulhaber's polynomial S(n) = 1 ** p + ... + n ** p, for any integer n. '''
+    total = fractions.Fraction(0)
+    binom = 1
+    for j in range(p + 1):
+        # B(1) = +1/2 in this form of the formula
+        b = -bernoulli(1) if j == 1 else bernoulli(j)
+        total += binom * b * n ** (p + 1 - j)
+        binom = binom * (p + 1 - j) // (j + 1)
+    return total / (p + 1)
+
+
+def polynomial(node, index, refs=()):
+    '''
+    Return the coefficients of node as a polynomial in the name index,
+    lowest degree first, or None if it is not a polynomial with integer
+    coefficients of degree up to max_degree.
+    '''
+    if isinstance(node, optimizer.Let):
+        refs = []
+        for binding in node.bindings:
+            refs.append(polynomial(binding, index, refs))
+        return polynomial(node.body, index, refs)
+    elif isinstance(node, optimizer.Ref):
+        return refs[node.slot]
+    elif isinstance(node, ast.Num):
+        value = node.n
+        if isinstance(value, bool) or not isinstance(value, int):
+            return None
+        return [value]
+    elif isinstance(node, ast.Name):
+        return [0, 1] if node.id == index else None
+    elif isinstance(node, ast.UnaryOp):
+        operand = polynomial(node.operand, index, refs)
+        if operand is None or not isinstance(node.op, (ast.UAdd, ast.USub)):
+            return None
+        return [-c for c in operand] if isinstance(node.op, ast.USub) else operand
+    elif not isinstance(node, ast.BinOp):
+        return None
+
+    left = polynomial(node.left, index, refs)
+    if left is None:
+        return None
+    if isinstance(node.op, ast.Pow):
+        if not isinstance(node.right, ast.Num) or isinstance(node.right.n, bool) or \
+                not isinstance(node.right.n, int) or not 0 <= node.right.n <= max_degree:
+            return None
+        result = [1]
+        for _ in range(node.right.n):
+            result = multiply(result, left)
+            if len(result) > max_degree + 1:
+                return None
+        return result
+    right = polynomial(node.right, index, refs)
+    if right is None:
+        return None
+    if isinstance(node.op, ast.Add):
+        return add(left, right)
+    elif isinstance(node.op, ast.Sub):
+        return add(left, [-c for c in right])
+    elif isinstance(node.op, ast.Mult):
+        result = multiply(left, right)
+        return result if len(result) <= max_degree + 1 else None
+    return None
+
+
+def add(p, q):
+    if len(p) < len(q):
+        p, q = q, p
+    return [c + (q[i] if i < len(q) else 0) for i, c in enumerate(p)]
+
+
+def multiply(p, q):
+    result = [0] * (len(p) + len(q) - 1)
+    for i, a in enumerate(p):
+        for j, b in enumerate(q):
+            result[i + j] += a * b
+    return result
+
+
+def evaluate(poly, x):
+    ''' Evaluate a polynomial at x by Horner's method. '''
+    result = 0
+    for c in reversed(poly):
+        result = result * x + c
+    return result
+
+
+def exact_sum(terms):
+    ''' Sum numbers exactly: integers as integers, floats with math.fsum. '''
+    total = 0
+    floats = []
+    imag = []
+    for term in terms:
+        if isinstance(term, int):
+            total += term
+        elif isinstance(term, float):
+            floats.append(term)
+        elif isinstance(term, complex):
+            floats.append(term.real)
+            imag.append(term.imag)
+        else:
+            total += term
+    if imag:
+        return complex(total + math.fsum(floats), math.fsum(imag))
+    if floats:
+        return total + math.fsum(floats)
+    return total
+
+
+def reduce_sum(terms, poly, a, b):
+    '''
+    Sum of the terms for the index running from a to b.
+
+    terms() iterates over the values of the body, poly is the body as a
+    polynomial in the index (see polynomial) or None.
+    '''
+    if b < a:
+        return 0
+    if poly is None:
+        return exact_sum(terms())
+    total = sum(c * (power_sum(p, b) - power_sum(p, a - 1)) for p, c in enumerate(poly) if c)
+    return int(total)
+
+
+def reduce_prod(terms, poly, a, b):
+    ''' Product of the terms for the index running from a to b. '''
+    if b < a:
+        return 1
+    if poly is not None and len(poly) == 1:
+        return poly[0] ** (b - a + 1)
+    if poly == [0, 1]:
+        if a <= 0 <= b:
+            return 0
+        if a > 0:
+            return math.factorial(b) // math.factorial(a - 1)
+        # a product of negative numbers
+        sign = -1 if (b - a + 1) % 2 else 1
+        return sign * (math.factorial(-a) // math.factorial(-b - 1))
+    result = 1
+    for term in terms():
+        result *= term
+    return result
+
+
+def extremum(terms, poly, a, b, func, name):
+    if b < a:
+        raise ValueError('%s() of an empty range' % name)
+    if poly is None or len(poly) > 3:
+        return func(terms())
+    candidates = set([a, b])
+    if len(poly) == 3 and poly[2]:
+        # the vertex of a parabola
+        vertex = fractions.Fraction(-poly[1], 2 * poly[2])
+        candidates.update(x for x in (math.floor(vertex), math.ceil(vertex)) if a <= x <= b)
+    return func(evaluate(poly, x) for x in candidates)
+
+
+def reduce_min(terms, poly, a, b):
+    ''' Minimum of the terms for the index running from a to b. '''
+    return extremum(terms, poly, a, b, min, 'min')
+
+
+def reduce_max(terms, poly, a, b):
+    ''' Maximum of the terms for the index running from a to b. '''
+    return extremum(terms, poly, a, b, max, 'max')
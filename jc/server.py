@@ -0,0 +1,185 @@
+'''
+Evaluator daemon.
+
+Keeps warm evaluators, with their compilation and memoization caches,
+alive behind a Unix domain socket, so that repeated single calculations
+skip building an evaluator from scratch. Named sessions keep their
+variables between calls.
+
+The protocol is line-delimited JSON. A request is an object with the
+expression in "expr" and an optional session name in "session", the
+response has the printed output in "output" and, if the evaluation
+failed, the error message in "error".
+'''
+
+import contextlib
+import io
+import json
+import os
+import signal
+import stat
+import sys
+
+from .budget import Budget
+from .cli import write_result
+
+# limit for a single request line
+max_request_size = 16 * 1024 * 1024
+
+# time limit of a statement if the evaluator has no budget, evaluation runs
+# on the event loop and one expensive request would stall every client
+default_timeout = 10
+
+
+def socket_path():
+    ''' Return the path of the daemon socket of the current user. '''
+    path = os.environ.get('JC_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'jc.sock')
+    return os.path.join(os.environ.get('TMPDIR', '/tmp'), 'jc-%d.sock' % os.getuid())
+
+
+def is_private(path):
+    ''' Check that path is a socket of the current user that no one else can connect to. '''
+    st = os.lstat(path)
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+def connect(path=None):
+    '''
+    Connect to the daemon listening on path, return None if there is none.
+
+    Sockets of other users are ignored, e.g. one created in a shared /tmp
+    to answer in place of the daemon.
+    '''
+    path = path or socket_path()
+    if not os.path.exists(path) or not is_private(path):
+        return None
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (IOError, OSError):
+        sock.close()
+        return None
+    return sock
+
+
+def request(sock, message):
+    ''' Send a request to the daemon, return its response. '''
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+    with sock.makefile('rb') as f:
+        line = f.readline()
+    if not line:
+        raise IOError('connection closed by the daemon')
+    return json.loads(line.decode('utf-8'))
+
+
+class Server(object):
+    '''
+    Evaluator daemon.
+
+    Evaluates requests on clones of a template evaluator. Requests without
+    a session share one scratch evaluator whose state is reset before each
+    request, so they keep the warm compilation cache without leaking
+    variables between calls. Evaluation runs on the event loop thread,
+    clients are served concurrently but evaluated one at a time, with a
+    time limit of default_timeout seconds per statement unless the
+    evaluator has a budget.
+    '''
+
+    def __init__(self, evaluator):
+        if evaluator.budget is None:
+            evaluator = evaluator.clone()
+            evaluator.budget = Budget(max_time=default_timeout)
+        self.template = evaluator
+        self.sessions = {}
+        self.scratch = evaluator.clone()
+
+    def session(self, name=None):
+        ''' Return the evaluator of a named session, or the reset scratch evaluator. '''
+        if name is None:
+            e = self.scratch
+            e._copy_state(self.template)
+            return e
+        if name not in self.sessions:
+            self.sessions[name] = self.template.clone()
+        return self.sessions[name]
+
+    def handle_request(self, message):
+        ''' Evaluate a request, return the response. '''
+        if not isinstance(message, dict) or not isinstance(message.get('expr'), str):
+            return {'output': '', 'error': 'invalid request'}
+        session = message.get('session')
+        if session is not None and not isinstance(session, str):
+            return {'output': '', 'error': 'invalid session name'}
+
+        e = self.session(session)
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                # large integers are written as in the CLI, in chunks
+                for result in e.eval(message['expr']):
+                    write_result(result)
+        except Exception as error:
+            return {'output': output.getvalue(), 'error': str(error)}
+        return {'output': output.getvalue()}
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = self.handle_request(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    response = {'output': '', 'error': 'invalid request'}
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (IOError, OSError, ValueError):
+            # disconnected client or request over max_request_size
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path):
+        import asyncio
+        # only the owner may connect to the socket
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.handle_client, path,
+                                                     limit=max_request_size)
+        finally:
+            os.umask(umask)
+        async with server:
+            await server.serve_forever()
+
+
+def serve(evaluator, path=None):
+    ''' Serve evaluator on a Unix domain socket at path until interrupted. '''
+    # asyncio is imported here to keep it out of the client
+    import asyncio
+
+    path = path or socket_path()
+    sock = connect(path)
+    if sock is not None:
+        sock.close()
+        raise RuntimeError('a jc daemon is already running at %s' % path)
+    if os.path.exists(path):
+        if os.lstat(path).st_uid != os.getuid():
+            raise RuntimeError('%s belongs to another user' % path)
+        # left behind by a daemon that did not exit cleanly
+        os.remove(path)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        asyncio.run(Server(evaluator).serve(path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,127 @@
+'''
+Session snapshots.
+
+Saves the user namespace (variables, formulas and functions), ans and the output
+base of an evaluator to a compact binary file and restores them, so that
+the values of a long prelude do not have to be computed again on every
+run. Integers of any size are stored exactly.
+
+A snapshot starts with a magic number, the format version and a CRC-32
+checksum of the marshal encoded state. Snapshots with another format
+version or a checksum mismatch are rejected. Snapshots are meant to be
+trusted local files, they are not protected against deliberate tampering.
+'''
+
+import marshal
+import os
+import struct
+import zlib
+
+from . import __version__
+
+magic = b'JCSS'
+format_version = 1
+header = struct.Struct('<4sHI')
+
+# marshal format version, supported by all Python versions
+marshal_version = 2
+
+number_types = (int, float, complex)
+
+
+class SessionError(ValueError):
+    pass
+
+
+def encode(evaluator):
+    ''' Encode the session state of an evaluator as snapshot bytes. '''
+    state = {
+        'jc': __version__,
+        'ans': evaluator.ans,
+        'base': evaluator.internal_variables['_base'],
+        'variables': evaluator.variables,
+        'formulas': dict((name, formula.expr) for name, formula in evaluator.formulas.items()),
+        'functions': [(function.name, list(function.params), function.expr, function.memo)
+                      for function in evaluator.user_functions.values()],
+    }
+    payload = marshal.dumps(state, marshal_version)
+    return header.pack(magic, format_version, zlib.crc32(payload) & 0xffffffff) + payload
+
+
+def decode(data):
+    ''' Decode and validate snapshot bytes, return the session state. '''
+    if len(data) < header.size:
+        raise SessionError('not a jc session snapshot')
+    file_magic, version, checksum = header.unpack(data[:header.size])
+    if file_magic != magic:
+        raise SessionError('not a jc session snapshot')
+    if version != format_version:
+        raise SessionError('unsupported session snapshot version %d (expected %d)'
+                           % (version, format_version))
+    payload = data[header.size:]
+    if zlib.crc32(payload) & 0xffffffff != checksum:
+        raise SessionError('session snapshot is corrupted (checksum mismatch)')
+
+    try:
+        state = marshal.loads(payload)
+    except (EOFError, ValueError, TypeError):
+        raise SessionError('session snapshot is corrupted')
+    if not isinstance(state, dict) or not isinstance(state.get('variables'), dict) or \
+            not isinstance(state.get('formulas'), dict) or not isinstance(state.get('functions', []), list):
+        raise SessionError('session snapshot is corrupted')
+    values = list(state['variables'].values())
+    if state['ans'] is not None:
+        values.append(state['ans'])
+    if not all(isinstance(value, number_types) for value in values):
+        raise SessionError('session snapshot contains unsupported values')
+    return state
+
+
+def save(evaluator, path):
+    ''' Save the session state of an evaluator to path, replacing it atomically. '''
+    data = encode(evaluator)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load(evaluator, path):
+    ''' Replace the session state of an evaluator with the snapshot at path. '''
+    with open(path, 'rb') as f:
+        state = decode(f.read())
+
+    # validate everything before replacing the current state
+    for name in list(state['variables']) + list(state['formulas']):
+        if name not in evaluator.user_functions:
+            evaluator._validate_var(name)
+    if state['base'] not in range(2, 37):
+        raise SessionError('session snapshot is corrupted')
+    # functions are parsed again from their source, in the order they were defined
+    functions = []
+    for name, params, expr, memo in state.get('functions', []):
+        functions.append(evaluator._parse_function(name, params, expr, memo))
+
+    evaluator.internal_variables['_base'] = state['base']
+    evaluator.variables = {}
+    evaluator.formulas = {}
+    evaluator._dependents = {}
+    evaluator.user_functions = dict((function.name, function) for function in functions)
+    evaluator._compiled.clear()
+    evaluator._compile_functions()
+    for name, value in state['variables'].items():
+        evaluator.variables[name] = value
+        if evaluator._completer is not None:
+            evaluator._completer.add_content(name)
+    for function in functions:
+        if evaluator._completer is not None:
+            evaluator._completer.add_content(function.name + '(')
+    # formulas are compiled again from their source, their values are computed when read
+    for name, expr in state['formulas'].items():
+        evaluator._assign_formula(name, expr)
+    evaluator.ans = state['ans']
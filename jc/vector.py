@@ -0,0 +1,216 @@
+'''
+Vectorized column evaluation.
+
+Binds a variable to a whole column of values and evaluates the expression
+tree once over arrays instead of once per value. Uses NumPy for columns of
+floats when it is installed, and elementwise batching over array module
+arrays otherwise: NumPy integers are fixed width and would silently wrap
+around where jc integers grow.
+'''
+
+import array
+import ast
+import itertools
+import math
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# in-place operators would modify the bound column when it is a mutable array
+array_operators = {
+    operator.iand: operator.and_,
+    operator.ior:  operator.or_,
+    operator.ixor: operator.xor,
+}
+
+if numpy is not None:
+    array_functions = {
+        'abs':   numpy.absolute,
+        'acos':  numpy.arccos,
+        'acosh': numpy.arccosh,
+        'asin':  numpy.arcsin,
+        'asinh': numpy.arcsinh,
+        'atan':  numpy.arctan,
+        'atanh': numpy.arctanh,
+        'cbrt':  lambda x: x ** (1. / 3),
+        'ceil':  numpy.ceil,
+        'cos':   numpy.cos,
+        'deg':   numpy.degrees,
+        'exp':   numpy.exp,
+        'floor': numpy.floor,
+        'fmod':  numpy.fmod,
+        'hyp':   numpy.hypot,
+        'ln':    numpy.log,
+        'log':   lambda x, base=math.e: numpy.log(x) / numpy.log(base),
+        'log2':  numpy.log2,
+        'log10': numpy.log10,
+        'nrt':   lambda n, x: x ** (1. / n),
+        'pmov':  lambda x, a, b: a + x * (b - a),
+        'rad':   numpy.radians,
+        'round': numpy.around,
+        'sin':   numpy.sin,
+        'sqrt':  numpy.sqrt,
+        'tan':   numpy.tan,
+    }
+else:
+    array_functions = {}
+
+int64_range = (-2 ** 63, 2 ** 63 - 1)
+
+
+def can_vectorize(values):
+    ''' Check if a column can be evaluated with NumPy with the same results as one by one. '''
+    return numpy is not None and all(type(value) is float for value in values)
+
+
+def to_array(values, vectorized=False):
+    ''' Convert values to a column, using the most compact representation available. '''
+    if vectorized:
+        return numpy.asarray(values, dtype=float)
+    values = list(values)
+    if all(type(value) is int for value in values):
+        if not values or int64_range[0] <= min(values) and max(values) <= int64_range[1]:
+            return array.array('q', values)
+    elif all(type(value) in (int, float) for value in values):
+        return array.array('d', values)
+    return values
+
+
+def is_column(value):
+    ''' Check if value is a column rather than a scalar. '''
+    if numpy is not None and isinstance(value, numpy.ndarray):
+        return True
+    return isinstance(value, (array.array, list))
+
+
+def elementwise(func, vectorized=False):
+    '''
+    Make func apply elementwise over columns, broadcasting scalar arguments.
+
+    The results are a NumPy array if vectorized is true, so that they can be
+    combined with the other columns by the NumPy operators.
+    '''
+    def apply(*args):
+        columns = [arg for arg in args if is_column(arg)]
+        if not columns:
+            return func(*args)
+        size = len(columns[0])
+        args = [arg if is_column(arg) else itertools.repeat(arg, size) for arg in args]
+        return to_array(list(map(func, *args)), vectorized)
+    return apply
+
+
+class ColumnCompiler(object):
+    '''
+    Column expression compiler.
+
+    Compiles an expression into a function of a column, resolving
+    operators and functions to their vectorized (NumPy) equivalents if
+    vectorized is true and to elementwise ones otherwise.
+    '''
+
+    def __init__(self, evaluator, name='x', vectorized=False):
+        self.evaluator = evaluator
+        self.name = name
+        self.vectorized = vectorized
+
+    def _get_op(self, operator):
+        op = self.evaluator._get_op(operator)
+        op = array_operators.get(op, op)
+        if self.vectorized:
+            return op
+        return elementwise(op)
+
+    def _compile_name(self, operator):
+        if operator.id == self.name:
+            return lambda column: column
+        value = self.evaluator._eval_op(operator)
+        return lambda column: value
+
+    def _compile_func(self, operator):
+        name = operator.func.id
+        if name in self.evaluator.user_functions:
+            # user functions are called per element
+            func = elementwise(self.evaluator.user_functions[name].call, self.vectorized)
+            args = [self.compile(arg) for arg in operator.args]
+            return lambda column: func(*[arg(column) for arg in args])
+        if name not in self.evaluator.functions:
+            raise NameError('function \'%s\' is not defined' % name)
+        if not self.evaluator._is_pure_func(name):
+            raise ValueError('cannot vectorize function \'%s\' with side effects' % name)
+        func_wrapper = self.evaluator.functions[name]
+        if func_wrapper.get('lazy') or func_wrapper.get('reduce'):
+            return self._compile_scalar(operator)
+
+        func = array_functions.get(name) if self.vectorized else None
+        if func is None:
+            func = elementwise(self.evaluator._get_func(name), self.vectorized)
+        args = [self.compile(arg) for arg in operator.args]
+        return lambda column: func(*[arg(column) for arg in args])
+
+    def _compile_scalar(self, op):
+        ''' Compile op with the scalar compiler, it is evaluated once per value of the column. '''
+        compiled = self.evaluator._compile_op(op)
+        name = self.name
+        vectorized = self.vectorized
+
+        def scalar(column):
+            scope = dict(self.evaluator.variables)
+            results = []
+            for value in column:
+                scope[name] = value
+                results.append(compiled(scope))
+            return to_array(results, vectorized)
+        return scalar
+
+    def compile(self, op):
+        ''' Compile expression operator into a function of the column. '''
+        if isinstance(op, ast.Num):
+            value = op.n
+            return lambda column: value
+        elif isinstance(op, ast.UnaryOp):
+            unary_op = self._get_op(op)
+            operand = self.compile(op.operand)
+            return lambda column: unary_op(operand(column))
+        elif isinstance(op, ast.BinOp):
+            binary_op = self._get_op(op)
+            left = self.compile(op.left)
+            right = self.compile(op.right)
+            return lambda column: binary_op(left(column), right(column))
+        elif isinstance(op, ast.Name):
+            return self._compile_name(op)
+        elif isinstance(op, ast.Call):
+            return self._compile_func(op)
+        else:
+            raise SyntaxError('unknown operator \'%s\'' % op)
+
+
+def map_column(evaluator, expr, column, name='x'):
+    '''
+    Evaluate expr with name bound to each value of column.
+
+    Returns the results as a list of plain Python numbers.
+    '''
+    try:
+        tree = ast.parse(expr.strip(), mode='eval')
+    except SyntaxError:
+        raise SyntaxError('invalid syntax')
+    vectorized = can_vectorize(column)
+    compiled = ColumnCompiler(evaluator, name, vectorized).compile(tree.body)
+
+    column = to_array(column, vectorized)
+    if vectorized:
+        with numpy.errstate(divide='raise', invalid='raise', over='raise'):
+            result = compiled(column)
+    else:
+        result = compiled(column)
+
+    if not is_column(result):
+        return [result] * len(column)
+    if vectorized:
+        return numpy.broadcast_to(result, column.shape).tolist()
+    return list(result)
@@ -16,5 +16,5 @@ setup(
     entry_points={
         'console_scripts': ['jc = jc.cli:main',],
     },
-    python_requires='>=2.7',
+    python_requires='>=3.7',
 )
@@ -1,6 +1,16 @@
+import contextlib
+import io
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 
 import jc
+from jc import vector
 
 
 class EvalTestCase(unittest.TestCase):
@@ -124,6 +134,22 @@ class MultiExprTest(EvalTestCase):
         r = self.e.eval('x = 2; x ** 8; a = 4; x ** a')
         self.assertEqual(r, [256, 16])
 
+    def test_long_script(self):
+        r = self.e.eval(';'.join(['a = 1'] + ['a + %d' % i for i in range(5000)]))
+        self.assertEqual(len(r), 5000)
+        self.assertEqual(r[-1], 5000)
+
+    def test_iter_eval(self):
+        g = self.e.iter_eval('1; a = 2; # comment; a * 2; 1 +')
+        self.assertEqual(next(g), 1)
+        self.assertEqual(next(g), 4)
+        with self.assertRaises(SyntaxError):
+            next(g)
+
+    def test_split_exprs(self):
+        r = list(jc.split_exprs('1; (2; 3); max(1;2)'))
+        self.assertEqual(r, ['1', ' (2; 3)', ' max(1;2)'])
+
 
 class FunctionTest(EvalTestCase):
 
@@ -179,6 +205,43 @@ class FunctionTest(EvalTestCase):
         r = self.e.eval('round(9.501)')
         self.assertEqual(r, [10])
 
+    def test_ackermann(self):
+        r = self.e.eval('A(0, 0); A(1, 2); A(2, 3); A(3, 6); A(3, 10); A(4, 1)')
+        self.assertEqual(r, [1, 4, 9, 509, 8189, 65533])
+        r = self.e.eval('A(4, 2) - (2 ** 65536 - 3)')
+        self.assertEqual(r, [0])
+        with self.assertRaises(ValueError):
+            self.e.eval('A(-1, 1)')
+        with self.assertRaises(ValueError):
+            self.e.eval('A(1.5, 2)')
+        self.assertEqual(self.e.eval('A(2.0, 3)'), [9])
+
+    def test_number_theory(self):
+        r = self.e.eval('powmod(2, 10 ** 18, 10 ** 9 + 7); powmod(3, -1, 11); binom(50, 20); binom(5, 7)')
+        self.assertEqual(r, [pow(2, 10 ** 18, 10 ** 9 + 7), 4, 47129212243960, 0])
+        r = self.e.eval('gcd(12, 18, 27); lcm(4, 6, 10); isqrt(10 ** 40 + 5); modinv(3, 11)')
+        self.assertEqual(r, [3, 60, 10 ** 20, 4])
+        r = self.e.eval('fib(0); fib(10); fib(-4); fib(1000) % 1000; fib(10 / 2)')
+        self.assertEqual(r, [0, 55, -3, 875, 5])
+        with self.assertRaises(ValueError):
+            self.e.eval('modinv(4, 10)')
+        with self.assertRaises(ValueError):
+            self.e.eval('fib(1.5)')
+
+    def test_isprime(self):
+        sieve = [0, 0] + [1] * 2998
+        for i in range(2, 55):
+            if sieve[i]:
+                sieve[i * i::i] = [0] * len(sieve[i * i::i])
+        self.assertEqual([jc.numtheory.isprime(i) for i in range(3000)], sieve)
+        # strong pseudoprime to bases 2, 3, 5 and 7, Mersenne primes and a semiprime
+        r = self.e.eval('isprime(3215031751); isprime(2 ** 521 - 1); isprime(2 ** 607 - 1); '
+                        'isprime((2 ** 89 - 1) * (2 ** 107 - 1))')
+        self.assertEqual(r, [0, 1, 1, 0])
+        # strong Lucas pseudoprimes are caught by the Miller-Rabin part of Baillie-PSW
+        self.assertTrue(jc.numtheory.is_strong_lucas_probable_prime(5459))
+        self.assertFalse(jc.numtheory.is_strong_probable_prime(5459, 2))
+
     def test_ln(self):
         r = self.e.eval('ln(1)')
         self.assertEqual(r, [0])
@@ -193,6 +256,145 @@ class FunctionTest(EvalTestCase):
             r = self.e.eval('ln(0)')
 
 
+class SeriesTest(EvalTestCase):
+
+    def test_closed_forms(self):
+        from jc import series
+        n = 10 ** 6
+        self.assertEqual(self.e.eval('sum(i ** 2, i, 1, %d)' % n), [n * (n + 1) * (2 * n + 1) // 6])
+        for body, a, b in [('(i + 1) * (i - 2) ** 3 - 7', -5, 12), ('i*i*i + 2*i', 3, 3), ('i ** 5', -4, 9)]:
+            self.assertEqual(self.e.eval('sum(%s, i, %d, %d)' % (body, a, b)),
+                             [sum(eval(body) for i in range(a, b + 1))])
+            self.assertEqual(self.e.eval('min(%s, i, %d, %d); max(%s, i, %d, %d)' % (body, a, b, body, a, b)),
+                             [min(eval(body) for i in range(a, b + 1)), max(eval(body) for i in range(a, b + 1))])
+        self.assertEqual(self.e.eval('prod(i, i, 5, 10); prod(i, i, -5, -2); prod(i, i, -1, 3); prod(3, k, 1, 4)'),
+                         [151200, 120, 0, 81])
+        self.assertEqual(self.e.eval('min(i ** 2 - 5 * i, i, -10, 10); max(-(i - 3) ** 2, i, -10, 10)'), [-6, 0])
+        self.assertEqual(series.polynomial(self.e._parse('(i + 1) ** 2 - i'), 'i'), [1, 1, 1])
+        self.assertIsNone(series.polynomial(self.e._parse('i / 2'), 'i'))
+
+    def test_loop(self):
+        self.assertEqual(self.e.eval('sum(0.1, i, 1, 10)'), [1])
+        self.assertEqual(self.e.eval('sum(1 / i, i, 1, 4); prod(i + 0.5, i, 1, 2)'), [2.0833333333333335, 3.75])
+        self.assertEqual(self.e.eval('n = 4; sum(sum(j * i, j, 1, i), i, 1, n)'), [65])
+        self.assertEqual(self.e.eval('max(sin(i), i, 0, 10)'), [0.9893582466233818])
+        self.assertEqual(self.e.eval('sum(i, i, 5, 4); prod(i, i, 5, 4)'), [0, 1])
+        # the index does not leak into or clobber the session
+        self.assertEqual(self.e.eval('i = 100; sum(i * i + i * i, i, 1, 3); i'), [28, 100])
+        with self.assertRaises(ValueError):
+            self.e.eval('min(i, i, 5, 4)')
+        with self.assertRaises(ValueError):
+            self.e.eval('sum(i, i, 1, 2.5)')
+        with self.assertRaises(SyntaxError):
+            self.e.eval('sum(i, 1, 2)')
+        with self.assertRaises(jc.NamespaceError):
+            self.e.eval('sum(pi, pi, 1, 2)')
+
+    def test_scope(self):
+        self.e.eval('k = 2; t := sum(k * i, i, 1, 3)')
+        self.assertEqual(self.e.formulas['t'].deps, set(['k']))
+        self.assertEqual(self.e.eval('t; k = 3; t'), [12, 18])
+        self.assertEqual(self.e.compile('sum(x * i, i, 1, n)').variables, ('x', 'n'))
+
+    def test_budget(self):
+        e = jc.Evaluator(completer=None, budget=jc.Budget(max_bits=10000, max_time=0.2))
+        with self.assertRaises(jc.BudgetError):
+            e.eval('prod(i, i, 1, 100000)')
+        with self.assertRaises(jc.BudgetError):
+            e.eval('sum(sqrt(i), i, 1, 10 ** 9)')
+
+
+class UserFunctionTest(EvalTestCase):
+
+    def test_define(self):
+        self.assertEqual(self.e.eval('f(x, y) = x ** 2 + y; f(3, 1); f(f(1, 1), 0) * 2'), [10, 8])
+        self.assertEqual(self.e.eval('k = 2; g() = k * 3; g(); k = 5; g()'), [6, 15])
+        self.e.eval('delete(g)')
+        with self.assertRaises(NameError):
+            self.e.eval('g()')
+        e = jc.Evaluator()
+        e.eval('h(x) = x')
+        self.assertIn('h(', e.completer.content)
+        e.eval('delete(h)')
+        self.assertNotIn('h(', e.completer.content)
+
+    def test_recursion(self):
+        self.e.eval('fact2(n) = cond(n, n * fact2(n - 1), 1)')
+        self.assertEqual(self.e.eval('fact2(20)'), [2432902008176640000])
+        self.assertEqual(self.e.eval('cond(0, 1 / 0, 2)'), [2])
+        with self.assertRaises(RuntimeError):
+            self.e.eval('fact2(1000)')
+        self.assertEqual(self.e.eval('fact2(3)'), [6])
+
+    def test_memo(self):
+        self.e.eval('@memo fib2(n) = cond(n * (n - 1), fib2(n - 1) + fib2(n - 2), n)')
+        self.assertEqual(self.e.eval('fib2(90)'), [2880067194370816120])
+        self.assertGreater(self.e.cache_info()['memo']['hits'], 80)
+        with self.assertRaises(ValueError):
+            self.e.eval('@memo m(x) = x * k')
+        # memoized results do not outlive the definitions of the functions called
+        self.e.eval('g(x) = x + 1; @memo m(x) = g(x) * 2')
+        self.assertEqual(self.e.eval('m(1); g(x) = x + 100; m(1)'), [4, 202])
+        self.e.eval('delete(g)')
+        with self.assertRaises(NameError):
+            self.e.eval('m(1)')
+        self.assertEqual(self.e.eval('g(x) = x; m(1)'), [2])
+        # nor do functions that read variables, directly or through others
+        with self.assertRaises(ValueError):
+            self.e.eval('g(x) = x * k')
+        with self.assertRaises(ValueError):
+            self.e.eval('h(x) = x * k; @memo n(x) = h(x)')
+        self.assertEqual(self.e.eval('m(3)'), [6])
+
+    def test_inline(self):
+        self.e.eval('sq(x) = x * x; f(x) = sq(x) + 1')
+        self.assertEqual(self.e.optimize('sq(y + 1) + sq(2)'), '$0 * $0 + 4 where $0 = y + 1')
+        self.assertEqual(self.e.optimize('f(y)'), 'f(y)')
+        # arguments of unused parameters are still evaluated
+        self.e.eval('one(x) = 1')
+        self.assertEqual(self.e.optimize('one(y)'), 'one(y)')
+        with self.assertRaises(ZeroDivisionError):
+            self.e.eval('one(1 / 0)')
+        # polynomial bodies keep their closed forms
+        self.assertEqual(self.e.eval('sum(sq(i), i, 1, 10 ** 6)'), [333333833333500000])
+        # redefinitions apply to compiled expressions, formulas and other functions
+        self.e.eval('y = 3; t := sq(y); t; f(y)')
+        self.assertEqual(self.e.eval('sq(x) = x + 100; sq(1); t; f(3)'), [101, 103, 104])
+        # and to formulas calling a function that was deleted and defined again
+        self.e.eval('delete(sq)')
+        with self.assertRaises(NameError):
+            self.e.eval('t')
+        self.assertEqual(self.e.eval('sq(x) = x + 1; y = 4; t'), [5])
+
+    def test_errors(self):
+        self.e.eval('f(x, y) = x + y')
+        for expr, error in [('f(1)', TypeError), ('f = 1', jc.NamespaceError),
+                            ('sqrt(x) = 1', jc.NamespaceError), ('h(x, x) = x', SyntaxError),
+                            ('h(x) = base(x)', ValueError), ('h(x) = y(x)', NameError),
+                            ('f', TypeError)]:
+            with self.assertRaises(error):
+                self.e.eval(expr)
+        # a failed definition keeps the previous one
+        with self.assertRaises(SyntaxError):
+            self.e.eval('f(x, y) = x +')
+        self.assertEqual(self.e.eval('f(1, 2)'), [3])
+
+    def test_clone(self):
+        self.e.eval('k = 1; f(x) = x + k')
+        clone = self.e.clone()
+        clone.eval('k = 10; f(x) = x * k')
+        self.assertEqual(clone.eval('f(2)'), [20])
+        self.assertEqual(self.e.eval('f(2)'), [3])
+        # resetting a copy recompiles functions only if their definitions differ
+        clone = self.e.clone()
+        call = clone.user_functions['f'].call
+        clone._copy_state(self.e)
+        self.assertIs(clone.user_functions['f'].call, call)
+        clone.eval('f(x) = x * 2')
+        clone._copy_state(self.e)
+        self.assertEqual(clone.eval('f(2)'), [3])
+
+
 class BaseTest(EvalTestCase):
 
     def test_input_base(self):
@@ -207,10 +409,10 @@ class BaseTest(EvalTestCase):
 
     def test_output_base(self):
         r = self.e.eval('base(2); 10')
-        self.assertEqual(r, [1010])
+        self.assertEqual(r, ['1010'])
 
         r = self.e.eval('base(8); 10')
-        self.assertEqual(r, [12])
+        self.assertEqual(r, ['12'])
 
         r = self.e.eval('base(10); 10')
         self.assertEqual(r, [10])
@@ -218,15 +420,98 @@ class BaseTest(EvalTestCase):
         r = self.e.eval('base(16); 10')
         self.assertEqual(r, ['a'])
 
+        r = self.e.eval('base(36); 35; -71; base(3); 10.5')
+        self.assertEqual(r, ['z', '-1z', '101'])
+
+        with self.assertRaises(ValueError):
+            self.e.eval('base(37)')
+        with self.assertRaises(ValueError):
+            self.e.eval('base(1)')
+
     def test_multi_base(self):
         r = self.e.eval('base(2); 10; base(8); 10; base(10); 10; base(16); 10')
-        self.assertEqual(r, [1010, 12, 10, 'a'])
+        self.assertEqual(r, ['1010', '12', 10, 'a'])
 
         r = self.e.eval('base(2); 0; base(8); 0; base(10); 0; base(16); 0')
-        self.assertEqual(r, [0, 0, 0, '0'])
+        self.assertEqual(r, ['0', '0', 0, '0'])
 
         r = self.e.eval('base(2); 10; base(10); base(2); 15')
-        self.assertEqual(r, [1010, 1111])
+        self.assertEqual(r, ['1010', '1111'])
+
+    def test_large_output(self):
+        r = self.e.eval('base(7); 7 ** 5000 - 1; -7 ** 5000')
+        self.assertEqual(str(r[0]), '6' * 5000)
+        self.assertEqual(str(r[1]), '-1' + '0' * 5000)
+        r = self.e.eval('base(10); 10 ** 10000')
+        self.assertEqual(r, [10 ** 10000])
+
+    def test_radix(self):
+        import random
+        for base in range(2, 37):
+            for bits in (0, 1, 100, 1024, 1025, 5000):
+                n = random.getrandbits(bits) if bits else 0
+                for leaf_bits in (16, 1024):
+                    digits = ''.join(jc.radix.iter_digits(-n, base, leaf_bits=leaf_bits))
+                    self.assertEqual(int(digits, base), -n)
+
+
+class FormulaTest(EvalTestCase):
+
+    def test_formula(self):
+        r = self.e.eval('a = 2; b = 3; c = 1; total := a * b + c; total')
+        self.assertEqual(r, [7])
+        r = self.e.eval('a = 10; total; double := total * 2; double; c = 0; double')
+        self.assertEqual(r, [31, 62, 60])
+        r = self.e.eval('total = 5; double; a = 1; double')
+        self.assertEqual(r, [10, 10])
+
+    def test_lazy(self):
+        self.e.eval('a = 2; sq := sqrt(a) + a')
+        formula = self.e.formulas['sq']
+        self.assertTrue(formula.dirty)
+        self.e.eval('sq')
+        self.assertFalse(formula.dirty)
+        self.e.eval('b = 1')
+        self.assertFalse(formula.dirty)
+        self.e.eval('a = 4')
+        self.assertTrue(formula.dirty)
+        self.assertEqual(self.e.eval('sq'), [6])
+
+    def test_errors(self):
+        self.e.eval('x := y + 1; y := z * 2')
+        with self.assertRaises(ValueError):
+            self.e.eval('z := x - 1')
+        with self.assertRaises(ValueError):
+            self.e.eval('w := w + 1')
+        with self.assertRaises(ValueError):
+            self.e.eval('w := ans + 1')
+        with self.assertRaises(ValueError):
+            self.e.eval('w := base(16)')
+        with self.assertRaises(NameError):
+            self.e.eval('x')
+        self.assertEqual(self.e.eval('z = 3; x'), [7])
+        with self.assertRaises(jc.NamespaceError):
+            self.e.eval('pi := 3')
+
+    def test_delete(self):
+        self.e.eval('a = 2; f := a * 3; f; delete(a)')
+        with self.assertRaises(NameError):
+            self.e.eval('f')
+        self.e.eval('a = 5; delete(f)')
+        with self.assertRaises(NameError):
+            self.e.eval('f')
+
+    def test_clone(self):
+        self.e.eval('a = 2; f := a * 3')
+        clone = self.e.clone()
+        clone.eval('a = 5')
+        self.assertEqual(clone.eval('f'), [15])
+        self.assertEqual(self.e.eval('f'), [6])
+        self.e.eval('b := a + 1; c := b * 10')
+        clone = self.e.clone()
+        clone.eval('a = 5')
+        self.assertEqual(clone.eval('c'), [60])
+        self.assertEqual(self.e.eval('c'), [30])
 
 
 class AnsTest(EvalTestCase):
@@ -296,5 +581,807 @@ class BitwiseTest(EvalTestCase):
         self.assertEqual(r, [0])
 
 
+class ParserTest(unittest.TestCase):
+
+    def setUp(self):
+        import ast
+        from jc import parser
+        self.ast = ast
+        self.parser = parser
+
+    def assertSameTree(self, expr):
+        ast = self.ast
+        self.assertEqual(ast.dump(self.parser.parse(expr)), ast.dump(ast.parse(expr, mode='eval').body), expr)
+
+    def test_cross_check(self):
+        for expr in ['3*4+1', '-2**2', '2**-1**2', '2 ** 3 * 4 // 5 % 6 << 1 | 3 ^ 4 & ~5',
+                     '-2**-3**2*~4', '-(-a)--b', 'f()(1,)(g(2, 3), -(4))', '((x))', '1 + 2 ',
+                     '0x_ff + 0o17 + 0B101 + 1_000 + 1.5e-3j + .5 + 1. + 2E+3 + 00 + 7J',
+                     'sqrt(x) * 2 + sin(pi / 4) ** 2', 'a >> 2 << b', '- - + ~x']:
+            self.assertSameTree(expr)
+
+    def test_random(self):
+        import random
+        rand = random.Random(42)
+        atoms = ['1', '23', '4.5', '0x1f', '1e3', '2j', 'x', 'pi', '_y1']
+        def expr(depth):
+            choice = rand.randrange(6 if depth else 1)
+            if choice == 0:
+                return rand.choice(atoms)
+            if choice == 1:
+                return rand.choice('-+~') + expr(depth - 1)
+            if choice == 2:
+                return '(%s)' % expr(depth - 1)
+            if choice == 3:
+                args = [expr(depth - 1) for _ in range(rand.randrange(3))]
+                return 'f(%s)' % ', '.join(args)
+            op = rand.choice(list(self.parser.binary_ops))
+            return expr(depth - 1) + rand.choice(['', ' ']) + op + rand.choice(['', ' ']) + expr(depth - 1)
+        for _ in range(500):
+            self.assertSameTree(expr(5))
+
+    def test_fallback(self):
+        for expr in ['1 if 2 else 3', 'f(x=1)', '(1, 2)', 'x.y', '1 == 2', 'True', '012', '2pi',
+                     '1e', '1 +', 'f(,)', '# c', '[1]', 'a = 1', '"s"', 'not a']:
+            with self.assertRaises(self.parser.ParseError):
+                self.parser.parse(expr)
+        self.assertIsInstance(self.parser.parse_expr('1 if 2 else 3'), self.ast.IfExp)
+        with self.assertRaises(SyntaxError):
+            self.parser.parse_expr('1 +')
+
+    def test_parse_line(self):
+        statements = self.parser.parse_line(' a = 2 ;b:=a*3; f(1; 2); - 1;; x ')
+        self.assertEqual([(kind, name, text) for kind, name, _, text in statements],
+                         [('assign', 'a', 'a = 2'), ('formula', 'b', 'b:=a*3'),
+                          ('source', None, 'f(1; 2)'), ('source', None, '- 1'), ('expr', None, 'x')])
+        self.assertEqual(self.ast.dump(statements[1][2]), self.ast.dump(self.parser.parse('a*3')))
+
+
+class CompileTest(EvalTestCase):
+
+    def test_cached_compile(self):
+        r = self.e.eval('x = 2; x * 3; x = 4; x * 3')
+        self.assertEqual(r, [6, 12])
+        self.assertEqual(len(self.e._compiled), 3)
+        self.assertTrue(self.e._compiled.hits >= 1)
+
+    def test_cache_eviction(self):
+        e = jc.Evaluator(completer=None, cache_size=2)
+        r = e.eval('1 + 1; 2 + 2; 3 + 3; 1 + 1')
+        self.assertEqual(r, [2, 4, 6, 2])
+        self.assertEqual(len(e._compiled), 2)
+        self.assertNotIn('2 + 2', e._compiled)
+
+    def test_errors(self):
+        with self.assertRaisesRegex(SyntaxError, '^invalid syntax$'):
+            self.e.eval('1 +')
+        with self.assertRaisesRegex(NameError, 'variable \'y\' is not defined'):
+            self.e.eval('y + 1')
+        with self.assertRaisesRegex(NameError, 'function \'foo\' is not defined'):
+            self.e.eval('foo(1)')
+        with self.assertRaisesRegex(TypeError, 'cannot evaluate function label \'sqrt\''):
+            self.e.eval('sqrt + 1')
+        r = self.e.eval('y = 1; y + 1')
+        self.assertEqual(r, [2])
+
+
+class ExpressionTest(EvalTestCase):
+
+    def test_call(self):
+        expr = self.e.compile('a * b + sqrt(a)')
+        self.assertEqual(expr.variables, ('a', 'b'))
+        self.assertEqual(expr(a=4, b=3), 14)
+        self.assertEqual(expr(9, 2), 21)
+        self.assertEqual(expr(4, b=0), 2)
+
+    def test_map(self):
+        expr = self.e.compile('x ** 2 + pi * 0')
+        r = list(expr.map([(1,), (2,), {'x': 3}]))
+        self.assertEqual(r, [1, 4, 9])
+
+    def test_no_side_effects(self):
+        self.e.eval('y = 10')
+        expr = self.e.compile('x + y')
+        self.assertEqual(expr(x=1), 11)
+        self.assertEqual(expr(x=1, y=1), 2)
+        self.assertEqual(self.e.variables, {'y': 10})
+        self.assertIsNone(self.e.ans)
+
+    def test_user_functions(self):
+        self.e.eval('sq(x) = x * x')
+        expr = self.e.compile('sq(x) + 1')
+        self.assertEqual(expr(x=3), 10)
+        # calls of user functions follow their redefinitions
+        self.e.eval('sq(x) = x + 100')
+        self.assertEqual(expr(x=3), 104)
+
+    def test_errors(self):
+        expr = self.e.compile('x + 1')
+        with self.assertRaises(TypeError):
+            expr(z=1)
+        with self.assertRaises(TypeError):
+            expr(1, 2)
+        with self.assertRaises(NameError):
+            expr()
+        with self.assertRaises(SyntaxError):
+            self.e.compile('x = 1')
+        with self.assertRaises(ValueError):
+            self.e.compile('base(16)')
+        with self.assertRaises(ValueError):
+            self.e.compile('delete(x)')
+
+
+class OptimizerTest(EvalTestCase):
+
+    def test_fold(self):
+        self.assertEqual(self.e.optimize('2 * pi * r'), '%r * r' % (2 * 3.141592653589793))
+        self.assertEqual(self.e.optimize('sqrt(16) / 2 * x'), '2.0 * x')
+        self.assertEqual(self.e.optimize('-2 ** 2 + x'), '-4 + x')
+        self.assertEqual(self.e.optimize('base(2 * 8)'), 'base(16)')
+        self.assertEqual(self.e.optimize('help(pi)'), 'help(pi)')
+        # only the condition of a lazy function, its branches may never be evaluated
+        self.assertEqual(self.e.optimize('cond(2 - 1, x * (2 * 3), 2 ** 30 * 8)'),
+                         'cond(1, x * (2 * 3), 2 ** 30 * 8)')
+        self.assertEqual(self.e.eval('cond(1, 1, 10 ** 10 ** 10)'), [1])
+
+    def test_fold_error(self):
+        self.assertEqual(self.e.optimize('1 / 0 + x'), '1 / 0 + x')
+        with self.assertRaises(ZeroDivisionError):
+            self.e.eval('1 / 0')
+
+    def test_hoist(self):
+        r = self.e.optimize('sqrt(x + 1) / (x + 1)')
+        self.assertEqual(r, 'sqrt($0) / $0 where $0 = x + 1')
+        r = self.e.optimize('(a - b) * (a - b) - (c - (a - b))')
+        self.assertEqual(r, '$0 * $0 - (c - $0) where $0 = a - b')
+        r = self.e.optimize('base(x + 1) + base(x + 1)')
+        self.assertEqual(r, 'base($0) + base($0) where $0 = x + 1')
+        r = self.e.optimize('x * 0.0 + x * -0.0 + x * 0.0')
+        self.assertEqual(r, '$0 + x * -0.0 + $0 where $0 = x * 0.0')
+
+    def test_hoist_large(self):
+        # folded literals too large to convert to strings
+        r = self.e.eval('a = 5; (2 ** 20000 + a) % 7; (2 ** 20000 + a) * 0 + (2 ** 20000 + a) % 7')
+        self.assertEqual(r, [(2 ** 20000 + 5) % 7] * 2)
+        # compile time grows linearly with the size of the expression
+        start = time.time()
+        self.e.compile(' + '.join(['x * 2'] * 400))
+        self.assertLess(time.time() - start, 1)
+
+    def test_eval(self):
+        r = self.e.eval('a = 3; b = 1; (a - b) ** (a - b) + 2 * pi * 0 + sqrt(a - b) ** 2')
+        self.assertAlmostEqual(r[0], 6)
+        expr = self.e.compile('(x + 1) * (x + 1)')
+        self.assertEqual(list(expr.map([(1,), (2,)])), [4, 9])
+
+
+class MemoTest(EvalTestCase):
+
+    def test_memo(self):
+        r = self.e.eval('x = 500; fact(x) // fact(x - 1); fact(x) // fact(x - 2)')
+        self.assertEqual(r, [500, 500 * 499])
+        info = self.e.cache_info()['memo']
+        self.assertEqual((info['hits'], info['misses']), (1, 3))
+        self.assertEqual(info['size'], 3)
+
+    def test_memo_types(self):
+        self.e.eval('x = 4')
+        self.assertEqual(self.e.eval('nrt(2, x)'), [2])
+        self.assertEqual(self.e.eval('x = 4.0; nrt(2, x)'), [2])
+        self.assertEqual(self.e.cache_info()['memo']['misses'], 2)
+
+    def test_memo_bytes(self):
+        e = jc.Evaluator(completer=None, memo_bytes=2000)
+        r = e.eval('x = 1000; fact(x) - fact(x); fact(x + 1) - fact(x + 1)')
+        self.assertEqual(r, [0, 0])
+        info = e.cache_info()['memo']
+        self.assertEqual(info['size'], 1)
+        self.assertTrue(info['bytes'] <= 2000)
+
+    def test_lru_cache(self):
+        c = jc.LRUCache(maxsize=2)
+        c.put('a', 1)
+        c.put('b', 2)
+        self.assertEqual(c.get('a'), 1)
+        c.put('c', 3)
+        self.assertEqual((c.get('a'), c.get('b'), c.get('c')), (1, None, 3))
+        self.assertEqual((c.hits, c.misses), (3, 1))
+
+
+class BudgetTest(unittest.TestCase):
+
+    def test_max_bits(self):
+        e = jc.Evaluator(completer=None, budget=jc.Budget(max_bits=10000))
+        for expr in ('2 ** 10 ** 10', '1 << 10 ** 12', 'fact(10 ** 7)', 'A(4, 3)',
+                     'x = 2 ** 5000; x * x * x', 'fib(10 ** 6)', 'binom(10 ** 6, 5 * 10 ** 5)'):
+            with self.assertRaises(jc.BudgetError):
+                e.eval(expr)
+        r = e.eval('2 ** 9999 - 2 ** 9999 + 1; 1 << 100 >> 99; fact(100) % 7; 2.5 ** 100 / 2.5 ** 99; '
+                   'powmod(3, 10 ** 100, 1009)')
+        self.assertEqual(r, [1, 2, 0, 2.5, pow(3, 10 ** 100, 1009)])
+
+    def test_max_memory(self):
+        e = jc.Evaluator(completer=None, budget=jc.Budget(max_memory=1000))
+        with self.assertRaises(jc.BudgetError):
+            e.eval('1 << 10 ** 5')
+        self.assertEqual(e.eval('1 << 10 >> 10'), [1])
+
+    def test_max_time(self):
+        e = jc.Evaluator(completer=None, budget=jc.Budget(max_time=0.01))
+        with self.assertRaises(jc.BudgetError):
+            e.eval('3 ** 10 ** 8')
+        with self.assertRaises(jc.BudgetError):
+            e.eval('fact(10 ** 6)')
+        self.assertEqual(e.eval('3 ** 100 % 2'), [1])
+
+    def test_no_budget(self):
+        e = jc.Evaluator(completer=None)
+        self.assertEqual(e.eval('2 ** 20000 // 2 ** 19999'), [2])
+
+
+class SessionTest(EvalTestCase):
+
+    def test_shared_tables(self):
+        e = jc.Evaluator(completer=None)
+        self.assertIs(e.functions, self.e.functions)
+        self.assertIs(e.constants, self.e.constants)
+        self.assertFalse(hasattr(e, '__dict__'))
+
+    def test_isolation(self):
+        e = jc.Evaluator(completer=None)
+        self.e.eval('a = 1; base(16); 255')
+        self.assertEqual(e.eval('base(10); 255'), [255])
+        with self.assertRaises(NameError):
+            e.eval('a')
+        self.assertEqual(self.e.eval('a + 254'), ['ff'])
+
+    def test_clone(self):
+        self.e.eval('a = 1; b = 2; base(2); 3')
+        clone = self.e.clone()
+        self.assertEqual(clone.eval('a + b; ans'), ['11', '11'])
+        clone.eval('a = 10; delete(b); base(10)')
+        self.assertEqual(clone.eval('a'), [10])
+        with self.assertRaises(NameError):
+            clone.eval('b')
+        self.assertEqual(self.e.eval('a; b'), ['1', '10'])
+        self.assertEqual(self.e.ans, 2)
+
+    def test_snapshot(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.e.eval('a = 3 ** 5000; b = 1.5; c = 2 + 1j; f := a % 7 + b; base(16); 10')
+            self.e.eval('g(x) = x; h(x) = x + a % 5; g(x) = h(x) + 1')
+            self.e.save_session(path)
+            e = jc.Evaluator(completer=None)
+            e.eval('old = 1')
+            e.load_session(path)
+            self.assertEqual(e.variables, self.e.variables)
+            self.assertEqual(e.ans, 10)
+            self.assertEqual(e.eval('ans; f; a = 1; f'), ['a', '3', '2'])
+            self.assertEqual(e.eval('g(10)'), ['c'])
+            with self.assertRaises(NameError):
+                e.eval('old')
+
+            from jc import session
+            with open(path, 'rb') as f:
+                data = f.read()
+            for bad in (data[:-1] + b'x', data[:4] + b'\x09' + data[5:], b'garbage'):
+                with open(path, 'wb') as f:
+                    f.write(bad)
+                with self.assertRaises(session.SessionError):
+                    e.load_session(path)
+            self.assertEqual(e.eval('f'), ['2'])
+        finally:
+            os.remove(path)
+
+
+class CompleterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.e = jc.Evaluator(completer=lambda content: jc.Completer(content, history=False))
+        self.c = self.e.completer
+
+    def complete_all(self, text):
+        results = []
+        while True:
+            result = self.c.complete(text, len(results))
+            if result is None:
+                return results
+            results.append(result)
+
+    def test_complete(self):
+        self.assertEqual(self.complete_all('lo'), ['log(', 'log10(', 'log2('])
+        self.assertEqual(self.complete_all('p'), ['phi', 'pi', 'pmov(', 'powmod(', 'prod('])
+        self.assertEqual(self.complete_all('xyz'), [])
+        self.assertEqual(self.complete_all('ans'), ['ans'])
+
+    def test_variables(self):
+        self.e.eval('pa = 1; pa = 2; pb = 3')
+        self.assertEqual(self.complete_all('p'), ['pa', 'pb', 'phi', 'pi', 'pmov(', 'powmod(', 'prod('])
+        self.e.eval('delete(pa)')
+        self.assertEqual(self.complete_all('p'), ['pb', 'phi', 'pi', 'pmov(', 'powmod(', 'prod('])
+
+    def test_lazy(self):
+        created = []
+        def make_completer(content):
+            created.append(content)
+            return jc.Completer(content, history=False)
+        e = jc.Evaluator(completer=make_completer)
+        e.eval('pa = 1; pc := pa; pf(x) = x')
+        self.assertEqual(created, [])
+        self.assertIsNone(e.clone().completer)
+        # created on first access, with the names defined before
+        self.c = e.completer
+        self.assertEqual(self.complete_all('p'), ['pa', 'pc', 'pf(', 'phi', 'pi', 'pmov(', 'powmod(', 'prod('])
+        self.assertIs(e.clone().completer, self.c)
+
+    def test_large_vocabulary(self):
+        for i in range(10000):
+            self.c.add_content('v%05d' % i)
+        self.assertEqual(len(self.complete_all('v0999')), 10)
+        self.assertEqual(self.complete_all('v09999'), ['v09999'])
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        import readline
+        self.readline = readline
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+        self.readline.clear_history()
+
+    def read_lines(self):
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_append(self):
+        with open(self.path, 'w') as f:
+            f.write('1 + 1\n2 + 2\n')
+        c = jc.Completer(history_file=self.path, history_len=10)
+        self.assertEqual(self.readline.get_current_history_length(), 2)
+        self.readline.add_history('3 + 3')
+        c.save_history()
+        c.save_history()
+        self.assertEqual(self.read_lines(), ['1 + 1', '2 + 2', '3 + 3'])
+
+    def test_tail(self):
+        lines = ['%d' % i for i in range(15)]
+        self.assertEqual(jc.completer.read_tail(self.path, 5), ([], 0))
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.assertEqual(jc.completer.read_tail(self.path, 5, block_size=4)[0], lines[-5:])
+        self.assertEqual(jc.completer.read_tail(self.path, 50, block_size=4), (lines, 15))
+
+    def test_compact(self):
+        lines = ['%d' % i for i in range(25)]
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        jc.Completer(history_file=self.path, history_len=10)
+        self.assertEqual(self.read_lines(), lines[-10:])
+        self.assertEqual(self.readline.get_history_item(1), '15')
+
+
+class ScriptTest(EvalTestCase):
+
+    def setUp(self):
+        super(ScriptTest, self).setUp()
+        from jc import script
+        self.script = script
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.jc')
+        self.environ = dict(os.environ)
+        os.environ['JC_CACHE_DIR'] = os.path.join(self.dir, 'cache')
+        with open(self.path, 'w') as f:
+            f.write('# test\na = 2; b = a * 3\nt := a + b\nb * pi\n- 1\n2 +\n')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.dir)
+
+    def run_script(self, e):
+        results = []
+        for lineno, statements in self.script.load(e, self.path):
+            try:
+                results.extend(self.script.iter_eval(e, statements))
+            except SyntaxError:
+                results.append(lineno)
+        return results
+
+    def test_script(self):
+        self.assertEqual(self.run_script(self.e), [18.84955592153876, 17.84955592153876, 6])
+        self.assertEqual(self.e.eval('t'), [8])
+        kinds = [[statement[0] for statement in statements]
+                 for _, statements in self.script.load(self.e, self.path)]
+        self.assertEqual(kinds, [['assign', 'assign'], ['formula'], ['expr'], ['source'], ['source']])
+
+    def test_cache(self):
+        self.run_script(jc.Evaluator(completer=None))
+        self.assertEqual(len(os.listdir(os.environ['JC_CACHE_DIR'])), 1)
+        profiler = jc.Profiler()
+        e = jc.Evaluator(completer=None, profiler=profiler)
+        self.assertEqual(self.run_script(e), [18.84955592153876, 17.84955592153876, 6])
+        # only the formula and the statements kept as source are parsed again
+        self.assertEqual(profiler.stages['parse'][0], 3)
+
+        # a changed script gets its own cache entry
+        with open(self.path, 'a') as f:
+            f.write('b\n')
+        self.assertEqual(self.run_script(jc.Evaluator(completer=None))[-1], 6)
+        self.assertEqual(len(os.listdir(os.environ['JC_CACHE_DIR'])), 2)
+
+    def test_cache_state(self):
+        with open(self.path, 'w') as f:
+            f.write('a = 2 ** 100000 % 7\na\n')
+        self.assertEqual(self.run_script(jc.Evaluator(completer=None)), [2])
+        # the cached script is validated and folded again for each session and budget
+        e = jc.Evaluator(completer=None, budget=jc.Budget(max_bits=1000))
+        with self.assertRaises(jc.BudgetError):
+            self.run_script(e)
+        e = jc.Evaluator(completer=None)
+        e.eval('a(x) = x')
+        with self.assertRaises(jc.NamespaceError):
+            self.run_script(e)
+
+    def test_validate(self):
+        # assignments are checked against the functions defined by the script itself
+        with open(self.path, 'w') as f:
+            f.write('f(x) = x + 1\nf = 3\n')
+        with self.assertRaises(jc.NamespaceError):
+            self.run_script(self.e)
+        self.assertNotIn('f', self.e.variables)
+        self.assertEqual(self.e.eval('f(1)'), [2])
+
+
+class VectorTest(EvalTestCase):
+
+    def test_map(self):
+        r = self.e.map('x * 2 + 1', [1, 2, 3])
+        self.assertEqual(r, [3, 5, 7])
+        r = self.e.map('sqrt(x) + floor(x / 4)', [4, 16.0])
+        self.assertEqual(r, [3, 8])
+        r = self.e.map('2 ** 3', [1, 2])
+        self.assertEqual(r, [8, 8])
+
+    def test_functions(self):
+        column = [0.5, 1, 2.5, 10]
+        for func in ('sin', 'log', 'log10', 'exp', 'ceil', 'erf', 'gamma', 'cbrt'):
+            r = self.e.map('%s(x)' % func, column)
+            expected = [self.e.eval('%s(%s)' % (func, value))[0] for value in column]
+            for result, value in zip(r, expected):
+                self.assertAlmostEqual(result, value)
+
+    def test_variables(self):
+        self.e.eval('k = 3')
+        r = self.e.map('k * y + pi * 0', [1, 2], name='y')
+        self.assertEqual(r, [3, 6])
+        self.e.eval('f(x) = x * k + 1')
+        self.assertEqual(self.e.map('f(x) + 1', [1, 2]), [5, 8])
+
+    def test_column_unchanged(self):
+        column = [1, 2, 3]
+        r = self.e.map('(x & 1) + x', column)
+        self.assertEqual(r, [2, 2, 4])
+        self.assertEqual(column, [1, 2, 3])
+
+    def test_integers(self):
+        # integers never go through fixed width arrays
+        self.assertEqual(self.e.map('x ** 3', [3000000000]), [27 * 10 ** 27])
+        self.assertEqual(self.e.map('x * 2 ** 62 + x ** -1', [2, 4]), [2 ** 63 + 0.5, 2 ** 64 + 0.25])
+
+    @unittest.skipIf(vector.numpy is None, 'NumPy is not installed')
+    def test_numpy(self):
+        self.assertTrue(vector.can_vectorize([1.5, 2.0]))
+        self.assertFalse(vector.can_vectorize([1.5, 2]))
+        self.assertEqual(self.e.map('x ** -1 + sqrt(x)', [4.0, 16.0]), [2.25, 4.0625])
+        self.assertEqual(self.e.map('x ** 3', [3000000000, 1.5]), [2.7e28, 3.375])
+        # functions without a NumPy equivalent are combined with the NumPy operators
+        self.assertEqual(self.e.map('gamma(x) + 1', [1.5, 3.0]),
+                         [math.gamma(1.5) + 1, 3.0])
+        self.assertEqual(self.e.map('erf(x) * 2', [0.0, 0.5]), [0.0, math.erf(0.5) * 2])
+        self.assertEqual(self.e.map('erf(x) + erf(x)', [0.0, 0.5]), [0.0, math.erf(0.5) * 2])
+        self.e.eval('f(y) = y * 2')
+        self.assertEqual(self.e.map('f(x) - x', [1.5, 2.5]), [1.5, 2.5])
+
+    def test_scalar_functions(self):
+        self.assertEqual(self.e.map('cond(x, 1, 2)', [0, 3]), [2, 1])
+        self.assertEqual(self.e.map('sum(i, i, 1, x) + x', [3, 4.0]), [9, 14.0])
+        self.assertEqual(self.e.map('sum(i * x, i, 1, 2) + sqrt(x)', [4.0, 9.0]), [14.0, 30.0])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self.e.map('base(x)', [1])
+        with self.assertRaises(NameError):
+            self.e.map('x + y', [1])
+
+
+class BatchTest(EvalTestCase):
+
+    def test_is_independent(self):
+        from jc import batch
+        self.assertTrue(batch.is_independent(self.e, '1 + 2 * pi; sqrt(0x10)'))
+        self.assertTrue(batch.is_independent(self.e, '-1e5 + 2'))
+        self.assertFalse(batch.is_independent(self.e, 'a = 1'))
+        self.assertFalse(batch.is_independent(self.e, 'a + 1'))
+        self.assertFalse(batch.is_independent(self.e, '1; ans'))
+        self.assertFalse(batch.is_independent(self.e, '* 2'))
+        self.assertFalse(batch.is_independent(self.e, 'base(16)'))
+        self.assertFalse(batch.is_independent(self.e, 'vars()'))
+
+
+class CliTest(unittest.TestCase):
+
+    socket = os.path.join(tempfile.gettempdir(), 'jc-test-%d.sock' % os.getpid())
+    cache_dir = os.path.join(tempfile.gettempdir(), 'jc-test-cache-%d' % os.getpid())
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.cache_dir, ignore_errors=True)
+
+    def run_jc(self, args, stdin='', profile=None):
+        # never forward to a daemon the user may have running
+        env = dict(os.environ, JC_SOCKET=self.socket, JC_CACHE_DIR=self.cache_dir)
+        env.pop('JC_PROFILE', None)
+        if profile is not None:
+            env['JC_PROFILE'] = profile
+        p = subprocess.Popen([sys.executable, '-m', 'jc.cli'] + args,
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, universal_newlines=True, env=env)
+        out, err = p.communicate(stdin)
+        return p.returncode, out, err
+
+    def test_single(self):
+        r = self.run_jc(['1 + 2; 3 * 4'])
+        self.assertEqual(r, (0, '3\n12\n', ''))
+        r = self.run_jc(['--', '--5'])
+        self.assertEqual(r, (0, '5\n', ''))
+        r = self.run_jc(['10 ** 10000; base(16); 16 ** 5000'])
+        self.assertEqual(r, (0, '1' + '0' * 10000 + '\n1' + '0' * 5000 + '\n', ''))
+
+    def test_piped(self):
+        r = self.run_jc([], 'a = 2\na * 3\n\n/ 2; * 4\n')
+        self.assertEqual(r, (0, '6\n3\n12\n', ''))
+
+    def test_piped_error(self):
+        r = self.run_jc([], '1\n2 +\n3\n')
+        self.assertEqual(r, (1, '1\n', 'ERROR: invalid syntax\n'))
+        r = self.run_jc(['--keep-going'], '1\n2 +\n3\n')
+        self.assertEqual(r, (1, '1\n3\n', 'ERROR: line 2: invalid syntax\n'))
+
+    def test_map(self):
+        r = self.run_jc(['--map', 'sqrt(x) * 2'], '1\n4\n\n0x10\n2.25\n')
+        self.assertEqual(r, (0, '2\n4\n8\n3\n', ''))
+
+    def test_jobs(self):
+        stdin = ''.join('%d ** 2 + sqrt(%d); fact(5)\n' % (i, i) for i in range(200))
+        stdin += 'a = 2\na * 3\n* 2\nbase(16)\n255 + 1\nsqrt(-1)\n1 / 0\nans + 1\n'
+        sequential = self.run_jc(['--keep-going'], stdin)
+        parallel = self.run_jc(['--keep-going', '--jobs', '2'], stdin)
+        self.assertEqual(sequential[0], 1)
+        self.assertEqual(parallel, sequential)
+
+    def test_lazy_imports(self):
+        code = ('import sys; sys.argv = ["jc", "1 + 1"]; import jc.cli; jc.cli.main(); '
+                'sys.stderr.write(str(sorted(set(["readline", "traceback"]) & set(sys.modules))))')
+        p = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+        out, err = p.communicate()
+        self.assertEqual((out, err), ('2\n', '[]'))
+
+    def test_unknown_option(self):
+        r = self.run_jc(['--bogus', '1'])
+        self.assertEqual(r[0], 1)
+
+    def test_serve(self):
+        r = self.run_jc(['--session', 's', '1'])
+        self.assertEqual(r[0], 1)
+        r = self.run_jc(['--session', 's', '--max-bits', '10', '1'])
+        self.assertEqual(r, (1, '', 'ERROR: option \'--session\' cannot be combined with --max-bits\n'))
+        self.assertIn('requires an expression', self.run_jc(['--session', 's'])[2])
+        daemon = subprocess.Popen([sys.executable, '-m', 'jc.cli', '--serve', '--socket', self.socket])
+        try:
+            for _ in range(100):
+                if os.path.exists(self.socket):
+                    break
+                time.sleep(0.05)
+            self.assertEqual(self.run_jc(['--session', 's', 'a = 6']), (0, '', ''))
+            self.assertEqual(self.run_jc(['--session', 's', 'a * 7']), (0, '42\n', ''))
+            self.assertEqual(self.run_jc(['a']), (1, '', 'ERROR: variable \'a\' is not defined\n'))
+            self.assertEqual(self.run_jc(['1 + 2; 3 * 4']), (0, '3\n12\n', ''))
+        finally:
+            daemon.terminate()
+            daemon.wait()
+        self.assertFalse(os.path.exists(self.socket))
+
+    def test_jsonl(self):
+        stdin = '{"id": 1, "expr": "x * 2", "vars": {"x": 21}}\n\n{"id": "b", "expr": "1 / 0"}\n{"id": 3, "expr": "x"}\n'
+        r = self.run_jc(['--jsonl'], stdin)
+        self.assertEqual(r, (1, '{"id":1,"result":42}\n'
+                                '{"id":"b","error":{"type":"ZeroDivisionError","message":"division by zero"}}\n'
+                                '{"id":3,"error":{"type":"NameError","message":"variable \'x\' is not defined"}}\n', ''))
+
+    def test_profile(self):
+        import json
+        r = self.run_jc(['--profile', '-', 'x = 4; sqrt(x) + sqrt(x + 1)'])
+        self.assertEqual(r[0], 0)
+        self.assertEqual(r[1], '4.23606797749979\n')
+        stats = json.loads(r[2])
+        self.assertEqual(stats['functions']['sqrt']['calls'], 2)
+        self.assertEqual(stats['stages']['print']['calls'], 1)
+        self.assertIn('"stages"', self.run_jc(['1'], profile='1')[2])
+        for profile in ('0', ''):
+            self.assertEqual(self.run_jc(['1'], profile=profile), (0, '1\n', ''))
+        self.assertFalse(os.path.exists('0'))
+
+    def test_script(self):
+        fd, path = tempfile.mkstemp(suffix='.jc')
+        with os.fdopen(fd, 'w') as f:
+            f.write('a = 4\nsqrt(a)\nb\na * 2\n')
+        try:
+            r = self.run_jc(['-f', path, 'a + 1'])
+            self.assertEqual(r, (1, '2\n', 'ERROR: %s:3: variable \'b\' is not defined\n' % path))
+            r = self.run_jc(['--keep-going', '--file', path])
+            self.assertEqual(r[:2], (1, '2\n8\n'))
+            r = self.run_jc(['-f', path + '.missing'])
+            self.assertEqual(r[0], 1)
+        finally:
+            os.remove(path)
+
+    def test_session_file(self):
+        path = os.path.join(tempfile.gettempdir(), 'jc-test-%d.session' % os.getpid())
+        try:
+            r = self.run_jc(['--save', path, 'a = 2; t := a * 10'])
+            self.assertEqual(r, (0, '', ''))
+            r = self.run_jc(['--load', path, '--save', path, 'a = a + 1; t'])
+            self.assertEqual(r, (0, '30\n', ''))
+            r = self.run_jc(['--load', path], 'ans\na\n')
+            self.assertEqual(r, (0, '30\n3\n', ''))
+            with open(path, 'wb') as f:
+                f.write(b'stale')
+            r = self.run_jc(['--load', path, 'a'])
+            self.assertEqual(r[0], 1)
+            self.assertIn('failed to load session', r[2])
+        finally:
+            os.remove(path)
+
+
+class JsonlTest(unittest.TestCase):
+
+    def setUp(self):
+        from jc import jsonl
+        self.jsonl = jsonl
+        self.r = jsonl.RecordEvaluator(jc.Evaluator(completer=None))
+
+    def test_record(self):
+        r = self.r.eval_record({'id': 1, 'expr': 'a = x + y; a * 2', 'vars': {'x': 1, 'y': 2.5}})
+        self.assertEqual(r, {'id': 1, 'result': 7})
+        r = self.r.eval_record({'id': 2, 'expr': 'a'})
+        self.assertEqual(r['error']['type'], 'NameError')
+        r = self.r.eval_record({'id': 3, 'expr': 'a = 1'})
+        self.assertEqual(r, {'id': 3, 'result': None})
+        r = self.r.eval_record({'id': 4, 'expr': 'base(16); 255'})
+        self.assertEqual(r, {'id': 4, 'result': 'ff'})
+        r = self.r.eval_record({'id': 5, 'expr': '255'})
+        self.assertEqual(r, {'id': 5, 'result': 255})
+
+    def test_printed(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            r = [self.r.eval_record({'id': 1, 'expr': expr})
+                 for expr in ('help(sqrt)', '_version', 'a = 2; vars()', '_version; 3')]
+        self.assertEqual(out.getvalue(), '')
+        self.assertEqual([record['result'] for record in r],
+                         ['sqrt(x): square root of x', jc.__version__, 'a: 2', 3])
+
+    def test_invalid(self):
+        self.assertEqual(self.r.eval_line('{"id": 1')['error']['type'], 'RecordError')
+        self.assertEqual(self.r.eval_line('[1]')['error']['type'], 'RecordError')
+        self.assertEqual(self.r.eval_line('  \n'), None)
+        r = self.r.eval_record({'id': 1, 'expr': 'x', 'vars': {'x': 'a'}})
+        self.assertEqual(r['error'], {'type': 'RecordError', 'message': 'invalid value for variable \'x\''})
+        r = self.r.eval_record({'id': 1, 'expr': '1', 'vars': {'pi': 3}})
+        self.assertEqual(r['error']['type'], 'NamespaceError')
+
+    def test_buffered(self):
+        class Out(object):
+            writes = []
+            def write(self, text):
+                self.writes.append(text)
+            def flush(self):
+                pass
+        out = Out()
+        lines = ['{"id": %d, "expr": "%d ** 2"}' % (i, i) for i in range(1000)]
+        failed = self.jsonl.eval_lines(jc.Evaluator(completer=None), lines, out, buffer_size=4096)
+        self.assertEqual(failed, 0)
+        self.assertTrue(1 < len(out.writes) < 20)
+        output = ''.join(out.writes).splitlines()
+        self.assertEqual(output[-1], '{"id":999,"result":998001}')
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_stats(self):
+        profiler = jc.Profiler()
+        e = jc.Evaluator(completer=None, profiler=profiler)
+        e.eval('x = 2; sqrt(x) * 2; sqrt(x) * 2; fact(x + 3); fact(x + 3)')
+        stats = profiler.as_dict()
+        self.assertEqual(stats['stages']['parse']['calls'], 3)
+        self.assertEqual(stats['stages']['eval']['calls'], 4)
+        self.assertEqual(stats['functions']['sqrt']['calls'], 2)
+        # memoized
+        self.assertEqual(stats['functions']['fact']['calls'], 1)
+        self.assertEqual(stats['nodes']['Call'], 4)
+        self.assertIn('sqrt', profiler.format())
+
+    def test_disabled(self):
+        e = jc.Evaluator(completer=None)
+        with self.assertRaises(ValueError):
+            e.eval('stats()')
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        from jc import server
+        self.server = server.Server(jc.Evaluator(completer=None))
+
+    def test_sessions(self):
+        request = self.server.handle_request
+        self.assertEqual(request({'expr': 'a = 2; a * 3', 'session': 's'}), {'output': '6\n'})
+        self.assertEqual(request({'expr': 'a + ans', 'session': 's'}), {'output': '8\n'})
+        self.assertEqual(request({'expr': 'a = 5; base(16); 255', 'session': 't'}), {'output': 'ff\n'})
+        self.assertEqual(request({'expr': 'a', 'session': 's'}), {'output': '2\n'})
+
+    def test_scratch(self):
+        request = self.server.handle_request
+        self.assertEqual(request({'expr': 'a = 2; base(2); a'}), {'output': '10\n'})
+        self.assertEqual(request({'expr': '5'}), {'output': '5\n'})
+        self.assertEqual(request({'expr': 'a'}), {'output': '', 'error': 'variable \'a\' is not defined'})
+
+    def test_output(self):
+        request = self.server.handle_request
+        self.assertEqual(request({'expr': 'base()'}), {'output': '10\n'})
+        self.assertEqual(request({'expr': '1 +'}), {'output': '', 'error': 'invalid syntax'})
+        self.assertEqual(request([]), {'output': '', 'error': 'invalid request'})
+        self.assertEqual(request({'expr': 1}), {'output': '', 'error': 'invalid request'})
+        # large integers are written out as by the CLI
+        self.assertEqual(request({'expr': '10 ** 5000'}), {'output': '1' + '0' * 5000 + '\n'})
+
+    def test_budget(self):
+        from jc import server
+        response = self.server.handle_request({'expr': '9 ** 9 ** 9'})
+        self.assertIn('seconds', response['error'])
+        # the budget of the evaluator served, if any, is kept
+        s = server.Server(jc.Evaluator(completer=None, budget=jc.Budget(max_bits=100)))
+        response = s.handle_request({'expr': '2 ** 1000'})
+        self.assertIn('bits', response['error'])
+
+    def test_private(self):
+        import socket
+        from jc import server
+        path = os.path.join(tempfile.mkdtemp(), 'jc.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(path)
+            sock.listen(1)
+            os.chmod(path, 0o666)
+            # sockets others can connect to (or own) are never used
+            self.assertFalse(server.is_private(path))
+            self.assertIsNone(server.connect(path))
+            os.chmod(path, 0o600)
+            self.assertTrue(server.is_private(path))
+            client = server.connect(path)
+            self.assertIsNotNone(client)
+            client.close()
+        finally:
+            sock.close()
+            shutil.rmtree(os.path.dirname(path))
+
+
 if __name__ == '__main__':
     unittest.main()